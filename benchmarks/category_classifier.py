@@ -0,0 +1,58 @@
+"""
+Measure how many QA pairs per second the trained category classifier labels on CPU.
+
+Usage (from the repository root):
+    python -m benchmarks.category_classifier --num_items 10000
+"""
+import argparse
+import json
+import time
+
+from src.category_classifier import CategoryClassifier, read_labelled_qa
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the QA category classifier")
+    parser.add_argument("--classifier_dir", type=str, default=None,
+                        help="Saved classifier version (defaults to the latest one)")
+    parser.add_argument("--data_path", type=str, default="utils/submit_QA_sample/qa_database_updated.jsonl",
+                        help="Labelled QA pairs to repeat as input")
+    parser.add_argument("--num_items", type=int, default=10000, help="Number of QA pairs to categorize")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs; the fastest is reported")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    if args.classifier_dir:
+        classifier = CategoryClassifier.load(args.classifier_dir)
+    else:
+        classifier = CategoryClassifier.load_latest()
+    if classifier is None:
+        raise SystemExit("No category classifier found; train one with train_classifier.py")
+
+    texts, _, _ = read_labelled_qa([args.data_path])
+    qa_sets = [{"question": text.split("\n", 1)[0], "answer": text.split("\n", 1)[-1]} for text in texts]
+    qa_sets = (qa_sets * (args.num_items // len(qa_sets) + 1))[:args.num_items]
+
+    classifier.predict(qa_sets[:10])
+    timings = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        classifier.predict(qa_sets)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    result = {
+        "version": classifier.metadata.get("version"),
+        "items": len(qa_sets),
+        "seconds": best,
+        "items_per_second": len(qa_sets) / best if best else 0.0,
+    }
+    print(f"Categorized {result['items']} QA pairs in {best:.3f}s ({result['items_per_second']:.0f} items/s)")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare valid QA outputs per second with and without grammar-constrained decoding.
+
+Usage (from the repository root):
+    python -m benchmarks.constrained_decoding --num_abstracts 16 --output_path constrained.json
+"""
+import argparse
+import json
+import time
+
+import src.conf as conf
+from prompt.prompt_manager import PromptManager
+from src.model import ItriModel
+from src.qa_json import extract_qa
+from utils.load_abstract_db.file_readers import read_output_yaml_file
+
+
+def is_valid_qa(text: str) -> bool:
+    """A generation is valid when it parses as QA JSON with a non-empty question and answer."""
+    qa = extract_qa(text)
+    return qa is not None and bool(qa["question"].strip()) and bool(qa["answer"].strip())
+
+
+def run(model, prompts, batch_size, constrained, categories):
+    start = time.perf_counter()
+    outputs = model.generate_batch(
+        prompts,
+        batch_size=batch_size,
+        constrain_qa_json=constrained,
+        qa_categories=categories
+    )
+    elapsed = time.perf_counter() - start
+    valid = sum(is_valid_qa(text) for text in outputs)
+
+    return {
+        "constrained": constrained,
+        "outputs": len(outputs),
+        "valid": valid,
+        "valid_rate": valid / len(outputs) if outputs else 0.0,
+        "seconds": elapsed,
+        "valid_per_second": valid / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark constrained vs unconstrained QA decoding")
+    parser.add_argument("--model_name", type=str, default=conf.model_name, help="Name of the model to use")
+    parser.add_argument("--adapter_path", type=str, default=None, help="Adapter applied to the model")
+    parser.add_argument("--yaml_path", type=str, default="utils/load_abstract_db/output.yaml", help="Path to the YAML file")
+    parser.add_argument("--num_abstracts", type=int, default=16, help="Number of abstracts to generate for")
+    parser.add_argument("--batch_size", type=int, default=conf.batch_size, help="Number of abstracts generated per batch")
+    parser.add_argument("--with_category", action="store_true", help="Constrain a category enum as well")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    abstracts = [item["abstract"] for item in read_output_yaml_file(args.yaml_path) if item["abstract"]]
+    abstracts = abstracts[:args.num_abstracts]
+    prompt_manager = PromptManager()
+    prompts = [prompt_manager.render_prompt("llama3.2.j2", {"abstract": abstract}) for abstract in abstracts]
+    categories = ("method", "knowledge", "discussion") if args.with_category else None
+
+    model = ItriModel(args.model_name, args.adapter_path)
+    model.set_prompt_prefix(prompt_manager.render_prefix("llama3.2.j2", "abstract"))
+    # Warm up the prefix cache and the grammar masks so neither run pays one-off costs
+    model.generate(prompts[0], max_new_tokens=8, constrain_qa_json=True, qa_categories=categories)
+
+    results = [
+        run(model, prompts, args.batch_size, constrained=False, categories=categories),
+        run(model, prompts, args.batch_size, constrained=True, categories=categories),
+    ]
+    for result in results:
+        label = "constrained" if result["constrained"] else "unconstrained"
+        print(f"{label:>13}: {result['valid']}/{result['outputs']} valid in {result['seconds']:.1f}s "
+              f"({result['valid_per_second']:.3f} valid outputs/s)")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump({"model_name": args.model_name, "adapter_path": args.adapter_path, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Offline micro-benchmark of ItriModel generation on a tiny randomly initialized Llama.
+
+Builds a small Llama config and a byte-level BPE tokenizer locally with the
+test suite's `build_tiny_model` (nothing is downloaded), then times `generate_batch` over batch sizes, llama3.2.j2 prompt
+lengths and decoding settings, with and without the cached prompt prefix.
+Results are written as JSON; `--baseline` compares them against an earlier
+run and exits non-zero on regressions.
+
+Usage (from the repository root):
+    python -m benchmarks.generation --output_path generation.json
+    python -m benchmarks.generation --output_path new.json --baseline generation.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from prompt.prompt_manager import PromptManager
+from src.metrics import metrics
+from tests.conftest import build_tiny_model, synthetic_abstract
+
+DECODING = {
+    "greedy": {"do_sample": False, "num_beams": 1},
+    "beams4": {"do_sample": False, "num_beams": 4},
+    "sample": {"do_sample": True, "num_beams": 1, "temperature": 0.7, "top_k": 50, "top_p": 0.9, "seed": 0},
+}
+
+
+def cuda_peak_bytes(reset: bool = False):
+    """Peak CUDA memory allocated since the last reset, or None without CUDA."""
+    import torch
+    if not torch.cuda.is_available():
+        return None
+    if reset:
+        torch.cuda.reset_peak_memory_stats()
+    return torch.cuda.max_memory_allocated()
+
+
+def run_case(model, prompts, batch_size, decoding, max_new_tokens, repeats):
+    """Time `generate_batch` `repeats` times after one warm-up call and summarize the runs."""
+    # min_new_tokens keeps every run the same length; random weights rarely emit EOS anyway
+    kwargs = {**DECODING[decoding], "max_new_tokens": max_new_tokens, "min_new_tokens": max_new_tokens}
+    model.generate_batch(prompts[:batch_size], batch_size=batch_size, **kwargs)
+
+    cuda_peak_bytes(reset=True)
+    seconds, summaries = [], []
+    for _ in range(repeats):
+        metrics.reset()
+        start = time.perf_counter()
+        model.generate_batch(prompts, batch_size=batch_size, **kwargs)
+        seconds.append(time.perf_counter() - start)
+        summaries.append(metrics.summary())
+
+    latency = statistics.median(seconds)
+    tokens_in = summaries[-1]["counters"].get("model.tokens_in", 0)
+    tokens_out = summaries[-1]["counters"].get("model.tokens_out", 0)
+    prefill = statistics.median(s["timers"].get("model.prefill", {}).get("seconds", 0.0) for s in summaries)
+    decode = statistics.median(s["timers"].get("model.decode", {}).get("seconds", 0.0) for s in summaries)
+    return {
+        "latency_seconds": latency,
+        "latency_per_prompt_seconds": latency / len(prompts),
+        "prefill_seconds": prefill,
+        "decode_seconds": decode,
+        "prompt_tokens": tokens_in,
+        "new_tokens": tokens_out,
+        "tokens_per_second": tokens_out / latency if latency else 0.0,
+        "prefill_tokens_per_second": tokens_in / prefill if prefill else None,
+        "peak_rss_bytes": metrics.peak_rss_bytes(),
+        "cuda_peak_bytes": cuda_peak_bytes(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Flag cases that got slower than the baseline by more than `tolerance`.
+
+    Args:
+        results (dict): Output of this run.
+        baseline (dict): Output of an earlier run.
+        tolerance (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+
+    Returns:
+        list[str]: One message per regression.
+    """
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        if case["latency_seconds"] > old["latency_seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{case['name']}: latency {old['latency_seconds']:.3f}s -> {case['latency_seconds']:.3f}s "
+                f"({case['latency_seconds'] / old['latency_seconds'] - 1:+.0%})"
+            )
+        if old["tokens_per_second"] and case["tokens_per_second"] < old["tokens_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{case['name']}: {old['tokens_per_second']:.1f} -> {case['tokens_per_second']:.1f} tokens/s "
+                f"({case['tokens_per_second'] / old['tokens_per_second'] - 1:+.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ItriModel generation on a tiny local Llama")
+    parser.add_argument("--model_dir", type=str, default=None,
+                        help="Reuse (or create) the tiny model here instead of a temporary directory")
+    parser.add_argument("--backend", type=str, default="cpu", help="ItriModel backend")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8], help="Batch sizes to run")
+    parser.add_argument("--abstract_words", type=int, nargs="+", default=[150, 300],
+                        help="Abstract lengths in words, rendered into llama3.2.j2")
+    parser.add_argument("--decoding", type=str, nargs="+", default=list(DECODING), choices=list(DECODING),
+                        help="Decoding settings to run")
+    parser.add_argument("--num_prompts", type=int, default=8, help="Prompts generated per case")
+    parser.add_argument("--max_new_tokens", type=int, default=32, help="New tokens per prompt")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case; the median is reported")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    import torch
+    import transformers
+    from src.model import ItriModel
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        model_dir = args.model_dir or temporary_dir
+        if not os.path.exists(os.path.join(model_dir, "config.json")):
+            build_tiny_model(model_dir)
+        model = ItriModel(model_dir, backend=args.backend)
+
+    # Only the decoding settings below should vary between cases
+    model.stop_at_qa_json = False
+    model.constrain_qa_json = False
+
+    prompt_manager = PromptManager()
+    prefix = prompt_manager.render_prefix("llama3.2.j2", "abstract")
+    metrics.enable()
+
+    cases = []
+    for num_words in args.abstract_words:
+        rng = random.Random(num_words)
+        prompts = [
+            prompt_manager.render_prompt("llama3.2.j2", {"abstract": synthetic_abstract(num_words, rng)})
+            for _ in range(args.num_prompts)
+        ]
+        for use_prefix in (False, True):
+            if use_prefix:
+                model.set_prompt_prefix(prefix)
+            else:
+                model.prompt_prefix = None
+            for decoding in args.decoding:
+                for batch_size in args.batch_sizes:
+                    name = f"words{num_words}-{decoding}-bs{batch_size}" + ("-prefix" if use_prefix else "")
+                    case = run_case(model, prompts, batch_size, decoding, args.max_new_tokens, args.repeats)
+                    cases.append({"name": name, "abstract_words": num_words, "decoding": decoding,
+                                  "batch_size": batch_size, "prompt_prefix": use_prefix, **case})
+                    print(f"{name:>32}: {case['latency_seconds']:.3f}s, {case['tokens_per_second']:.1f} tokens/s, "
+                          f"prefill {case['prefill_seconds']:.3f}s, peak RSS {case['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "platform": platform.platform(),
+            "threads": torch.get_num_threads(),
+            "backend": args.backend,
+            "quantization": model.quantization,
+        },
+        "settings": {
+            "num_prompts": args.num_prompts,
+            "max_new_tokens": args.max_new_tokens,
+            "repeats": args.repeats,
+        },
+        "cases": cases,
+    }
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output_path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
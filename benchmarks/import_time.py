@@ -0,0 +1,96 @@
+"""
+Guard the import cost of the lightweight prompt and data paths.
+
+Each module is imported in a fresh interpreter; the run fails if an import
+exceeds the time budget or pulls in a heavy ML library.
+
+Usage (from the repository root):
+    python -m benchmarks.import_time --budget_ms 500
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules that render prompts, read data or start entry scripts without constructing a model
+LIGHT_MODULES = [
+    "src.conf",
+    "src.qa_json",
+    "src.qa_validation",
+    "src.registry",
+    "src.checkpoints",
+    "src.cache",
+    "src.categorize",
+    "src.category_classifier",
+    "src.client",
+    "src.metrics",
+    "src.planner",
+    "src.utils",
+    "prompt.prompt_manager",
+    "utils.load_abstract_db.file_readers",
+    "generate_QA",
+    "predict",
+    "export_model",
+    "train_classifier",
+    "model_server",
+    "qa_service",
+]
+
+HEAVY_MODULES = ["torch", "transformers", "peft", "bitsandbytes"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, repeats: int):
+    """Best-of-`repeats` import time of `module` in a fresh interpreter, plus any heavy modules it loaded."""
+    best, heavy = None, []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            return {"module": module, "error": completed.stderr.strip().splitlines()[-1]}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        best = result["seconds"] if best is None else min(best, result["seconds"])
+        heavy = result["heavy"]
+    return {"module": module, "seconds": best, "heavy": heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import time of the prompt/data paths")
+    parser.add_argument("--budget_ms", type=float, default=500, help="Maximum import time per module")
+    parser.add_argument("--repeats", type=int, default=3, help="Imports per module; the fastest is kept")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    results = [measure(module, args.repeats) for module in LIGHT_MODULES]
+    failures = 0
+    for result in results:
+        if "error" in result:
+            # Failing on a heavy library means the module tried to import it
+            failed = any(f"'{module}'" in result["error"] for module in HEAVY_MODULES)
+            failures += failed
+            print(f"{'FAIL' if failed else 'SKIP'} {result['module']}: {result['error']}")
+            continue
+        over_budget = result["seconds"] * 1000 > args.budget_ms
+        failed = over_budget or bool(result["heavy"])
+        failures += failed
+        note = f" loads {', '.join(result['heavy'])}" if result["heavy"] else ""
+        print(f"{'FAIL' if failed else 'ok  '} {result['module']:<40} {result['seconds'] * 1000:8.1f} ms{note}")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": results}, f, indent=2)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
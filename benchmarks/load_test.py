@@ -0,0 +1,92 @@
+"""
+Send concurrent QA requests to qa_service.py and report latency percentiles and throughput.
+
+Usage (from the repository root, with the service running):
+    python -m benchmarks.load_test --num_requests 200 --concurrency 32 --output_path load_test.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+
+import aiohttp
+
+import src.conf as conf
+from utils.load_abstract_db.file_readers import read_output_yaml_file
+
+
+def percentile(values: list, fraction: float):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+async def send(session, url, abstract, max_new_tokens, timeout):
+    start = time.perf_counter()
+    payload = {"abstract": abstract, "max_new_tokens": max_new_tokens, "timeout": timeout}
+    async with session.post(url + "/qa", json=payload) as response:
+        body = await response.json()
+    return {
+        "status": response.status,
+        "latency": time.perf_counter() - start,
+        "new_tokens": body.get("new_tokens", 0),
+        "valid": body.get("QA") is not None,
+    }
+
+
+async def run(url, abstracts, concurrency, max_new_tokens, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(session, abstract):
+        async with semaphore:
+            return await send(session, url, abstract, max_new_tokens, timeout)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(limited(session, abstract) for abstract in abstracts))
+        return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the continuous-batching QA service")
+    parser.add_argument("--url", type=str, default=conf.service_url, help="Base URL of qa_service.py")
+    parser.add_argument("--yaml_path", type=str, default="utils/load_abstract_db/output.yaml", help="Path to the YAML file")
+    parser.add_argument("--num_requests", type=int, default=100, help="Requests to send; abstracts are reused as needed")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once")
+    parser.add_argument("--max_new_tokens", type=int, default=None, help="New-token limit per request")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-request timeout sent to the service")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    abstracts = [item["abstract"] for item in read_output_yaml_file(args.yaml_path) if item["abstract"]]
+    abstracts = (abstracts * (args.num_requests // len(abstracts) + 1))[:args.num_requests]
+
+    results, elapsed = asyncio.run(run(args.url.rstrip("/"), abstracts, args.concurrency, args.max_new_tokens, args.timeout))
+    succeeded = [result for result in results if result["status"] == 200]
+    latencies = [result["latency"] for result in succeeded]
+    summary = {
+        "requests": len(results),
+        "succeeded": len(succeeded),
+        "timed_out": sum(result["status"] == 504 for result in results),
+        "valid_qa": sum(result["valid"] for result in succeeded),
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "requests_per_second": len(succeeded) / elapsed if elapsed else 0.0,
+        "tokens_per_second": sum(result["new_tokens"] for result in succeeded) / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 0.50) if latencies else None,
+        "latency_p99": percentile(latencies, 0.99) if latencies else None,
+    }
+
+    print(f"{summary['succeeded']}/{summary['requests']} succeeded ({summary['timed_out']} timed out) in {elapsed:.1f}s")
+    if latencies:
+        print(f"Latency p50 {summary['latency_p50']:.3f}s, p99 {summary['latency_p99']:.3f}s")
+    print(f"Throughput {summary['requests_per_second']:.2f} requests/s, {summary['tokens_per_second']:.1f} tokens/s")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare generation latency of the PyTorch cpu backend with the ONNX Runtime backend.
+
+Without --model_name, a tiny random Llama is built locally (see tests/conftest.py),
+so the comparison runs offline; with one, pass the same --adapter_path used for serving.
+
+Usage (from the repository root):
+    python -m benchmarks.onnx_latency --output_path onnx_latency.json
+    python -m benchmarks.onnx_latency --model_name meta-llama/Llama-3.2-1B --adapter_path models/adapter
+"""
+import argparse
+import json
+import random
+import tempfile
+
+import src.conf as conf
+from benchmarks.generation import run_case
+from prompt.prompt_manager import PromptManager
+from src.metrics import metrics
+from tests.conftest import build_tiny_model, synthetic_abstract
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PyTorch and ONNX Runtime generation latency on CPU")
+    parser.add_argument("--model_name", type=str, default=None, help="Base model; defaults to a tiny local Llama")
+    parser.add_argument("--adapter_path", type=str, default=None, help="Adapter merged into both models")
+    parser.add_argument("--num_prompts", type=int, default=8, help="Prompts generated per run")
+    parser.add_argument("--abstract_words", type=int, default=250, help="Abstract length in words")
+    parser.add_argument("--batch_size", type=int, default=conf.batch_size, help="Prompts per batch")
+    parser.add_argument("--max_new_tokens", type=int, default=32, help="New tokens per prompt")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per backend; the median is reported")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    from src.checkpoints import export_onnx, find_onnx_checkpoint
+    from src.model import ItriModel
+
+    prompt_manager = PromptManager()
+    rng = random.Random(0)
+    prompts = [
+        prompt_manager.render_prompt("llama3.2.j2", {"abstract": synthetic_abstract(args.abstract_words, rng)})
+        for _ in range(args.num_prompts)
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        model_name = args.model_name or build_tiny_model(f"{temporary_dir}/tiny_llama")
+        export_dir = None
+        if args.model_name:
+            export_dir = find_onnx_checkpoint(args.model_name, args.adapter_path)
+        if export_dir is None:
+            export_dir = export_onnx(model_name, args.adapter_path, root=f"{temporary_dir}/onnx", quantize=True)
+
+        metrics.enable()
+        variants = [("pytorch", "cpu", model_name, args.adapter_path, None),
+                    ("onnx-float32", "onnx", export_dir, None, False),
+                    ("onnx-int8", "onnx", export_dir, None, True)]
+        for name, backend, path, adapter_path, quantized in variants:
+            if quantized is not None:
+                conf.onnx_backend_config["quantized"] = quantized
+            model = ItriModel(path, adapter_path, backend=backend)
+            model.stop_at_qa_json = False
+            model.constrain_qa_json = False
+            case = run_case(model, prompts, args.batch_size, "greedy", args.max_new_tokens, args.repeats)
+            results.append({"name": name, "quantization": model.quantization, **case})
+            del model
+
+    baseline = results[0]["latency_seconds"]
+    for result in results:
+        result["speedup"] = baseline / result["latency_seconds"] if result["latency_seconds"] else None
+        print(f"{result['name']:>13}: {result['latency_seconds']:.3f}s, {result['tokens_per_second']:.1f} tokens/s, "
+              f"{result['speedup']:.2f}x vs PyTorch, peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump({"model_name": args.model_name or "tiny-random-llama", "adapter_path": args.adapter_path,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Run every non-LLM stage of the QA pipeline on synthetic corpora of growing size.
+
+For each scale the benchmark writes a synthetic corpus (benchmarks/synthetic_corpus.py),
+then runs the stages in pipeline order:
+
+    read_bibtex -> merge -> save_yaml      (utils/load_abstract_db/main.py)
+    read_yaml -> generate_qa               (generate_QA.py, with a deterministic fake model)
+    update_jsonl                           (utils/submit_QA_sample/update_jsonl.py)
+
+and records each stage's wall time and peak process RSS (sampled in a background
+thread), plus the Python heap peak with --trace_memory. Stages whose time per
+record grows with the corpus are reported at the end.
+
+Usage (from the repository root):
+    python -m benchmarks.pipeline --scales 1000 10000 100000 --output_path pipeline.json
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import generate_QA
+from benchmarks.synthetic_corpus import write_corpus
+from prompt.prompt_manager import PromptManager
+from src.categorize import LabelScorer
+from src.metrics import metrics
+from utils.load_abstract_db.file_readers import read_output_yaml_file
+
+
+class FakeQAModel:
+    """
+    Deterministic stand-in for `ItriModel`: outputs are derived from a hash of the prompt.
+
+    Every `invalid_every`-th distinct output is not valid QA JSON, so the
+    raw-output and LLM-categorization paths run as they would in production.
+    """
+
+    model_name = "fake"
+    adapter_path = None
+    backend = "cpu"
+    device = "cpu"
+    draft = None
+
+    def __init__(self, invalid_every: int = 20):
+        self.invalid_every = invalid_every
+
+    @staticmethod
+    def _hash(text: str):
+        return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+    def set_prompt_prefix(self, prefix: str):
+        pass
+
+    @contextlib.contextmanager
+    def adapter_disabled(self):
+        yield self
+
+    def generate_batch(self, prompts: list, batch_size: int = 8, show_progress: bool = False, **generation_kwargs):
+        outputs = []
+        for prompt in prompts:
+            value = self._hash(prompt)
+            if value % self.invalid_every == 0:
+                outputs.append(f"The abstract {value} describes a study but no JSON follows")
+            else:
+                outputs.append(json.dumps({
+                    "question": f"What did study {value} measure?",
+                    "answer": f"It measured telomere length in cohort {value % 997}.",
+                }))
+        return outputs
+
+    def score_continuations(self, prompts: list, continuations: list, batch_size: int = 8,
+                            show_progress: bool = False):
+        return [
+            [-((self._hash(prompt + continuation) % 1000) / 100) for continuation in continuations]
+            for prompt in prompts
+        ]
+
+
+def rss_bytes():
+    """Current resident set size, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard stdout; per-record messages would flood the terminal at these scales."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def measure(results: dict, stage: str, records: int, trace_memory: bool = False, interval: float = 0.01):
+    """
+    Record the wall time and memory of the enclosed block as `results[stage]`.
+
+    The process RSS is sampled every `interval` seconds, since the kernel's
+    peak covers the whole process rather than one stage. tracemalloc adds the
+    Python heap peak but slows pure-Python stages several times over.
+    """
+    rss_before = rss_bytes()
+    samples = [rss_before or 0]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            samples.append(rss_bytes() or 0)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        heap_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        stop.set()
+        sampler.join()
+        rss_after = rss_bytes()
+        results[stage] = {
+            "records": records,
+            "seconds": seconds,
+            "records_per_second": records / seconds if seconds else None,
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "stage_peak_rss_bytes": max(samples + [rss_after or 0]) or None,
+            "heap_peak_bytes": heap_peak,
+        }
+
+
+def run_generate_qa(items: list, output_path: str, chunk_size: int, batch_size: int):
+    """Run generate_QA.py's chunked processing and writing with `FakeQAModel`; return its stage timers."""
+    model = FakeQAModel()
+    pipeline = {
+        "model_qa": model,
+        "model_small": None,
+        "category_model": model,
+        "category_scorer": LabelScorer(model, batch_size=batch_size),
+        "classifier": None,
+        "prompt_manager": PromptManager(),
+        "cache": None,
+        "generation_kwargs": {},
+        "batch_size": batch_size,
+        "num_qa": 1,
+        "diverse_qa": False,
+        "show_progress": False,
+        "worker_metrics_path": None,
+    }
+    metrics.reset()
+    metrics.enable()
+    with open(output_path, "wb") as output_file:
+        for start in range(0, len(items), chunk_size):
+            outcomes = generate_QA.process_chunk(pipeline, items[start:start + chunk_size])
+            with metrics.timer("pipeline.write"):
+                generate_QA.write_results(output_file, [result for result, error in outcomes if error is None])
+    metrics.enable(False)
+    return {name: stage["seconds"] for name, stage in metrics.summary()["timers"].items()}
+
+
+def run_scale(num_records: int, work_dir: str, args):
+    """Write a corpus of `num_records` records and run every stage on it."""
+    from utils.submit_QA_sample.update_jsonl import load_jsonl, load_yaml, update_jsonl_with_abstracts, write_jsonl
+
+    results = {}
+    formats = ("yaml", "qa_jsonl") if args.skip_bibtex else ("bibtex", "qa_jsonl")
+    with measure(results, "synthetic_corpus", num_records, args.trace_memory):
+        paths = write_corpus(num_records, work_dir, seed=args.seed, formats=formats)
+
+    if not args.skip_bibtex:
+        # BibTeX parsing and DataFrames need pybtex and pandas, like main.py
+        from utils.load_abstract_db.data_processing import merge_dataframes
+        from utils.load_abstract_db.data_savers import save_to_yaml
+        from utils.load_abstract_db.file_readers import read_bib_file
+
+        with measure(results, "read_bibtex", num_records, args.trace_memory):
+            bib_dfs = [read_bib_file(paths["bibtex"]), read_bib_file(paths["bibtex_keywords"])]
+        with measure(results, "merge", num_records, args.trace_memory):
+            combined_df = merge_dataframes(*bib_dfs)
+        paths["yaml"] = os.path.join(work_dir, "output.yaml")
+        with measure(results, "save_yaml", num_records, args.trace_memory):
+            with quiet():
+                save_to_yaml(combined_df, paths["yaml"])
+        del bib_dfs, combined_df
+
+    with measure(results, "read_yaml", num_records, args.trace_memory):
+        items = read_output_yaml_file(paths["yaml"])
+
+    with measure(results, "generate_qa", len(items), args.trace_memory):
+        with quiet():
+            substages = run_generate_qa(items, os.path.join(work_dir, "qa_output.jsonl"),
+                                        args.chunk_size, args.batch_size)
+    results["generate_qa"]["substages"] = substages
+    del items
+
+    with measure(results, "update_jsonl", num_records, args.trace_memory):
+        with quiet():
+            updated = update_jsonl_with_abstracts(load_jsonl(paths["qa_jsonl"]), load_yaml(paths["yaml"]))
+            write_jsonl(updated, os.path.join(work_dir, "qa_database_updated.jsonl"))
+    del updated
+
+    return results
+
+
+def scaling_report(runs: list, factor: float):
+    """
+    Find stages whose seconds per record grow by more than `factor` from the smallest to the largest scale.
+
+    Args:
+        runs (list[dict]): {"num_records", "stages"} per scale, smallest first.
+        factor (float): Growth in seconds per record that counts as scaling badly.
+
+    Returns:
+        list[str]: One message per stage that scales badly.
+    """
+    if len(runs) < 2:
+        return []
+    smallest, largest = runs[0], runs[-1]
+    messages = []
+    for stage, result in largest["stages"].items():
+        baseline = smallest["stages"].get(stage)
+        if not baseline or not baseline["seconds"]:
+            continue
+        before = baseline["seconds"] / baseline["records"]
+        after = result["seconds"] / result["records"]
+        if after > before * factor:
+            messages.append(
+                f"{stage}: {before * 1e6:.1f} us/record at {smallest['num_records']} records, "
+                f"{after * 1e6:.1f} us/record at {largest['num_records']} ({after / before:.1f}x)"
+            )
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the non-LLM pipeline stages on synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Corpus sizes in records, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="Directory for the corpora and outputs; defaults to a temporary directory")
+    parser.add_argument("--skip_bibtex", action="store_true",
+                        help="Start from a synthetic YAML file instead of parsing BibTeX (no pybtex/pandas needed)")
+    parser.add_argument("--chunk_size", type=int, default=64, help="Abstracts per generate_QA.py chunk")
+    parser.add_argument("--batch_size", type=int, default=8, help="Batch size passed to the fake model")
+    parser.add_argument("--trace_memory", action="store_true",
+                        help="Also record the Python heap peak with tracemalloc (slows pure-Python stages down)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus")
+    parser.add_argument("--scaling_factor", type=float, default=2.0,
+                        help="Growth in seconds per record reported as scaling badly")
+    parser.add_argument("--output_path", type=str, default=None, help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        for num_records in sorted(args.scales):
+            work_dir = os.path.join(args.work_dir or temporary_dir, f"records_{num_records}")
+            print(f"Running {num_records} records in {work_dir}")
+            stages = run_scale(num_records, work_dir, args)
+            runs.append({"num_records": num_records, "stages": stages})
+            for stage, result in stages.items():
+                peak = result["stage_peak_rss_bytes"]
+                memory = f", peak RSS {peak / 2**20:.0f} MiB" if peak else ""
+                if result["heap_peak_bytes"]:
+                    memory += f", heap peak {result['heap_peak_bytes'] / 2**20:.1f} MiB"
+                print(f"{stage:>18}: {result['seconds']:8.2f}s ({result['records_per_second']:,.0f} records/s){memory}")
+
+    slow = scaling_report(runs, args.scaling_factor)
+    if slow:
+        print(f"Stages whose time per record grew more than {args.scaling_factor}x:")
+        for message in slow:
+            print(f"  {message}")
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump({"trace_memory": args.trace_memory, "runs": runs, "scales_badly": slow}, f, indent=2)
+        print(f"Results saved to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Generate synthetic BibTeX, YAML and QA JSONL corpora of any size.
+
+Records are deterministic for a given seed and shaped like the PubMed exports
+in utils/load_abstract_db and the QA samples in utils/submit_QA_sample, so
+every pipeline stage can be run at 1k to 1M records without real data.
+Files are written record by record, so memory stays flat as the corpus grows.
+
+Usage (from the repository root):
+    python -m benchmarks.synthetic_corpus --num_records 100000 --output_dir data/synthetic
+"""
+import argparse
+import json
+import os
+import random
+
+import yaml
+
+WORDS = (
+    "telomere length telomerase activity cadmium exposure oxidative stress senescence cells patients "
+    "expression cancer treatment cohort mortality association increased reduced significantly analysis "
+    "samples clinical mice tumor growth pathway response risk population aging biomarkers leukocyte "
+    "regression adjusted participants measured compared urinary serum smoking inflammation"
+).split()
+JOURNALS = ["BMC Public Health", "Aging Clinical and Experimental Research", "Environment International",
+            "Scientific Reports", "PLoS One", "Mutation Research"]
+SURNAMES = ["Zhang", "Liu", "Smith", "Garcia", "Müller", "Kim", "Rossi", "Nguyen", "Okafor", "Silva"]
+GIVEN_NAMES = ["Ya", "Mingjiang", "Anna", "Carlos", "Jonas", "Min-ji", "Luca", "Thi", "Chidi", "Beatriz"]
+CATEGORIES = ["method", "knowledge", "discussion"]
+
+
+def _sentence(rng: random.Random, min_words: int = 8, max_words: int = 22):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))).capitalize() + "."
+
+
+def synthetic_records(num_records: int, seed: int = 0, abstract_words: int = 250):
+    """
+    Yield bibliographic records with a unique key, DOI and PMID each.
+
+    Args:
+        num_records (int): Number of records.
+        seed (int): Seed for the generated text. Defaults to 0.
+        abstract_words (int): Approximate abstract length in words. Defaults to 250.
+
+    Yields:
+        dict: key, title, authors, journal, year, volume, pages, doi, pmid and abstract.
+    """
+    rng = random.Random(seed)
+    for index in range(num_records):
+        sections = []
+        for heading in ("INTRODUCTION", "METHODS", "RESULTS", "CONCLUSIONS"):
+            sentences = [_sentence(rng) for _ in range(max(1, abstract_words // 60))]
+            sections.append(f"{heading}: " + " ".join(sentences))
+        # Keys, DOIs and PMIDs depend only on the index, so every format agrees on them
+        year = 2000 + index % 25
+        yield {
+            "key": f"{SURNAMES[index % len(SURNAMES)].lower()}_{index}_{year}",
+            "title": _sentence(rng, 6, 14),
+            "authors": " and ".join(
+                f"{rng.choice(SURNAMES)}, {rng.choice(GIVEN_NAMES)}" for _ in range(rng.randint(1, 6))
+            ),
+            "journal": rng.choice(JOURNALS),
+            "year": str(year),
+            "volume": str(rng.randint(1, 60)),
+            "pages": f"{rng.randint(1, 900)}",
+            "doi": f"10.{5000 + index % 4000}/synthetic.{index:07d}",
+            "pmid": str(30000000 + index),
+            "abstract": " ".join(sections),
+        }
+
+
+def _bibtex_value(value: str):
+    # Braces delimit BibTeX values, so keep the text balanced
+    return value.replace("{", "(").replace("}", ")")
+
+
+def write_bibtex(records, path: str, fields=("title", "journal", "year", "volume", "pages", "doi", "abstract")):
+    """
+    Write records as BibTeX @article entries.
+
+    Args:
+        records (iterable[dict]): Records from `synthetic_records`.
+        path (str): Output .bib file.
+        fields (tuple[str]): Fields written besides the key and authors.
+
+    Returns:
+        int: Number of entries written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            lines = [f"@article{{{record['key']},"]
+            if "authors" in record:
+                lines.append(f"\tauthor = {{{_bibtex_value(record['authors'])}}},")
+            lines += [f"\t{field} = {{{_bibtex_value(record[field])}}}," for field in fields if field in record]
+            f.write("\n".join(lines) + "\n}\n\n")
+            count += 1
+    return count
+
+
+def write_yaml(records, path: str):
+    """
+    Write records as the YAML list produced by `save_to_yaml`, one record at a time.
+
+    Args:
+        records (iterable[dict]): Records from `synthetic_records`.
+        path (str): Output .yaml file.
+
+    Returns:
+        int: Number of records written.
+    """
+    # libyaml's emitter is an order of magnitude faster at large scales; the output is the same
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            yaml.dump([record], f, Dumper=dumper, default_flow_style=False, allow_unicode=True)
+            count += 1
+    return count
+
+
+def write_qa_jsonl(records, path: str, qa_per_record: int = 2, seed: int = 0):
+    """
+    Write QA pairs in the format of utils/submit_QA_sample/qa_database.jsonl.
+
+    Args:
+        records (iterable[dict]): Records from `synthetic_records`.
+        path (str): Output .jsonl file.
+        qa_per_record (int): QA pairs per record. Defaults to 2.
+        seed (int): Seed for the generated text. Defaults to 0.
+
+    Returns:
+        int: Number of QA pairs written.
+    """
+    rng = random.Random(seed)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            for _ in range(qa_per_record):
+                qa = {
+                    "question": _sentence(rng, 6, 14)[:-1] + "?",
+                    "answer": _sentence(rng),
+                    "pmid": record["pmid"],
+                    "doi": record["doi"],
+                    "category": rng.choice(CATEGORIES),
+                }
+                f.write(json.dumps(qa) + "\n")
+                count += 1
+    return count
+
+
+def write_corpus(num_records: int, output_dir: str, seed: int = 0, formats=("bibtex", "yaml", "qa_jsonl")):
+    """
+    Write a corpus of `num_records` records in the requested formats.
+
+    The BibTeX corpus is split like a typical export: `records.bib` holds the
+    entries and `keywords.bib` adds a keywords field for the same keys, for
+    `merge_dataframes` to join.
+
+    Args:
+        num_records (int): Number of records.
+        output_dir (str): Directory for the files.
+        seed (int): Seed for the generated text. Defaults to 0.
+        formats (tuple[str]): Any of "bibtex", "yaml" and "qa_jsonl".
+
+    Returns:
+        dict: Maps each written file's role to its path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    if "bibtex" in formats:
+        paths["bibtex"] = os.path.join(output_dir, "records.bib")
+        write_bibtex(synthetic_records(num_records, seed), paths["bibtex"])
+        paths["bibtex_keywords"] = os.path.join(output_dir, "keywords.bib")
+        rng = random.Random(seed)
+        write_bibtex(
+            ({"key": record["key"], "keywords": ", ".join(rng.sample(WORDS, 4))}
+             for record in synthetic_records(num_records, seed, abstract_words=0)),
+            paths["bibtex_keywords"],
+            fields=("keywords",)
+        )
+    if "yaml" in formats:
+        paths["yaml"] = os.path.join(output_dir, "records.yaml")
+        write_yaml(synthetic_records(num_records, seed), paths["yaml"])
+    if "qa_jsonl" in formats:
+        paths["qa_jsonl"] = os.path.join(output_dir, "qa_database.jsonl")
+        write_qa_jsonl(synthetic_records(num_records, seed, abstract_words=0), paths["qa_jsonl"], seed=seed)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic BibTeX/YAML/QA JSONL corpus")
+    parser.add_argument("--num_records", type=int, default=1000, help="Number of records")
+    parser.add_argument("--output_dir", type=str, default="data/synthetic", help="Directory for the files")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated text")
+    parser.add_argument("--formats", type=str, nargs="+", default=["bibtex", "yaml", "qa_jsonl"],
+                        choices=["bibtex", "yaml", "qa_jsonl"], help="Formats to write")
+    args = parser.parse_args()
+
+    paths = write_corpus(args.num_records, args.output_dir, args.seed, tuple(args.formats))
+    for role, path in paths.items():
+        print(f"{role:>16}: {path} ({os.path.getsize(path) / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
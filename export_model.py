@@ -0,0 +1,30 @@
+import argparse
+import src.conf as conf
+from src.checkpoints import export_merged, export_onnx
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a fine-tuned adapter merged into its base model")
+    parser.add_argument("--model_name", type=str, default="meta-llama/Llama-3.2-3B", help="Name of the base model")
+    parser.add_argument("--adapter_path", type=str, default=conf.adapter_path, help="Path to the trained adapter")
+    parser.add_argument("--format", type=str, default="merged", choices=["merged", "onnx"],
+                        help="'merged' safetensors for the cpu/cuda backends, or 'onnx' for the onnx backend")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Directory for exports (default: conf.merged_model_path or conf.onnx_model_path)")
+    parser.add_argument("--dtype", type=str, default="bfloat16", choices=["bfloat16", "float16", "float32"],
+                        help="Dtype of the saved weights (merged format)")
+    parser.add_argument("--quantize", action="store_true",
+                        help="Also write a dynamic int8 ONNX graph (onnx format)")
+    parser.add_argument("--base_only", action="store_true",
+                        help="Export the base model without the adapter, e.g. for categorization (onnx format)")
+    args = parser.parse_args()
+
+    if args.format == "onnx":
+        export_onnx(args.model_name, None if args.base_only else args.adapter_path,
+                    root=args.output_dir, quantize=args.quantize)
+    else:
+        export_merged(args.model_name, args.adapter_path, root=args.output_dir, dtype=args.dtype)
+
+
+if __name__ == "__main__":
+    main()
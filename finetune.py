@@ -4,9 +4,10 @@ import json
 from transformers import Trainer, TrainingArguments, AutoModelForCausalLM, AutoTokenizer, IntervalStrategy, EarlyStoppingCallback
 from datasets import Dataset
 from src.model import ItriModel
+from src.planner import MemoryPlanner, is_out_of_memory, release_memory
 from src.utils import load_jsonl_as_dict
 from prompt.prompt_manager import PromptManager
-from peft import get_peft_model, LoraConfig, TaskType
+from peft import get_peft_model, get_peft_model_state_dict, set_peft_model_state_dict, LoraConfig, TaskType
 import torch
 import numpy as np
 
@@ -15,6 +16,9 @@ data_path = "utils/submit_QA_sample/qa_database_updated.jsonl"
 eval_path = "data/QA_data/eval.jsonl"
 result_path = "models/experiment/result.txt"
 output_dir = "models/experiment"
+# Samples per optimizer step; the memory planner splits it into micro-batches and accumulation steps
+effective_batch_size = 8
+max_length = 512
 
 def load_tokenizer(model_name):
     tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -30,7 +34,7 @@ def load_sampled_data(file_path, sample_sizes):
     return sampled_datasets
 
 # Step 2: Prepare dataset for fine-tuning
-def prepare_dataset(file_path, tokenizer, prompt_manager, max_length=512):
+def prepare_dataset(file_path, tokenizer, prompt_manager, max_length=max_length):
     data = load_jsonl_as_dict(file_path)
     raw_data = [{"context": entry["abstract"], "question": entry["question"], "answer": entry["answer"]} for entry in data]
     dataset = Dataset.from_list(raw_data)
@@ -60,13 +64,46 @@ def configure_lora():
     )
 
 # Step 4: Fine-tune the model
+def plan_training_batch(model):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    planner = MemoryPlanner(model.config, device, dtype_bytes=2 if device == "cuda" else 4)
+    return planner.training_batch(model, max_length, effective_batch_size)
+
 def fine_tune_model(model, tokenizer, train_dataset, eval_dataset, current_output_dir, save_dir, num_epochs):
+    micro_batch, accumulation = plan_training_batch(model)
+    # Adapter weights before training, so a retry after OOM starts from the same point; the
+    # resized embeddings are frozen and need no copy
+    initial_state = {name: tensor.detach().to("cpu", copy=True)
+                     for name, tensor in get_peft_model_state_dict(model, save_embedding_layers=False).items()}
+    while True:
+        trainer = build_trainer(model, tokenizer, train_dataset, eval_dataset, current_output_dir, num_epochs,
+                                micro_batch, accumulation)
+        try:
+            trainer.train()
+            break
+        except (RuntimeError, MemoryError) as error:
+            if micro_batch == 1 or not is_out_of_memory(error):
+                raise
+        # Halve the micro-batch but keep the effective batch size; the new Trainer brings a fresh
+        # optimizer and schedule, and the adapter is reset to undo the steps already taken
+        del trainer
+        release_memory()
+        set_peft_model_state_dict(model, initial_state)
+        micro_batch, accumulation = micro_batch // 2, accumulation * 2
+        print(f"Out of memory; retrying with micro-batch {micro_batch} x {accumulation} accumulation steps")
+
+    model.save_pretrained(save_dir)
+    tokenizer.save_pretrained(save_dir)
+    return trainer
+
+def build_trainer(model, tokenizer, train_dataset, eval_dataset, current_output_dir, num_epochs, micro_batch,
+                  accumulation):
     training_args = TrainingArguments(
         output_dir=current_output_dir,
         learning_rate=3e-5,
-        per_device_train_batch_size=1,
-        per_device_eval_batch_size=1,
-        gradient_accumulation_steps=8,
+        per_device_train_batch_size=micro_batch,
+        per_device_eval_batch_size=micro_batch,
+        gradient_accumulation_steps=accumulation,
         evaluation_strategy="epoch",
         num_train_epochs=num_epochs,
         weight_decay=0.1,
@@ -87,14 +124,8 @@ def fine_tune_model(model, tokenizer, train_dataset, eval_dataset, current_outpu
         compute_metrics=None,
         callbacks=[EarlyStoppingCallback(early_stopping_patience=3)]
     )
-
-    trainer.train()
-
-    model.save_pretrained(save_dir)
-    tokenizer.save_pretrained(save_dir)
     return trainer
 
-
 # Step 5: Evaluate model and log results
 def evaluate_and_log_results(trainer, eval_dataset, tokenizer, result_path, qa_size):
     predictions = trainer.predict(eval_dataset)
@@ -1,90 +1,587 @@
 import argparse
-import torch
+import glob
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from collections import Counter
 import jsonlines
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from src.model import ItriModel
+from src import registry
+from src.cache import GenerationCache
+from src.categorize import LabelScorer, categorize_qa_sets
+from src.category_classifier import CategoryClassifier
+from src.client import RemoteItriModel, connect_or_load
+from src.metrics import metrics
+from src.parallel import run_sharded
+from src.planner import parse_batch_size
+from src.qa_json import dedup_qa_sets, extract_qa
+from src.qa_validation import qa_rejection
 from prompt.prompt_manager import PromptManager
 import src.conf as conf
-from tqdm import tqdm
 
 from utils.load_abstract_db.file_readers import read_output_yaml_file
 
 
+def load_pipeline(args, show_progress: bool = True, worker_metrics_root: str = None):
+    """
+    Load the Q&A model and the categorizers.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+        show_progress (bool): Display progress bars while processing. Defaults to True.
+        worker_metrics_root (str, optional): Set in `--workers` processes, which record metrics
+            and write their summary to `<root>.worker<pid><ext>`. Defaults to None.
+
+    Returns:
+        dict: The models and settings used by `process_abstracts`.
+    """
+    prompt_manager = PromptManager()
+    prefix = prompt_manager.render_prefix("llama3.2.j2", "abstract")
+
+    # Workers record their own metrics and write them next to the main summary
+    worker_metrics_path = None
+    if worker_metrics_root:
+        metrics.enable()
+        root, ext = os.path.splitext(worker_metrics_root)
+        worker_metrics_path = f"{root}.worker{os.getpid()}{ext}"
+
+    # Initialize the Q&A model; a merged checkpoint would leave no base weights to categorize with
+    model_qa = connect_or_load(
+        args.server,
+        "meta-llama/Llama-3.2-3B",
+        conf.adapter_path,
+        need_base=True,
+        draft_model_name=args.draft_model_name,
+        draft_adapter_path=args.draft_adapter_path,
+        num_assistant_tokens=args.num_assistant_tokens
+    )
+    print(f"Using device: {model_qa.device}")
+
+    # Categorize with the same base model, reusing the loaded weights with the adapter disabled
+    if isinstance(model_qa, RemoteItriModel):
+        category_model = model_qa
+    else:
+        category_model = registry.get_base_model("meta-llama/Llama-3.2-3B", model_qa.backend)
+    classifier = CategoryClassifier.load_latest() if args.categorizer == "classifier" else None
+    if args.categorizer == "classifier" and classifier is None:
+        print(f"No category classifier found in {conf.category_classifier_path}, categorizing with the LLM")
+
+    # The few-shot instructions before the abstract are shared by every prompt
+    model_qa.set_prompt_prefix(prefix)
+
+    # In a cascade the smaller fine-tuned model answers first and model_qa only takes its rejects
+    model_small = None
+    if args.cascade:
+        model_small = connect_or_load(args.server, args.cascade_model_name, args.cascade_adapter_path)
+        model_small.set_prompt_prefix(prefix)
+        print(f"Cascade: {args.cascade_model_name} first, escalating rejected abstracts to the Q&A model")
+
+    return {
+        "model_qa": model_qa,
+        "model_small": model_small,
+        "cascade_stats": {"tiers": {tier: {"abstracts": 0, "seconds": 0.0} for tier in ("small", "large")},
+                          "rejections": Counter()},
+        "category_model": category_model,
+        "category_scorer": LabelScorer(category_model, batch_size=args.batch_size),
+        "classifier": classifier,
+        "prompt_manager": prompt_manager,
+        "cache": GenerationCache() if conf.use_generation_cache and not args.no_cache else None,
+        "generation_kwargs": {"seed": args.seed} if args.seed is not None else {},
+        "batch_size": args.batch_size,
+        "num_qa": args.num_qa,
+        "diverse_qa": args.diverse_qa,
+        "show_progress": show_progress,
+        "worker_metrics_path": worker_metrics_path,
+    }
+
+
+def generate_raw(pipeline: dict, model, prompts: list):
+    """
+    Generate `num_qa` raw outputs per prompt with one model, through the generation cache if enabled.
+
+    Args:
+        pipeline (dict): Models and settings from `load_pipeline`.
+        model: `ItriModel` or `RemoteItriModel` to generate with.
+        prompts (list[str]): The rendered prompts.
+
+    Returns:
+        list[list[str]]: The generated outputs of each prompt.
+    """
+    num_qa, cache = pipeline["num_qa"], pipeline["cache"]
+    settings = {"batch_size": pipeline["batch_size"], "show_progress": pipeline["show_progress"],
+                **pipeline["generation_kwargs"]}
+    if num_qa > 1:
+        settings["diverse"] = pipeline["diverse_qa"]
+        if cache is not None:
+            candidates_raw = cache.generate_candidates(model, prompts, num_qa, **settings)
+        else:
+            candidates_raw = model.generate_candidates(prompts, num_qa, **settings)
+    else:
+        if cache is not None:
+            outputs = cache.generate_batch(model, prompts, **settings)
+        else:
+            outputs = model.generate_batch(prompts, **settings)
+        candidates_raw = [[output] for output in outputs]
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Generation cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['uncached']} not cacheable (sampling without --seed, or beam sampling)")
+    return candidates_raw
+
+
+def generate_cascade(pipeline: dict, items: list, prompts: list):
+    """
+    Generate with the small model and escalate the abstracts it fails on to the Q&A model.
+
+    An abstract is accepted from the small model when at least one of its
+    outputs passes `qa_rejection`; its failing outputs are dropped. Every
+    output of a rejected abstract is regenerated with the Q&A model and kept
+    as it is. Tier counts, times and rejection reasons are added to
+    `pipeline["cascade_stats"]` and to the metrics.
+
+    Args:
+        pipeline (dict): Models and settings from `load_pipeline`.
+        items (list[dict]): Entries read from the YAML file.
+        prompts (list[str]): The rendered prompt of each entry.
+
+    Returns:
+        tuple[list[list[str]], list[str]]: The outputs of each entry and the tier ("small" or "large")
+            that produced them.
+    """
+    stats = pipeline["cascade_stats"]
+
+    def run_tier(tier, model, tier_prompts):
+        start = time.perf_counter()
+        outputs = generate_raw(pipeline, model, tier_prompts)
+        seconds = time.perf_counter() - start
+        stats["tiers"][tier]["abstracts"] += len(tier_prompts)
+        stats["tiers"][tier]["seconds"] += seconds
+        metrics.record_time(f"pipeline.generate_{tier}", seconds)
+        metrics.add(f"pipeline.cascade_{tier}_abstracts", len(tier_prompts))
+        return outputs
+
+    candidates_raw = run_tier("small", pipeline["model_small"], prompts)
+    tiers = ["small"] * len(items)
+    escalated = []
+    for index, (item, candidates) in enumerate(zip(items, candidates_raw)):
+        reasons = [qa_rejection(extract_qa(candidate), item.get("abstract", "")) for candidate in candidates]
+        if all(reasons):
+            escalated.append(index)
+            stats["rejections"].update(reasons)
+            for reason in reasons:
+                metrics.add(f"pipeline.cascade_rejected_{reason}")
+        else:
+            candidates_raw[index] = [candidate for candidate, reason in zip(candidates, reasons) if reason is None]
+
+    print(f"Cascade: {len(items) - len(escalated)} of {len(items)} abstracts accepted from the small model, "
+          f"{len(escalated)} escalated")
+    if escalated:
+        large_outputs = run_tier("large", pipeline["model_qa"], [prompts[index] for index in escalated])
+        for index, candidates in zip(escalated, large_outputs):
+            candidates_raw[index] = candidates
+            tiers[index] = "large"
+    return candidates_raw, tiers
+
+
+def process_abstracts(pipeline: dict, items: list):
+    """
+    Generate and categorize `num_qa` Q&A sets for each abstract.
+
+    With `num_qa` above 1 the candidates of an abstract share one prefill,
+    and candidates whose question nearly repeats an earlier one are dropped.
+    With a small model loaded (`--cascade`), see `generate_cascade`.
+
+    Args:
+        pipeline (dict): Models and settings from `load_pipeline`.
+        items (list[dict]): Entries read from the YAML file.
+
+    Returns:
+        list[dict]: One result record per distinct Q&A set (or per entry without one), in input order.
+    """
+    # Step 1: Generate Q&A sets for all abstracts in length-bucketed batches
+    num_qa = pipeline["num_qa"]
+    print(f"Generating {num_qa} Q&A set(s) for each of {len(items)} abstracts")
+    with metrics.timer("pipeline.render_prompts"):
+        prompts_qa = [
+            pipeline["prompt_manager"].render_prompt("llama3.2.j2", {"abstract": item.get("abstract", "")})
+            for item in items
+        ]
+    with metrics.timer("pipeline.generate"):
+        if pipeline["model_small"] is not None:
+            candidates_raw, tiers = generate_cascade(pipeline, items, prompts_qa)
+        else:
+            candidates_raw, tiers = generate_raw(pipeline, pipeline["model_qa"], prompts_qa), None
+
+    # The model returns only the generated tokens, so parse the QA objects directly
+    entries, qa_sets, qa_sets_raw = [], [], []
+    for item_index, (item, candidates) in enumerate(zip(items, candidates_raw)):
+        parsed = [extract_qa(candidate) for candidate in candidates]
+        kept = dedup_qa_sets(parsed, conf.qa_dedup_threshold)
+        if not kept:
+            print(f"No valid Q&A object generated for DOI: {item.get('doi', 'unknown')}")
+            entries.append((item_index, None))
+            qa_sets.append(None)
+            qa_sets_raw.append(candidates[0])
+            continue
+        metrics.add("pipeline.qa_duplicates", sum(qa_set is not None for qa_set in parsed) - len(kept))
+        for qa_index, candidate_index in enumerate(kept):
+            entries.append((item_index, qa_index))
+            qa_sets.append(parsed[candidate_index])
+            qa_sets_raw.append(candidates[candidate_index])
+    metrics.add("pipeline.qa_parsed", sum(qa_set is not None for qa_set in qa_sets))
+
+    # Step 2: Categorize with the classifier, scoring the labels with the base weights where it is unsure
+    print(f"Categorizing {len(qa_sets)} Q&A sets")
+    with metrics.timer("pipeline.categorize"), pipeline["category_model"].adapter_disabled():
+        categories = categorize_qa_sets(
+            qa_sets, qa_sets_raw, pipeline["category_scorer"], pipeline["classifier"],
+            show_progress=pipeline["show_progress"]
+        )
+    llm_count = sum(category["source"] == "llm" for category in categories)
+    print(f"Categorized {len(categories) - llm_count} Q&A sets with the classifier and {llm_count} with the LLM")
+
+    results = []
+
+    for (item_index, qa_index), qa_set, qa_set_raw, category in zip(entries, qa_sets, qa_sets_raw, categories):
+        doi = items[item_index].get("doi", "unknown")
+
+        # Store results, keeping the raw text when it could not be parsed
+        result = {
+            "doi": doi,
+            "QA": qa_set or {},
+            "category": category["category"],
+            "category_probabilities": category["probabilities"],
+            "category_source": category["source"],
+        }
+        if num_qa > 1 and qa_index is not None:
+            result["qa_index"] = qa_index
+        if tiers is not None:
+            result["generation_tier"] = tiers[item_index]
+        if qa_set is None:
+            result["raw_output"] = qa_set_raw
+        results.append(result)
+
+    return results
+
+
+def process_safely(pipeline: dict, items: list):
+    """
+    Run `process_abstracts`, isolating failures to the abstracts that cause them.
+
+    If a chunk fails, its abstracts are retried one at a time, so one bad
+    abstract only loses its own record.
+
+    Args:
+        pipeline (dict): Models and settings from `load_pipeline`.
+        items (list[dict]): Entries read from the YAML file.
+
+    Returns:
+        list[tuple[dict, dict]]: (result, None) per result record or (None, error record) per
+            failed entry, in input order.
+    """
+    try:
+        return [(result, None) for result in process_abstracts(pipeline, items)]
+    except Exception as e:
+        if len(items) == 1:
+            return [(None, {
+                "doi": items[0].get("doi", "unknown"),
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": traceback.format_exc(),
+            })]
+        print(f"Processing {len(items)} abstracts failed ({type(e).__name__}: {e}), retrying one at a time")
+
+    outcomes = []
+    for item in items:
+        outcomes.extend(process_safely(pipeline, [item]))
+    return outcomes
+
+
+def process_chunk(pipeline: dict, items: list):
+    """`process_safely`, then refresh a worker's metrics summary."""
+    metrics.add("pipeline.abstracts", len(items))
+    outcomes = process_safely(pipeline, items)
+    if pipeline["worker_metrics_path"]:
+        metrics.write_summary(pipeline["worker_metrics_path"])
+    return outcomes
+
+
+def print_cascade_stats(stats: dict):
+    """Print how many abstracts each cascade tier generated, its time per abstract and why abstracts escalated."""
+    total = sum(tier["abstracts"] for tier in stats["tiers"].values())
+    for name, tier in stats["tiers"].items():
+        per_abstract = tier["seconds"] / tier["abstracts"] if tier["abstracts"] else 0.0
+        print(f"Cascade {name} tier: {tier['abstracts']} abstracts, {tier['seconds']:.1f}s "
+              f"({per_abstract:.2f}s per abstract)")
+    small = stats["tiers"]["small"]["abstracts"]
+    if small:
+        escalated = stats["tiers"]["large"]["abstracts"]
+        print(f"Cascade: {escalated / small:.1%} of abstracts escalated to the Q&A model"
+              f" ({total} generations in total)")
+    if stats["rejections"]:
+        print("Cascade rejections: " + ", ".join(f"{reason} {count}" for reason, count in
+                                                  stats["rejections"].most_common()))
+
+
+def print_draft_stats(stats: dict):
+    """Print the share of drafted tokens the Q&A model accepted, from `ItriModel.summarize_draft_stats`."""
+    print(
+        f"Assisted decoding: {stats['acceptance_rate']:.1%} of drafted tokens accepted, "
+        f"{stats['tokens_per_target_forward']:.2f} tokens per target forward pass"
+    )
+
+
+def worker_summary_files(worker_metrics_root: str):
+    """Map each worker metrics summary under a root to its modification time."""
+    root, ext = os.path.splitext(worker_metrics_root)
+    return {path: os.stat(path).st_mtime_ns for path in glob.glob(f"{glob.escape(root)}.worker*{ext}")}
+
+
+def read_worker_summaries(worker_metrics_root: str, before: dict):
+    """
+    Load the metrics summaries that `--workers` processes wrote during this run.
+
+    Args:
+        worker_metrics_root (str): The root passed to `load_pipeline`.
+        before (dict): `worker_summary_files` from before the run; files it lists unchanged
+            belong to earlier runs.
+
+    Returns:
+        list[dict]: One `metrics.summary()` per worker.
+    """
+    summaries = []
+    for path, modified in worker_summary_files(worker_metrics_root).items():
+        if before.get(path) != modified:
+            with open(path) as f:
+                summaries.append(json.load(f))
+    return summaries
+
+
+def run_stats_from_summaries(summaries: list):
+    """
+    Rebuild the cascade statistics and assisted-decoding counters of a `--workers` run.
+
+    Args:
+        summaries (list[dict]): Worker summaries from `read_worker_summaries`.
+
+    Returns:
+        tuple[dict, dict]: Stats in the form of `pipeline["cascade_stats"]`, and the summed
+            "model.draft_*" counters in the form of `ItriModel.draft_stats`.
+    """
+    counters, seconds = Counter(), Counter()
+    for summary in summaries:
+        counters.update(summary["counters"])
+        seconds.update({name: stage["seconds"] for name, stage in summary["timers"].items()})
+
+    rejected = "pipeline.cascade_rejected_"
+    cascade_stats = {
+        "tiers": {
+            tier: {"abstracts": counters[f"pipeline.cascade_{tier}_abstracts"],
+                   "seconds": seconds[f"pipeline.generate_{tier}"]}
+            for tier in ("small", "large")
+        },
+        "rejections": Counter({name[len(rejected):]: count for name, count in counters.items()
+                               if name.startswith(rejected)}),
+    }
+    draft_counters = {name: counters[f"model.draft_{name}"]
+                      for name in ("generations", "new_tokens", "target_forwards", "draft_forwards")}
+    return cascade_stats, draft_counters
+
+
+def write_results(output_file, results: list):
+    """
+    Append result records to the output file as JSON lines in a single write.
+
+    All records of a chunk, and so every Q&A set of each of its abstracts, go
+    out together. A crash can then at most cut off the last line, which
+    `completed_dois` removes; it never leaves an abstract with only some of
+    its records, which `--resume` would count as done.
+
+    Args:
+        output_file: The output JSONL file, opened in binary write or append mode.
+        results (list[dict]): Result records.
+    """
+    if not results:
+        return
+    buffer = io.StringIO()
+    jsonlines.Writer(buffer).write_all(results)
+    output_file.write(buffer.getvalue().encode("utf-8"))
+    output_file.flush()
+
+
+def completed_dois(output_path: str):
+    """
+    Collect the DOIs already written to an output file, for resuming a run.
+
+    A last line cut off by a crash is removed so that new records start on a fresh line.
+    Records are written a chunk at a time (`write_results`), so every DOI found is complete.
+
+    Args:
+        output_path (str): Path to the output JSONL file.
+
+    Returns:
+        set: DOIs of the complete records.
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    dois = set()
+    valid_length = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_length += len(line)
+            dois.add(record.get("doi"))
+
+    if valid_length < os.path.getsize(output_path):
+        print(f"Removing an incomplete record at the end of {output_path}")
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_length)
+    return dois
+
+
 def main():
     parser = argparse.ArgumentParser(description="Use ItriModel for Medical Q&A")
     parser.add_argument("--model_name", type=str, default=conf.model_name, help="Name of the model to use")
     parser.add_argument("--yaml_path", type=str, default="utils/load_abstract_db/output.yaml", help="Path to the YAML file")
     parser.add_argument("--output_path", type=str, default="output.jsonl", help="Path to the output JSONL file")
+    parser.add_argument("--batch_size", type=parse_batch_size, default=conf.batch_size,
+                        help="Number of abstracts generated per batch, or 'auto' to size batches from free memory")
+    parser.add_argument("--num_qa", type=int, default=conf.num_qa,
+                        help="Q&A pairs generated per abstract from one prefill; near-duplicate questions are dropped")
+    parser.add_argument("--diverse_qa", action="store_true",
+                        help="Generate the --num_qa candidates with diverse beam search instead of sampling")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Generate with --cascade_model_name first and only escalate abstracts whose Q&A sets "
+                             "fail validation to the Q&A model")
+    parser.add_argument("--cascade_model_name", type=str, default=conf.cascade_model_name,
+                        help="Small model tried first in --cascade mode")
+    parser.add_argument("--cascade_adapter_path", type=str, default=conf.cascade_adapter_path,
+                        help="Adapter of the small cascade model")
+    parser.add_argument("--draft_model_name", type=str, default=conf.draft_model_name, help="Draft model for assisted decoding")
+    parser.add_argument("--draft_adapter_path", type=str, default=conf.draft_adapter_path, help="Adapter of the draft model")
+    parser.add_argument("--num_assistant_tokens", type=int, default=conf.num_assistant_tokens, help="Tokens drafted per verification step")
+    parser.add_argument("--server", type=str, nargs="?", const=conf.server_url, default=None,
+                        help="Use a running model_server.py (default URL if no value is given)")
+    parser.add_argument("--categorizer", type=str, default="classifier", choices=["classifier", "llm"],
+                        help="Categorize with the trained classifier (LLM below the confidence threshold) or the LLM only")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling; sampled outputs are only cached when it is set")
+    parser.add_argument("--no_cache", action="store_true", help="Always generate instead of reusing cached outputs")
+    parser.add_argument("--chunk_size", type=int, default=64,
+                        help="Abstracts processed and written together; a crash loses at most one chunk per worker")
+    parser.add_argument("--resume", action="store_true", help="Skip abstracts whose DOI is already in the output file")
+    parser.add_argument("--error_path", type=str, default=None,
+                        help="JSONL file for abstracts that failed (defaults to <output_path>.errors.jsonl)")
+    parser.add_argument("--metrics_path", type=str, default=None,
+                        help="Record per-stage timings and counters and write a JSON summary here")
+    parser.add_argument("--prometheus_path", type=str, default=None,
+                        help="Also rewrite these metrics in Prometheus text format periodically")
+    parser.add_argument("--prometheus_interval", type=float, default=conf.prometheus_interval,
+                        help="Seconds between Prometheus updates")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes, each loading its own model and sharing the CPU cores")
     args = parser.parse_args()
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
-
-    # Initialize the Q&A model
-    model_qa = ItriModel("meta-llama/Llama-3.2-3B", conf.adapter_path)
-
-    # Initialize the categorization model
-    category_model_name = "meta-llama/Llama-3.2-3B"  # Using the same model for categorization
-    tokenizer = AutoTokenizer.from_pretrained(category_model_name)
-    category_model = AutoModelForCausalLM.from_pretrained(category_model_name).to(device)
+    if args.num_qa < 1:
+        parser.error("--num_qa must be at least 1")
+    if args.num_qa > 1 and args.draft_model_name:
+        parser.error("--num_qa above 1 cannot be combined with assisted decoding (--draft_model_name)")
+    if args.workers > 1 and args.server:
+        parser.error("--workers loads a model per process and cannot be combined with --server")
 
-    prompt_manager = PromptManager()
+    error_path = args.error_path or os.path.splitext(args.output_path)[0] + ".errors.jsonl"
+    if args.metrics_path or args.prometheus_path:
+        metrics.enable()
+    if args.prometheus_path:
+        metrics.start_prometheus(args.prometheus_path, args.prometheus_interval)
 
     try:
-        yaml_data = read_output_yaml_file(args.yaml_path)
-
-        results = []
-
-        for item in tqdm(yaml_data):
-            doi = item.get("doi", "unknown")
-            abstract = item.get("abstract", "")
-
-            # Step 1: Generate Q&A set
-            print(f"Generating Q&A set for DOI: {doi}")
-            prompt_qa = prompt_manager.render_prompt("llama3.2.j2", {"abstract": abstract})
-            qa_set_raw = model_qa.generate(prompt_qa)
-
-            qa_keyphrase = "# Your generated question and answer set:"
-            qa_set = qa_set_raw.split(qa_keyphrase, 1)[1].strip() if qa_keyphrase in qa_set_raw else ""
-
-            # Step 2: Categorize
-            print(f"Categorizing Q&A set for DOI: {doi}")
-            categorization_prompt = (
-                f"Given the following Q&A set, classify it into one of the following categories:"
-                f" method, knowledge, discussion.\n\n"
-                f"Q&A Set: {qa_set}\n"
-                f"Category (choose only from method, knowledge, discussion):"
-            )
-
-            inputs = tokenizer(categorization_prompt, return_tensors="pt").to(device)
-            outputs = category_model.generate(
-                inputs.input_ids,
-                max_new_tokens=1,
-                temperature=0.1
-            )
-            category_raw = tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
-
-            category_keyphrase = "Category (choose only from method, knowledge, discussion):"
-            category = category_raw.split(category_keyphrase, 1)[1].strip() if category_keyphrase in category_raw else ""
-
-            # Store results
-            results.append({
-                "doi": doi,
-                "QA": qa_set,
-                "category": category,
-            })
-
-        # Write results to JSONL file
-        print(f"Saving results to {args.output_path}")
-        with jsonlines.open(args.output_path, mode='w') as writer:
-            writer.write_all(results)
-
-        print("Processing complete.")
-
+        with metrics.timer("pipeline.yaml_load"):
+            yaml_data = read_output_yaml_file(args.yaml_path)
     except FileNotFoundError as e:
         print(f"Error: {e}")
-    except Exception as e:
-        print(f"Unexpected error: {e}")
+        return
+
+    if args.resume:
+        # Abstracts without a DOI cannot be matched and are processed again
+        done = completed_dois(args.output_path)
+        yaml_data = [item for item in yaml_data if item.get("doi") is None or item["doi"] not in done]
+        print(f"Resuming: {len(done)} abstracts already done, {len(yaml_data)} remaining")
+
+    mode = "a" if args.resume else "w"
+    counts = {"written": 0, "failed": 0}
+    print(f"Writing results to {args.output_path} and failures to {error_path}")
+    with open(args.output_path, mode + "b") as output_file, \
+            jsonlines.open(error_path, mode=mode, flush=True) as error_writer:
+
+        def write_outcomes(outcomes):
+            with metrics.timer("pipeline.write"):
+                results = [result for result, error in outcomes if error is None]
+                write_results(output_file, results)
+                counts["written"] += len(results)
+                for _, error in outcomes:
+                    if error is not None:
+                        print(f"Failed to process DOI {error['doi']}: {error['error']}")
+                        error_writer.write(error)
+                        counts["failed"] += 1
+
+        if args.workers > 1:
+            # Workers report the cascade and assisted-decoding figures through their metrics summaries,
+            # kept in a temporary directory unless --metrics_path asks for them
+            report_dir = None
+            worker_metrics_root = args.metrics_path
+            if worker_metrics_root is None and (args.cascade or args.draft_model_name):
+                report_dir = tempfile.mkdtemp(prefix="generate_QA_workers_")
+                worker_metrics_root = os.path.join(report_dir, "metrics.json")
+            before = worker_summary_files(worker_metrics_root) if worker_metrics_root else {}
+            try:
+                # Each worker loads its own model once and takes chunks until all abstracts are done
+                run_sharded(
+                    yaml_data,
+                    process_chunk,
+                    args.workers,
+                    init_fn=load_pipeline,
+                    init_args=(args, False, worker_metrics_root),
+                    shard_size=args.chunk_size,
+                    on_results=write_outcomes
+                )
+                summaries = read_worker_summaries(worker_metrics_root, before) if worker_metrics_root else []
+            finally:
+                if report_dir is not None:
+                    shutil.rmtree(report_dir, ignore_errors=True)
+            cascade_stats, draft_counters = run_stats_from_summaries(summaries)
+            if not args.draft_model_name:
+                draft_counters = None
+        else:
+            pipeline = load_pipeline(args)
+            for start in range(0, len(yaml_data), args.chunk_size):
+                write_outcomes(process_chunk(pipeline, yaml_data[start:start + args.chunk_size]))
+            cascade_stats = pipeline["cascade_stats"]
+            draft_counters = pipeline["model_qa"].draft_stats if pipeline["model_qa"].draft is not None else None
+
+    if args.cascade:
+        print_cascade_stats(cascade_stats)
+    if draft_counters is not None:
+        from src.model import ItriModel
+        print_draft_stats(ItriModel.summarize_draft_stats(draft_counters))
+
+    print(f"Processing complete: {counts['written']} written, {counts['failed']} failed.")
+
+    metrics.add("pipeline.written", counts["written"])
+    metrics.add("pipeline.failed", counts["failed"])
+    if args.prometheus_path:
+        metrics.stop_prometheus()
+    if args.metrics_path:
+        metrics.write_summary(args.metrics_path)
+        print(f"Metrics summary saved to {args.metrics_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import argparse
+import json
+import threading
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import src.conf as conf
+from src import registry
+
+# Models are not safe to run concurrently, so generation requests take turns
+_generate_lock = threading.Lock()
+
+
+def resident_model(payload: dict):
+    """Return the loaded model a request asks for, loading it on first use."""
+    if payload.get("disable_adapter"):
+        return registry.get_base_model(payload["model_name"], payload.get("backend"))
+    return registry.get_model(payload["model_name"], payload.get("adapter_path"), backend=payload.get("backend"),
+                              **payload.get("load_kwargs", {}))
+
+
+def handle_generate(payload: dict):
+    """
+    Run one generation request against a resident model.
+
+    Args:
+        payload (dict): Request body sent by `RemoteItriModel.generate_batch` or
+            `RemoteItriModel.generate_candidates`, which adds "num_candidates".
+
+    Returns:
+        dict: {"outputs": [...]} in prompt order, a list of candidates per prompt
+            when "num_candidates" is given.
+    """
+    with _generate_lock:
+        model = resident_model(payload)
+        if payload.get("prompt_prefix"):
+            model.set_prompt_prefix(payload["prompt_prefix"])
+
+        with model.adapter_disabled() if payload.get("disable_adapter") else nullcontext():
+            if payload.get("num_candidates"):
+                outputs = model.generate_candidates(
+                    payload["prompts"],
+                    payload["num_candidates"],
+                    batch_size=payload.get("batch_size", conf.batch_size),
+                    diverse=payload.get("diverse", False),
+                    **payload.get("generation_kwargs", {})
+                )
+            else:
+                outputs = model.generate_batch(
+                    payload["prompts"],
+                    batch_size=payload.get("batch_size", conf.batch_size),
+                    **payload.get("generation_kwargs", {})
+                )
+    return {"outputs": outputs}
+
+
+def handle_score(payload: dict):
+    """
+    Score continuations against a resident model.
+
+    Args:
+        payload (dict): Request body sent by `RemoteItriModel.score_continuations`.
+
+    Returns:
+        dict: {"scores": [...]} in prompt order.
+    """
+    with _generate_lock:
+        model = resident_model(payload)
+        with model.adapter_disabled() if payload.get("disable_adapter") else nullcontext():
+            scores = model.score_continuations(
+                payload["prompts"],
+                payload["continuations"],
+                batch_size=payload.get("batch_size", conf.batch_size)
+            )
+    return {"scores": scores}
+
+
+def handle_info(payload: dict):
+    """
+    Describe a resident model's quantization and default decoding settings.
+
+    Args:
+        payload (dict): Request body sent by `RemoteItriModel.info`.
+
+    Returns:
+        dict: The settings a generation cache on the client keys on.
+    """
+    with _generate_lock:
+        model = resident_model(payload)
+    return {
+        "quantization": model.quantization,
+        "generation_kwargs": model.generation_kwargs,
+        "stop_at_qa_json": model.stop_at_qa_json,
+        "constrain_qa_json": model.constrain_qa_json,
+        "qa_categories": model.qa_categories,
+    }
+
+
+# POST endpoints and their handlers
+HANDLERS = {
+    "/generate": handle_generate,
+    "/score": handle_score,
+    "/info": handle_info,
+}
+
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET /health and POST /generate, /score and /info as JSON."""
+
+    def do_GET(self):
+        if self.path == "/health":
+            models = [list(key) for key in registry.loaded_models()]
+            self._send_json(200, {"status": "ok", "models": models})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        handler = HANDLERS.get(self.path)
+        if handler is None:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            self._send_json(200, handler(payload))
+        except (KeyError, ValueError, TypeError) as e:
+            self._send_json(400, {"error": f"Bad request: {e}"})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep ItriModel instances loaded for predict.py and generate_QA.py")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on (keep it local)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--preload", nargs="*", default=[],
+                        help="Models to load at startup, as MODEL_NAME or MODEL_NAME@ADAPTER_PATH")
+    parser.add_argument("--backend", type=str, default=None, help="Backend for preloaded models")
+    args = parser.parse_args()
+
+    for spec in args.preload:
+        model_name, _, adapter_path = spec.partition("@")
+        # Keep the base weights of adapter models for generate_QA.py's categorization requests
+        registry.get_model(model_name, adapter_path or None, backend=args.backend, need_base=True)
+
+    server = ThreadingHTTPServer((args.host, args.port), ModelRequestHandler)
+    print(f"Model server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down model server.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
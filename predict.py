@@ -1,39 +1,99 @@
 import argparse
-import torch
-from src.model import ItriModel
+from src.cache import GenerationCache
+from src.client import connect_or_load
+from src.metrics import metrics
+from src.planner import parse_batch_size
 from src.utils import *
 from prompt.prompt_manager import PromptManager
 import src.conf as conf
-import torch
 
 
 def main():
     parser = argparse.ArgumentParser(description="Use ItriModel for Medical Q&A")
     parser.add_argument("--model_name", type=str, default=conf.model_name, help="Name of the model to use")
+    parser.add_argument("--batch_size", type=parse_batch_size, default=conf.batch_size,
+                        help="Number of abstracts generated per batch, or 'auto' to size batches from free memory")
+    parser.add_argument("--stream", action="store_true", help="Print each answer token by token as it is generated")
+    parser.add_argument("--server", type=str, nargs="?", const=conf.server_url, default=None,
+                        help="Use a running model_server.py (default URL if no value is given)")
+    parser.add_argument("--do_sample", action="store_true", help="Sample instead of greedy decoding when streaming")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for sampling; sampled outputs are only cached when it is set")
+    parser.add_argument("--no_cache", action="store_true", help="Always generate instead of reusing cached outputs")
+    parser.add_argument("--metrics_path", type=str, default=None,
+                        help="Record per-stage timings and counters and write a JSON summary here")
+    parser.add_argument("--adapter_paths", type=str, nargs="+", default=None,
+                        help="Compare these adapters, e.g. the QA3...QA25 experiments, on one resident base model")
     args = parser.parse_args()
+    if args.adapter_paths and (args.stream or args.server):
+        parser.error("--adapter_paths loads the adapters in this process; it cannot be combined with --stream "
+                     "or --server")
+    if args.metrics_path:
+        metrics.enable()
 
-    # Automatically default to 'cuda' if available, else fallback to 'cpu'
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {device}")
-
-    # Initialize the model
-    model = ItriModel(args.model_name)
+    # Initialize the model; the backend defaults to 'cuda' if available, else 'cpu'
+    # Streaming needs the model in-process, so the server is only used for batched generation
+    if args.adapter_paths:
+        from src.model import ItriModel
+        model = ItriModel(args.model_name, adapter_paths=args.adapter_paths)
+    else:
+        model = connect_or_load(None if args.stream else args.server, args.model_name)
+    print(f"Using device: {model.device}")
 
     # Initialize the PromptManager
     prompt_manager = PromptManager()
+    # The few-shot instructions before the abstract are shared by every prompt
+    model.set_prompt_prefix(prompt_manager.render_prefix("llama3.2.j2", "abstract"))
 
     try:
         # Load queries and context
         # queries = load_jsonl_as_dict(conf.QA_data_path)[0]["question"]
         context_list = load_jsonl_as_dict(conf.QA_data_path)
 
-        for ctx in context_list:
-            # Render and generate answers
-            print("Generating QA set based on the abstracts")
-            # Render the prompt using PromptManager
-            prompt = prompt_manager.render_prompt("llama3.2.j2", {"abstract": ctx["abstract"]})
-            answer = model.generate(prompt)
+        # Render and generate answers
+        print("Generating QA set based on the abstracts")
+        # Render the prompts using PromptManager
+        prompts = [
+            prompt_manager.render_prompt("llama3.2.j2", {"abstract": ctx["abstract"]})
+            for ctx in context_list
+        ]
+
+        if args.stream:
+            for prompt in prompts:
+                stream = model.generate_stream(prompt, do_sample=args.do_sample)
+                print("Answer: ", end="", flush=True)
+                for text in stream:
+                    print(text, end="", flush=True)
+                stats = stream.stats()
+                print(f"\n\n[{stats['tokens']} tokens, time to first token {stats['time_to_first_token'] or 0:.3f}s, "
+                      f"{stats['tokens_per_second'] or 0:.1f} tokens/s]")
+                print("---------------------------------")
+            return
 
+        generation_kwargs = {"seed": args.seed} if args.seed is not None else {}
+        if args.adapter_paths:
+            # Every prompt runs once per adapter; generate_batch groups them so each adapter is selected once
+            outputs = model.generate_batch(
+                prompts * len(args.adapter_paths),
+                batch_size=args.batch_size,
+                adapter_paths=[path for path in args.adapter_paths for _ in prompts],
+                **generation_kwargs
+            )
+            answers = [
+                "\n".join(f"[{path}] {outputs[position * len(prompts) + index]}"
+                          for position, path in enumerate(args.adapter_paths))
+                for index in range(len(prompts))
+            ]
+        elif conf.use_generation_cache and not args.no_cache:
+            cache = GenerationCache()
+            answers = cache.generate_batch(model, prompts, batch_size=args.batch_size, **generation_kwargs)
+            stats = cache.stats()
+            print(f"Generation cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['uncached']} not cacheable (sampling without --seed, or beam sampling)")
+        else:
+            answers = model.generate_batch(prompts, batch_size=args.batch_size, **generation_kwargs)
+
+        for answer in answers:
             # Print results
             # print(f"Query: {query}")
             # print(f"Context: {context}\n")
@@ -41,6 +101,10 @@ def main():
             print(f"Answer: {answer}\n")
             print("---------------------------------")
 
+        if args.metrics_path:
+            metrics.write_summary(args.metrics_path)
+            print(f"Metrics summary saved to {args.metrics_path}")
+
         # Save the model after generation
         # model.save_model(base_save_path="./models")
 
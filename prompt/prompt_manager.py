@@ -51,6 +51,19 @@ class PromptManager:
         except Exception as e:
             raise ValueError(f"Error rendering template {template_name}: {e}")
     
+    def render_prefix(self, template_name: str, variable: str, variables: dict = None) -> str:
+        """
+        Renders the static part of a template that comes before `variable`.
+
+        The result is identical for every prompt rendered from the template, so
+        models can cache its KV states once and reuse them across prompts.
+        """
+        sentinel = "\x00PREFIX_SPLIT\x00"
+        rendered = self.render_prompt(template_name, {**(variables or {}), variable: sentinel})
+        if sentinel not in rendered:
+            raise ValueError(f"Variable {variable} is not used in template {template_name}")
+        return rendered.split(sentinel, 1)[0]
+
     def set_template_dir(self, template_dir: str) -> None:
         """
         Updates the template directory to a new path.
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import time
+
+from aiohttp import web
+
+import src.conf as conf
+from prompt.prompt_manager import PromptManager
+from src.qa_json import extract_qa
+
+
+async def await_results(futures: list, timeout: float):
+    """
+    Wait for batcher futures, cancelling the unfinished ones when the timeout passes.
+
+    Raises:
+        asyncio.TimeoutError: If the results are not ready within `timeout` seconds.
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.gather(*(asyncio.wrap_future(future) for future in futures)), timeout
+        )
+    except asyncio.TimeoutError:
+        # The batcher drops cancelled sequences at its next step
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def submit_kwargs(options: dict):
+    """Pick the decoding options the batcher supports from a request."""
+    return {
+        "max_new_tokens": options.get("max_new_tokens"),
+        "do_sample": bool(options.get("do_sample", False)),
+        "temperature": options.get("temperature") or 1.0,
+        "top_k": options.get("top_k"),
+    }
+
+
+async def handle_health(request):
+    app = request.app
+    return web.json_response({
+        "status": "ok",
+        "models": [[app["model_name"], app["adapter_path"]]],
+        **app["batcher"].stats(),
+    })
+
+
+async def handle_qa(request):
+    """POST /qa: {"abstract": ...} in, the generated QA object out."""
+    app = request.app
+    try:
+        payload = await request.json()
+        abstract = payload["abstract"]
+    except (KeyError, ValueError) as e:
+        return web.json_response({"error": f"Bad request: {e}"}, status=400)
+
+    prompt = app["prompt_manager"].render_prompt("llama3.2.j2", {"abstract": abstract})
+    future = app["batcher"].submit(prompt, **submit_kwargs(payload))
+    try:
+        result, = await await_results([future], payload.get("timeout") or app["request_timeout"])
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "Generation timed out"}, status=504)
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+    return web.json_response({
+        "QA": extract_qa(result["text"]),
+        "raw_output": result["text"],
+        "new_tokens": result["new_tokens"],
+        "queue_time": result["queue_time"],
+        "latency": result["latency"],
+    })
+
+
+async def handle_info(request):
+    """POST /info: the settings `RemoteItriModel.info` reports, as the batcher applies them."""
+    batcher = request.app["batcher"]
+    return web.json_response({
+        "quantization": batcher.model.quantization,
+        # The batcher decodes greedily unless a request samples, and never constrains the JSON
+        "generation_kwargs": {"max_new_tokens": batcher.max_new_tokens, "do_sample": False,
+                              "temperature": 1.0, "top_k": None},
+        "stop_at_qa_json": batcher.stop_at_qa_json,
+        "constrain_qa_json": False,
+        "qa_categories": None,
+    })
+
+
+async def handle_generate(request):
+    """
+    POST /generate: the `RemoteItriModel` request format, so `predict.py --server` can use the service.
+
+    With "num_candidates" every prompt is submitted that many times, sampled unless the
+    generation kwargs say otherwise, and "outputs" holds a list of candidates per prompt.
+    Diverse beam search does not fit the batcher and is rejected.
+    """
+    app = request.app
+    try:
+        payload = await request.json()
+        prompts = payload["prompts"]
+        num_candidates = int(payload.get("num_candidates") or 0)
+    except (KeyError, TypeError, ValueError) as e:
+        return web.json_response({"error": f"Bad request: {e}"}, status=400)
+    if payload.get("disable_adapter"):
+        return web.json_response({"error": "The service only serves its adapter model"}, status=400)
+    if num_candidates < 0:
+        return web.json_response({"error": "num_candidates cannot be negative"}, status=400)
+    if payload.get("diverse"):
+        return web.json_response({"error": "The service cannot run diverse beam search"}, status=400)
+
+    generation_kwargs = payload.get("generation_kwargs", {})
+    if num_candidates:
+        # Like `ItriModel.generate_candidates`, candidates are sampled unless told otherwise
+        generation_kwargs = {"do_sample": True, **generation_kwargs}
+    kwargs = submit_kwargs(generation_kwargs)
+    futures = [app["batcher"].submit(prompt, **kwargs) for prompt in prompts for _ in range(num_candidates or 1)]
+    try:
+        results = await await_results(futures, payload.get("timeout") or app["request_timeout"])
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "Generation timed out"}, status=504)
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+    texts = [result["text"] for result in results]
+    if num_candidates:
+        texts = [texts[start:start + num_candidates] for start in range(0, len(texts), num_candidates)]
+    return web.json_response({"outputs": texts})
+
+
+def build_app(batcher, model_name: str, adapter_path: str = None, request_timeout: float = None):
+    """
+    Create the web application around a started `ContinuousBatcher`.
+
+    Args:
+        batcher (ContinuousBatcher): Batcher decoding for all requests.
+        model_name (str): Name of the served base model, reported by /health.
+        adapter_path (str, optional): Adapter of the served model. Defaults to None.
+        request_timeout (float, optional): Seconds before a request is cancelled. Defaults to
+            `conf.service_config["request_timeout"]`.
+
+    Returns:
+        aiohttp.web.Application: The application.
+    """
+    app = web.Application()
+    app["batcher"] = batcher
+    app["model_name"] = model_name
+    app["adapter_path"] = adapter_path
+    app["request_timeout"] = request_timeout or conf.service_config["request_timeout"]
+    app["prompt_manager"] = PromptManager()
+    app.router.add_get("/health", handle_health)
+    app.router.add_post("/qa", handle_qa)
+    app.router.add_post("/generate", handle_generate)
+    app.router.add_post("/info", handle_info)
+
+    async def stop_batcher(app):
+        app["batcher"].stop()
+
+    app.on_cleanup.append(stop_batcher)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve QA generation with continuous batching")
+    parser.add_argument("--model_name", type=str, default="meta-llama/Llama-3.2-3B", help="Name of the base model")
+    parser.add_argument("--adapter_path", type=str, default=conf.adapter_path, help="Path to the trained adapter")
+    parser.add_argument("--backend", type=str, default=None, help="Backend for the model")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on (keep it local)")
+    parser.add_argument("--port", type=int, default=8766, help="Port to listen on")
+    parser.add_argument("--max_batch_tokens", type=int, default=conf.service_config["max_batch_tokens"],
+                        help="Prompt plus new tokens all running sequences may reserve")
+    parser.add_argument("--max_batch_size", type=int, default=conf.service_config["max_batch_size"],
+                        help="Maximum sequences decoded together")
+    parser.add_argument("--request_timeout", type=float, default=conf.service_config["request_timeout"],
+                        help="Seconds before a request is cancelled")
+    args = parser.parse_args()
+
+    # Loading the model pulls in torch, so only do it once the arguments are valid
+    from src import registry
+    from src.batching import ContinuousBatcher
+
+    start = time.perf_counter()
+    model = registry.get_model(args.model_name, args.adapter_path, backend=args.backend)
+    print(f"Loaded {args.model_name} on {model.device} in {time.perf_counter() - start:.1f}s")
+
+    batcher = ContinuousBatcher(
+        model, max_batch_tokens=args.max_batch_tokens, max_batch_size=args.max_batch_size
+    ).start()
+    app = build_app(batcher, args.model_name, args.adapter_path, args.request_timeout)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
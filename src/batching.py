@@ -0,0 +1,307 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+
+import src.conf as conf
+from src.qa_json import extract_qa
+
+
+class _Sequence:
+    """A request being decoded: its prompt, generated tokens and the future to resolve."""
+
+    def __init__(self, prompt_ids: list, max_new_tokens: int, do_sample: bool, temperature: float, top_k: int):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_k = top_k
+        self.generated = []
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.started = None
+
+    @property
+    def reserved_tokens(self):
+        """Tokens of KV cache this sequence may grow to."""
+        return len(self.prompt_ids) + self.max_new_tokens
+
+
+class ContinuousBatcher:
+    """
+    Decode many requests together, admitting new ones as others finish.
+
+    A background thread runs one decode step at a time for every running
+    sequence. Between steps, waiting requests are prefilled and their KV
+    states are joined to the running batch (left-padded to a common length),
+    and finished or cancelled sequences are dropped, so the batch never
+    waits for its slowest member.
+
+    Decoding is greedy unless a request asks for sampling; beam search does
+    not fit a batch whose members change every step.
+    """
+
+    def __init__(self, model, max_batch_tokens: int = None, max_batch_size: int = None,
+                 max_new_tokens: int = None, stop_at_qa_json: bool = None):
+        """
+        Args:
+            model (ItriModel): The loaded model.
+            max_batch_tokens (int, optional): Prompt plus new tokens all running sequences may
+                reserve. Defaults to `conf.service_config["max_batch_tokens"]`.
+            max_batch_size (int, optional): Maximum running sequences. Defaults to
+                `conf.service_config["max_batch_size"]`.
+            max_new_tokens (int, optional): Default new-token limit per request. Defaults to
+                the model's `max_new_tokens`.
+            stop_at_qa_json (bool, optional): End a sequence once its QA object is closed.
+                Defaults to the model's setting.
+        """
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.device = model.device
+        self.max_batch_tokens = max_batch_tokens or conf.service_config["max_batch_tokens"]
+        self.max_batch_size = max_batch_size or conf.service_config["max_batch_size"]
+        self.max_new_tokens = max_new_tokens or model.generation_kwargs["max_new_tokens"]
+        self.stop_at_qa_json = model.stop_at_qa_json if stop_at_qa_json is None else stop_at_qa_json
+
+        eos_token_id = model.model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+
+        self._waiting = collections.deque()
+        self._condition = threading.Condition()
+        self._running = []
+        # Per-layer (key, value) tensors and the attention mask of the running rows
+        self._cache = None
+        self._attention_mask = None
+        self._thread = None
+        self._stopped = False
+        self.counters = {"completed": 0, "cancelled": 0, "failed": 0, "steps": 0, "new_tokens": 0}
+
+    def start(self):
+        """Start the decoding thread."""
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="continuous-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the decoding thread after the current step."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, prompt: str, max_new_tokens: int = None, do_sample: bool = False,
+               temperature: float = 1.0, top_k: int = None):
+        """
+        Queue a prompt for generation.
+
+        Cancelling the returned future drops the sequence at the next step.
+
+        Args:
+            prompt (str): The rendered prompt.
+            max_new_tokens (int, optional): New-token limit. Defaults to the batcher's limit.
+            do_sample (bool): Sample instead of decoding greedily. Defaults to False.
+            temperature (float): Sampling temperature. Defaults to 1.0.
+            top_k (int, optional): Sample only among the top-k tokens. Defaults to None (all).
+
+        Returns:
+            concurrent.futures.Future: Resolves to {"text", "new_tokens", "queue_time", "latency"}.
+        """
+        prompt_ids = self.tokenizer(prompt, truncation=True, max_length=self.model.max_input_length)["input_ids"]
+        sequence = _Sequence(prompt_ids, max_new_tokens or self.max_new_tokens, do_sample, temperature, top_k)
+        with self._condition:
+            self._waiting.append(sequence)
+            self._condition.notify()
+        return sequence.future
+
+    def stats(self):
+        """Return the queue and batch sizes plus the lifetime counters."""
+        return {"waiting": len(self._waiting), "running": len(self._running), **self.counters}
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._waiting and not self._running:
+                    self._condition.wait()
+                if self._stopped:
+                    break
+            try:
+                self._drop_cancelled()
+                self._admit()
+                if self._running:
+                    self._step()
+            except Exception as e:
+                # Fail the running requests rather than the service, and start from an empty batch
+                self._fail(self._running, e)
+                self._running, self._cache, self._attention_mask = [], None, None
+
+    def _drop_cancelled(self):
+        cancelled = [row for row, sequence in enumerate(self._running) if sequence.future.cancelled()]
+        if cancelled:
+            self.counters["cancelled"] += len(cancelled)
+            self._remove_rows(cancelled)
+
+    def _admit(self):
+        """Prefill waiting sequences that fit the token budget and join them to the running batch."""
+        reserved = sum(sequence.reserved_tokens for sequence in self._running)
+        admitted = []
+        with self._condition:
+            while self._waiting and len(self._running) + len(admitted) < self.max_batch_size:
+                sequence = self._waiting[0]
+                if sequence.future.cancelled():
+                    self._waiting.popleft()
+                    self.counters["cancelled"] += 1
+                    continue
+                # An oversized request still runs, alone, rather than waiting forever
+                if reserved + sequence.reserved_tokens > self.max_batch_tokens and (self._running or admitted):
+                    break
+                admitted.append(self._waiting.popleft())
+                reserved += sequence.reserved_tokens
+        if not admitted:
+            return
+
+        max_length = max(len(sequence.prompt_ids) for sequence in admitted)
+        pad_token_id = self.tokenizer.pad_token_id
+        input_ids = torch.tensor(
+            [[pad_token_id] * (max_length - len(s.prompt_ids)) + s.prompt_ids for s in admitted], device=self.device
+        )
+        attention_mask = torch.tensor(
+            [[0] * (max_length - len(s.prompt_ids)) + [1] * len(s.prompt_ids) for s in admitted], device=self.device
+        )
+        try:
+            logits, cache = self._forward(input_ids, attention_mask, DynamicCache())
+        except Exception as e:
+            self._fail(admitted, e)
+            return
+
+        started = time.perf_counter()
+        for sequence in admitted:
+            sequence.started = started
+        self._join(admitted, cache, attention_mask)
+        self._append_tokens(admitted, logits, offset=len(self._running) - len(admitted))
+
+    def _step(self):
+        """Feed every running sequence its last token and pick the next one."""
+        input_ids = torch.tensor([[sequence.generated[-1]] for sequence in self._running], device=self.device)
+        attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._running), 1))], dim=1
+        )
+        logits, self._cache = self._forward(input_ids, attention_mask, DynamicCache.from_legacy_cache(self._cache))
+        self._attention_mask = attention_mask
+        self.counters["steps"] += 1
+        self._append_tokens(self._running, logits, offset=0)
+
+    def _forward(self, input_ids, attention_mask, past_key_values):
+        """Run the model on new tokens and return the last logits and the extended cache as tuples."""
+        # A plain forward pass does not derive positions from the mask like generate does
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+        with torch.inference_mode(), torch.amp.autocast(device_type=self.device, enabled=self.device == "cuda"):
+            output = self.model.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+                num_logits_to_keep=1
+            )
+        return output.logits[:, -1, :].float(), output.past_key_values.to_legacy_cache()
+
+    def _join(self, admitted: list, cache: tuple, attention_mask):
+        """Append prefilled rows to the running batch, left-padding the shorter side."""
+        if not self._running:
+            self._running, self._cache, self._attention_mask = list(admitted), cache, attention_mask
+            return
+
+        length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+
+        def pad(tensor, dim_from_end):
+            missing = length - tensor.shape[-dim_from_end]
+            if not missing:
+                return tensor
+            return F.pad(tensor, (0, 0) * (dim_from_end - 1) + (missing, 0))
+
+        self._cache = tuple(
+            (torch.cat([pad(key, 2), pad(new_key, 2)]), torch.cat([pad(value, 2), pad(new_value, 2)]))
+            for (key, value), (new_key, new_value) in zip(self._cache, cache)
+        )
+        self._attention_mask = torch.cat([pad(self._attention_mask, 1), pad(attention_mask, 1)])
+        self._running.extend(admitted)
+
+    def _append_tokens(self, sequences: list, logits, offset: int):
+        """Choose the next token of each sequence (rows `offset` onward) and retire finished ones."""
+        finished = []
+        for index, sequence in enumerate(sequences):
+            row_logits = logits[index]
+            if sequence.do_sample:
+                if sequence.top_k:
+                    threshold = torch.topk(row_logits, sequence.top_k).values[-1]
+                    row_logits = row_logits.masked_fill(row_logits < threshold, float("-inf"))
+                probs = torch.softmax(row_logits / max(sequence.temperature, 1e-5), dim=-1)
+                token_id = int(torch.multinomial(probs, 1))
+            else:
+                token_id = int(row_logits.argmax())
+            sequence.generated.append(token_id)
+            self.counters["new_tokens"] += 1
+
+            if self._is_finished(sequence, token_id):
+                finished.append(offset + index)
+                self._resolve(sequence)
+
+        if finished:
+            self._remove_rows(finished)
+
+    def _is_finished(self, sequence: _Sequence, token_id: int):
+        if token_id in self.eos_token_ids or len(sequence.generated) >= sequence.max_new_tokens:
+            return True
+        if self.stop_at_qa_json and "}" in self.tokenizer.decode([token_id]):
+            return extract_qa(self.tokenizer.decode(sequence.generated, skip_special_tokens=True)) is not None
+        return False
+
+    def _resolve(self, sequence: _Sequence):
+        now = time.perf_counter()
+        try:
+            sequence.future.set_result({
+                "text": self.tokenizer.decode(sequence.generated, skip_special_tokens=True).strip(),
+                "new_tokens": len(sequence.generated),
+                "queue_time": sequence.started - sequence.submitted,
+                "latency": now - sequence.submitted,
+            })
+            self.counters["completed"] += 1
+        except InvalidStateError:
+            # Cancelled by the caller after this step started
+            self.counters["cancelled"] += 1
+
+    def _fail(self, sequences: list, error: Exception):
+        for sequence in sequences:
+            try:
+                sequence.future.set_exception(error)
+                self.counters["failed"] += 1
+            except InvalidStateError:
+                pass
+
+    def _remove_rows(self, rows: list):
+        """Drop rows from the running batch and trim cache columns that are padding for every row."""
+        removed = set(rows)
+        keep = [row for row in range(len(self._running)) if row not in removed]
+        self._running = [self._running[row] for row in keep]
+        if not keep:
+            self._cache, self._attention_mask = None, None
+            return
+
+        index = torch.tensor(keep, device=self._attention_mask.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        start = int(attention_mask.any(dim=0).nonzero()[0])
+        self._attention_mask = attention_mask[:, start:]
+        self._cache = tuple(
+            (key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+            for key, value in self._cache
+        )
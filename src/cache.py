@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import src.conf as conf
+from src.checkpoints import adapter_fingerprint
+
+
+class GenerationCache:
+    """
+    Persistent SQLite cache of generated text, keyed by everything that determines the output.
+
+    The key hashes the base model, its quantization, the adapter contents,
+    the full rendered prompt (template and abstract) and the resolved
+    decoding settings. Entries are evicted least recently used once the
+    cache holds more than `max_entries`. Sampled generations are only
+    cached when a seed is fixed and each row samples from its own stream,
+    i.e. without beam search; beam sampling draws across a whole batch, so
+    its output also depends on the other prompts in the batch.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = None):
+        """
+        Args:
+            path (str, optional): SQLite file. Defaults to `conf.cache_path`.
+            max_entries (int, optional): Entries kept before evicting. Defaults to `conf.cache_max_entries`.
+        """
+        self.path = path or conf.cache_path
+        self.max_entries = max_entries or conf.cache_max_entries
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        # Worker processes share the file, so wait for their writes instead of failing
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS generations "
+            "(key TEXT PRIMARY KEY, output TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+        self._adapter_hashes = {}
+        self.counters = {"hits": 0, "misses": 0, "uncached": 0, "evicted": 0}
+
+    def close(self):
+        self._connection.close()
+
+    def _adapter_hash(self, adapter_path: str):
+        """Hash the adapter files once per path; fall back to the path for adapters not on disk."""
+        if not adapter_path:
+            return None
+        if adapter_path not in self._adapter_hashes:
+            try:
+                self._adapter_hashes[adapter_path] = adapter_fingerprint(adapter_path)
+            except FileNotFoundError:
+                self._adapter_hashes[adapter_path] = adapter_path
+        return self._adapter_hashes[adapter_path]
+
+    def settings_for(self, model, generation_kwargs: dict):
+        """
+        Resolve the decoding settings a generation would use, or None if its output is not reproducible.
+
+        Args:
+            model: `ItriModel` or `RemoteItriModel`, whose defaults come from the server.
+            generation_kwargs (dict): Overrides passed to `generate_batch`.
+
+        Returns:
+            dict or None: The settings to key on.
+        """
+        defaults = getattr(model, "generation_kwargs", None)
+        settings = {**(defaults or {}), **generation_kwargs}
+        for name in ("stop_at_qa_json", "constrain_qa_json", "qa_categories"):
+            settings.setdefault(name, getattr(model, name, getattr(conf, name)))
+        # Without the model's defaults, sampling cannot be ruled out
+        if settings.get("do_sample", defaults is None) and (
+                settings.get("seed") is None or (settings.get("num_beams") or 1) > 1):
+            return None
+        return settings
+
+    def key(self, model, prompt: str, settings: dict):
+        """Hash a prompt together with the model identity and decoding settings."""
+        identity = {
+            "model_name": model.model_name,
+            "quantization": model.quantization,
+            "adapter": self._adapter_hash(model.adapter_path),
+            "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            "settings": settings,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list):
+        """Return {key: output} for the cached keys and mark them as recently used."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, output FROM generations WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE generations SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._connection.commit()
+        return found
+
+    def put_many(self, items: dict):
+        """Store {key: output} and evict the least recently used entries beyond the cap."""
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO generations (key, output, created, last_used) VALUES (?, ?, ?, ?)",
+                [(key, output, now, now) for key, output in items.items()]
+            )
+            count, = self._connection.execute("SELECT COUNT(*) FROM generations").fetchone()
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM generations WHERE key IN "
+                    "(SELECT key FROM generations ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+                self.counters["evicted"] += count - self.max_entries
+            self._connection.commit()
+
+    def generate_batch(self, model, prompts: list, batch_size: int = 8, show_progress: bool = False,
+                       **generation_kwargs):
+        """
+        `model.generate_batch` that returns cached outputs and only generates the misses.
+
+        Args:
+            model: `ItriModel` or `RemoteItriModel`.
+            prompts (list[str]): The rendered prompts.
+            batch_size (int): Maximum number of prompts per forward pass. Defaults to 8.
+            show_progress (bool): Display a progress bar over the batches. Defaults to False.
+            **generation_kwargs: Overrides for the default generation settings, including `seed`.
+
+        Returns:
+            list[str]: The generated answers, one per prompt.
+        """
+        return self._generate_cached(
+            model, prompts, self.settings_for(model, generation_kwargs),
+            lambda missing: model.generate_batch(missing, batch_size=batch_size, show_progress=show_progress,
+                                                 **generation_kwargs)
+        )
+
+    def generate_candidates(self, model, prompts: list, num_candidates: int, batch_size: int = 8,
+                            show_progress: bool = False, diverse: bool = False, **generation_kwargs):
+        """
+        `model.generate_candidates` that returns cached candidate lists and only generates the misses.
+
+        Args:
+            model: `ItriModel` or `RemoteItriModel`.
+            prompts (list[str]): The rendered prompts.
+            num_candidates (int): Answers to generate per prompt.
+            batch_size (int): Maximum number of prompts per forward pass. Defaults to 8.
+            show_progress (bool): Display a progress bar over the batches. Defaults to False.
+            diverse (bool): Use diverse beam search instead of sampling. Defaults to False.
+            **generation_kwargs: Overrides for the default generation settings, including `seed`.
+
+        Returns:
+            list[list[str]]: `num_candidates` answers per prompt.
+        """
+        # The same overrides `generate_candidates` applies before the caller's settings
+        overrides = {}
+        if num_candidates > 1:
+            overrides = {"do_sample": not diverse, "num_beams": num_candidates if diverse else 1}
+        settings = self.settings_for(model, {
+            **overrides, **generation_kwargs, "num_candidates": num_candidates, "diverse": diverse
+        })
+        outputs = self._generate_cached(
+            model, prompts, settings,
+            lambda missing: [json.dumps(candidates) for candidates in model.generate_candidates(
+                missing, num_candidates, batch_size=batch_size, show_progress=show_progress, diverse=diverse,
+                **generation_kwargs
+            )]
+        )
+        return [json.loads(output) for output in outputs]
+
+    def _generate_cached(self, model, prompts: list, settings: dict, generate):
+        """Look up each prompt under `settings` and call `generate(prompts)` for the misses only."""
+        if settings is None:
+            self.counters["uncached"] += len(prompts)
+            return generate(prompts)
+
+        keys = [self.key(model, prompt, settings) for prompt in prompts]
+        cached = self.get_many(list(set(keys)))
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        self.counters["hits"] += len(prompts) - len(missing)
+        self.counters["misses"] += len(missing)
+
+        outputs = [cached.get(key) for key in keys]
+        if missing:
+            generated = generate([prompts[i] for i in missing])
+            for i, output in zip(missing, generated):
+                outputs[i] = output
+            self.put_many({keys[i]: outputs[i] for i in missing})
+        return outputs
+
+    def stats(self):
+        """Return the hit/miss counters and the hit rate over cacheable prompts."""
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters, "hit_rate": self.counters["hits"] / lookups if lookups else 0.0}
@@ -0,0 +1,152 @@
+import json
+import math
+
+import src.conf as conf
+
+# Content-free inputs used to estimate the model's bias towards each label
+CALIBRATION_INPUTS = ("N/A", "", "[MASK]")
+
+
+def categorization_prompt(qa_text: str, labels=None):
+    """
+    Build the prompt whose continuation is scored against each category label.
+
+    Parameters:
+    - qa_text (str): The QA set as JSON, or the raw generated text when it could not be parsed.
+    - labels (list, optional): Category labels. Defaults to `conf.category_labels`.
+
+    Returns:
+    - str: The prompt, ending right before the label.
+    """
+    labels = labels or conf.category_labels
+    return (
+        f"Given the following Q&A set, classify it into one of the following categories:"
+        f" {', '.join(labels)}.\n\n"
+        f"Q&A Set: {qa_text}\n"
+        f"Category (choose only from {', '.join(labels)}):"
+    )
+
+
+def softmax(scores: list):
+    """Normalize log-scores into probabilities."""
+    top = max(scores)
+    weights = [math.exp(score - top) for score in scores]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+class LabelScorer:
+    """
+    Categorize QA sets by comparing the likelihood of each label after the prompt.
+
+    All labels are scored in one batched forward pass, so no tokens are
+    generated and the result is always one of the labels. With calibration,
+    label probabilities are divided by those the model assigns after
+    content-free inputs (contextual calibration), which removes its prior
+    preference for some labels.
+
+    The calibration is estimated on the first call, so use the scorer with
+    the same model state (e.g. always inside `adapter_disabled()`).
+    """
+
+    def __init__(self, model, labels=None, calibrate: bool = None, batch_size: int = None):
+        """
+        Parameters:
+        - model: An `ItriModel` or `RemoteItriModel` providing `score_continuations`.
+        - labels (list, optional): Category labels. Defaults to `conf.category_labels`.
+        - calibrate (bool, optional): Apply contextual calibration. Defaults to `conf.calibrate_categories`.
+        - batch_size (int, optional): Prompts per forward pass. Defaults to `conf.batch_size`.
+        """
+        self.model = model
+        self.labels = list(labels or conf.category_labels)
+        self.calibrate = conf.calibrate_categories if calibrate is None else calibrate
+        self.batch_size = batch_size or conf.batch_size
+        self.prior = None
+
+    def _label_probabilities(self, prompts: list, show_progress: bool = False):
+        # A leading space makes each label a continuation of the prompt rather than a new word piece
+        continuations = [f" {label}" for label in self.labels]
+        scores = self.model.score_continuations(
+            prompts, continuations, batch_size=self.batch_size, show_progress=show_progress
+        )
+        return [softmax(row) for row in scores]
+
+    def estimate_prior(self):
+        """
+        Estimate the label probabilities the model assigns without any QA content.
+
+        Returns:
+        - list: The mean probability of each label over the content-free inputs.
+        """
+        rows = self._label_probabilities([categorization_prompt(text, self.labels) for text in CALIBRATION_INPUTS])
+        self.prior = [sum(column) / len(rows) for column in zip(*rows)]
+        return self.prior
+
+    def score(self, qa_texts: list, show_progress: bool = False):
+        """
+        Categorize QA sets.
+
+        Parameters:
+        - qa_texts (list): QA sets as JSON text, or raw generated text.
+        - show_progress (bool): Display a progress bar over the batches. Defaults to False.
+
+        Returns:
+        - list: One {"category": label, "probabilities": {label: probability}} dict per QA set.
+        """
+        if not qa_texts:
+            return []
+        if self.calibrate and self.prior is None:
+            self.estimate_prior()
+
+        results = []
+        prompts = [categorization_prompt(text, self.labels) for text in qa_texts]
+        for probabilities in self._label_probabilities(prompts, show_progress):
+            if self.calibrate:
+                adjusted = [p / max(prior, 1e-12) for p, prior in zip(probabilities, self.prior)]
+                total = sum(adjusted)
+                probabilities = [p / total for p in adjusted]
+            best = max(range(len(self.labels)), key=lambda i: probabilities[i])
+            results.append({
+                "category": self.labels[best],
+                "probabilities": dict(zip(self.labels, probabilities)),
+            })
+        return results
+
+
+def categorize_qa_sets(qa_sets: list, raw_outputs: list, scorer: LabelScorer, classifier=None,
+                       threshold: float = None, show_progress: bool = False):
+    """
+    Categorize QA sets with the trained classifier, falling back to LLM label scoring.
+
+    QA sets the classifier is not confident about, and outputs that could not
+    be parsed into a QA set, are scored by `scorer` in one batch.
+
+    Parameters:
+    - qa_sets (list): Parsed QA dicts, or None where parsing failed.
+    - raw_outputs (list): The generated text behind each QA set.
+    - scorer (LabelScorer): LLM label scorer for the fallback.
+    - classifier (CategoryClassifier, optional): Trained classifier. Defaults to None (LLM only).
+    - threshold (float, optional): Minimum classifier probability to accept its label.
+      Defaults to `conf.category_confidence_threshold`.
+    - show_progress (bool): Display a progress bar over the LLM batches. Defaults to False.
+
+    Returns:
+    - list: One {"category", "probabilities", "source"} dict per QA set, where
+      "source" is "classifier" or "llm".
+    """
+    threshold = conf.category_confidence_threshold if threshold is None else threshold
+    results = [None] * len(qa_sets)
+
+    if classifier is not None:
+        parsed = [i for i, qa_set in enumerate(qa_sets) if qa_set]
+        for i, prediction in zip(parsed, classifier.predict([qa_sets[i] for i in parsed])):
+            if max(prediction["probabilities"].values()) >= threshold:
+                results[i] = {**prediction, "source": "classifier"}
+
+    remaining = [i for i, result in enumerate(results) if result is None]
+    if remaining:
+        texts = [json.dumps(qa_sets[i]) if qa_sets[i] else raw_outputs[i] for i in remaining]
+        for i, prediction in zip(remaining, scorer.score(texts, show_progress=show_progress)):
+            results[i] = {**prediction, "source": "llm"}
+
+    return results
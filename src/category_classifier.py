@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+import src.conf as conf
+
+
+MODEL_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+
+
+def qa_text(qa_set: dict):
+    """Text the classifier sees for a QA pair: the question followed by the answer."""
+    return f"{qa_set.get('question', '')}\n{qa_set.get('answer', '')}"
+
+
+def read_labelled_qa(jsonl_paths: list):
+    """
+    Read labelled QA pairs written by the submission tool (utils/submit_QA_sample).
+
+    Args:
+        jsonl_paths (list[str]): JSONL files with "question", "answer" and "category" fields.
+
+    Returns:
+        tuple[list[str], list[str], str]: The QA texts, their categories, and a
+            SHA-256 digest of the training data.
+    """
+    texts, labels = [], []
+    digest = hashlib.sha256()
+    for path in jsonl_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if not entry.get("category") or not (entry.get("question") or entry.get("answer")):
+                    continue
+                texts.append(qa_text(entry))
+                labels.append(entry["category"].strip().lower())
+                digest.update(line.encode("utf-8"))
+    return texts, labels, digest.hexdigest()
+
+
+def version_dirs(root: str = None):
+    """Return the versioned artifact directories under `root` as {version number: path}."""
+    root = root or conf.category_classifier_path
+    if not os.path.isdir(root):
+        return {}
+    versions = {}
+    for name in os.listdir(root):
+        match = re.fullmatch(r"v(\d+)", name)
+        if match and os.path.exists(os.path.join(root, name, MODEL_FILE)):
+            versions[int(match.group(1))] = os.path.join(root, name)
+    return versions
+
+
+class CategoryClassifier:
+    """
+    Hashed word n-grams with a linear model, categorizing QA pairs without an LLM.
+
+    The hashing vectorizer has no vocabulary to fit or store, so the artifact
+    is just the linear weights and prediction is a sparse matrix product.
+    """
+
+    def __init__(self, pipeline, metadata: dict):
+        self.pipeline = pipeline
+        self.metadata = metadata
+        self.labels = [str(label) for label in pipeline.classes_]
+
+    @classmethod
+    def train(cls, jsonl_paths: list, n_features: int = 2 ** 18):
+        """
+        Fit the classifier on labelled QA pairs.
+
+        Args:
+            jsonl_paths (list[str]): JSONL files with labelled QA pairs.
+            n_features (int): Size of the hashed feature space. Defaults to 2**18.
+
+        Returns:
+            CategoryClassifier: The fitted classifier with its training metadata.
+        """
+        import sklearn
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.model_selection import cross_val_score
+        from sklearn.pipeline import make_pipeline
+
+        texts, labels, data_hash = read_labelled_qa(jsonl_paths)
+        if len(set(labels)) < 2:
+            raise ValueError(f"Need at least two categories to train, found {sorted(set(labels))}")
+
+        def build():
+            return make_pipeline(
+                HashingVectorizer(n_features=n_features, ngram_range=(1, 2), alternate_sign=False),
+                LogisticRegression(max_iter=1000, class_weight="balanced")
+            )
+
+        # Cross-validate only when every category has enough examples for the folds
+        folds = min(5, min(labels.count(label) for label in set(labels)))
+        accuracy = float(cross_val_score(build(), texts, labels, cv=folds).mean()) if folds >= 2 else None
+
+        pipeline = build().fit(texts, labels)
+        metadata = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "training_files": list(jsonl_paths),
+            "training_data_sha256": data_hash,
+            "num_examples": len(texts),
+            "label_counts": {label: labels.count(label) for label in sorted(set(labels))},
+            "cv_accuracy": accuracy,
+            "n_features": n_features,
+            "sklearn_version": sklearn.__version__,
+        }
+        return cls(pipeline, metadata)
+
+    def save(self, root: str = None):
+        """
+        Save the classifier as the next version under `root`, e.g. models/category_classifier/v3.
+
+        Args:
+            root (str, optional): Artifact directory. Defaults to `conf.category_classifier_path`.
+
+        Returns:
+            str: The directory the version was written to.
+        """
+        import joblib
+
+        root = root or conf.category_classifier_path
+        version = max(version_dirs(root), default=0) + 1
+        save_dir = os.path.join(root, f"v{version}")
+        os.makedirs(save_dir)
+
+        self.metadata["version"] = version
+        joblib.dump(self.pipeline, os.path.join(save_dir, MODEL_FILE))
+        with open(os.path.join(save_dir, METADATA_FILE), "w") as f:
+            json.dump(self.metadata, f, indent=2)
+        return save_dir
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a saved version directory."""
+        import joblib
+
+        with open(os.path.join(path, METADATA_FILE), "r") as f:
+            metadata = json.load(f)
+        return cls(joblib.load(os.path.join(path, MODEL_FILE)), metadata)
+
+    @classmethod
+    def load_latest(cls, root: str = None):
+        """
+        Load the highest saved version.
+
+        Args:
+            root (str, optional): Artifact directory. Defaults to `conf.category_classifier_path`.
+
+        Returns:
+            CategoryClassifier or None: The classifier, or None if none has been trained.
+        """
+        versions = version_dirs(root)
+        return cls.load(versions[max(versions)]) if versions else None
+
+    def predict(self, qa_sets: list):
+        """
+        Categorize QA pairs.
+
+        Args:
+            qa_sets (list[dict]): QA pairs with "question" and "answer" keys.
+
+        Returns:
+            list[dict]: One {"category": label, "probabilities": {label: probability}}
+                dict per QA pair, as returned by `LabelScorer.score`.
+        """
+        if not qa_sets:
+            return []
+        probabilities = self.pipeline.predict_proba([qa_text(qa_set) for qa_set in qa_sets])
+        return [
+            {
+                "category": self.labels[row.argmax()],
+                "probabilities": {label: float(p) for label, p in zip(self.labels, row)},
+            }
+            for row in probabilities
+        ]
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import src.conf as conf
+
+
+MANIFEST_NAME = "manifest.json"
+ADAPTER_FILES = ("adapter_config.json", "adapter_model.safetensors", "adapter_model.bin")
+ONNX_FILE = "model.onnx"
+ONNX_QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def adapter_fingerprint(adapter_path: str):
+    """
+    Hash the configuration and weights of a trained adapter.
+
+    Args:
+        adapter_path (str): Directory written by `save_pretrained` of a PEFT model.
+
+    Returns:
+        str: Hex SHA-256 digest over the adapter files.
+    """
+    digest = hashlib.sha256()
+    found = False
+    for file_name in ADAPTER_FILES:
+        file_path = os.path.join(adapter_path, file_name)
+        if not os.path.exists(file_path):
+            continue
+        found = True
+        digest.update(file_name.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+    if not found:
+        raise FileNotFoundError(f"No adapter files found in {adapter_path}")
+    return digest.hexdigest()
+
+
+def merged_checkpoint_dir(model_name: str, adapter_hash: str, root: str = None):
+    """Directory of the merged checkpoint for a base model and adapter hash."""
+    return os.path.join(root or conf.merged_model_path, f"{model_name.replace('/', '_')}_{adapter_hash[:16]}")
+
+
+def find_merged_checkpoint(model_name: str, adapter_path: str, root: str = None):
+    """
+    Look up a merged checkpoint exported for this base model and adapter.
+
+    Args:
+        model_name (str): Name of the base model.
+        adapter_path (str): Path to the adapter.
+        root (str, optional): Directory holding merged checkpoints. Defaults to `conf.merged_model_path`.
+
+    Returns:
+        str or None: The checkpoint directory if its manifest matches, else None.
+    """
+    if not os.path.isdir(adapter_path):
+        return None
+
+    adapter_hash = adapter_fingerprint(adapter_path)
+    checkpoint_dir = merged_checkpoint_dir(model_name, adapter_hash, root)
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("base_model") != model_name or manifest.get("adapter_hash") != adapter_hash:
+        return None
+    return checkpoint_dir
+
+
+def export_merged(model_name: str, adapter_path: str, root: str = None, dtype: str = "bfloat16"):
+    """
+    Merge a LoRA adapter into its base weights and save the result as safetensors.
+
+    The checkpoint is written next to a manifest keyed by the base model and
+    adapter hash, which `ItriModel` uses to load it instead of base + adapter.
+
+    Args:
+        model_name (str): Name of the base model.
+        adapter_path (str): Path to the adapter.
+        root (str, optional): Directory for merged checkpoints. Defaults to `conf.merged_model_path`.
+        dtype (str): Dtype of the saved weights. Defaults to "bfloat16".
+
+    Returns:
+        str: The checkpoint directory.
+    """
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    adapter_hash = adapter_fingerprint(adapter_path)
+    checkpoint_dir = merged_checkpoint_dir(model_name, adapter_hash, root)
+    staging_dir = f"{checkpoint_dir}.partial"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    print(f"Merging adapter {adapter_path} into {model_name}...")
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=getattr(torch, dtype), low_cpu_mem_usage=True)
+    model = PeftModel.from_pretrained(model, adapter_path).merge_and_unload()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    model.save_pretrained(staging_dir, safe_serialization=True)
+    tokenizer.save_pretrained(staging_dir)
+    manifest = {
+        "base_model": model_name,
+        "adapter_path": adapter_path,
+        "adapter_hash": adapter_hash,
+        "dtype": dtype,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(staging_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap the finished export in at once so a crash never leaves a half-written checkpoint
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.replace(staging_dir, checkpoint_dir)
+    print(f"Merged checkpoint saved to {checkpoint_dir}")
+    return checkpoint_dir
+
+
+def onnx_checkpoint_dir(model_name: str, adapter_hash: str = None, root: str = None):
+    """Directory of the ONNX export for a base model and adapter hash (None for the base model alone)."""
+    suffix = adapter_hash[:16] if adapter_hash else "base"
+    return os.path.join(root or conf.onnx_model_path, f"{model_name.replace('/', '_')}_{suffix}")
+
+
+def find_onnx_checkpoint(model_name: str, adapter_path: str = None, root: str = None):
+    """
+    Look up an ONNX export for this base model and adapter.
+
+    Args:
+        model_name (str): Name of the base model.
+        adapter_path (str, optional): Path to the adapter. Defaults to None (the base model alone).
+        root (str, optional): Directory holding ONNX exports. Defaults to `conf.onnx_model_path`.
+
+    Returns:
+        str or None: The export directory if its manifest matches, else None.
+    """
+    adapter_hash = None
+    if adapter_path:
+        if not os.path.isdir(adapter_path):
+            return None
+        adapter_hash = adapter_fingerprint(adapter_path)
+
+    checkpoint_dir = onnx_checkpoint_dir(model_name, adapter_hash, root)
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("base_model") != model_name or manifest.get("adapter_hash") != adapter_hash:
+        return None
+    return checkpoint_dir
+
+
+def export_onnx(model_name: str, adapter_path: str = None, root: str = None, quantize: bool = False):
+    """
+    Export a base model, with its adapter merged in, to an ONNX decoder with KV-cache inputs and outputs.
+
+    The adapter is merged first, reusing a merged checkpoint from
+    `export_merged` when one exists. With `quantize`, the Linear weights are
+    additionally stored as dynamic int8 in `model_quantized.onnx`, next to
+    the float32 `model.onnx`.
+
+    Args:
+        model_name (str): Name of the base model, or a local model directory.
+        adapter_path (str, optional): Path to the adapter. Defaults to None (the base model alone).
+        root (str, optional): Directory for ONNX exports. Defaults to `conf.onnx_model_path`.
+        quantize (bool): Also write a dynamically int8-quantized graph. Defaults to False.
+
+    Returns:
+        str: The export directory.
+    """
+    from optimum.exporters.onnx import main_export
+
+    adapter_hash = adapter_fingerprint(adapter_path) if adapter_path else None
+    checkpoint_dir = onnx_checkpoint_dir(model_name, adapter_hash, root)
+    staging_dir = f"{checkpoint_dir}.partial"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    with tempfile.TemporaryDirectory() as merge_root:
+        source = model_name
+        if adapter_path:
+            # ONNX graphs are traced in float32, so merge at full precision unless a merge exists
+            source = find_merged_checkpoint(model_name, adapter_path) or export_merged(
+                model_name, adapter_path, root=merge_root, dtype="float32"
+            )
+        print(f"Exporting {source} to ONNX...")
+        main_export(source, output=staging_dir, task="text-generation-with-past")
+
+    files = [ONNX_FILE]
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("Quantizing the ONNX graph to dynamic int8...")
+        quantize_dynamic(
+            os.path.join(staging_dir, ONNX_FILE),
+            os.path.join(staging_dir, ONNX_QUANTIZED_FILE),
+            weight_type=QuantType.QInt8,
+            # Graphs over 2 GB keep their weights in a separate file
+            use_external_data_format=os.path.exists(os.path.join(staging_dir, ONNX_FILE + "_data"))
+        )
+        files.append(ONNX_QUANTIZED_FILE)
+
+    manifest = {
+        "base_model": model_name,
+        "adapter_path": adapter_path,
+        "adapter_hash": adapter_hash,
+        "format": "onnx",
+        "files": files,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(staging_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.replace(staging_dir, checkpoint_dir)
+    print(f"ONNX export saved to {checkpoint_dir}")
+    return checkpoint_dir
@@ -0,0 +1,180 @@
+import json
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from src import registry
+
+
+class RemoteItriModel:
+    """
+    Client for a model kept resident by model_server.py, mirroring the ItriModel generation API.
+
+    The model is loaded on the server the first time it is requested, and
+    stays loaded for later runs.
+    """
+
+    def __init__(self, server_url: str, model_name: str, adapter_path: str = None, backend: str = None,
+                 timeout: float = None, **load_kwargs):
+        """
+        Args:
+            server_url (str): Base URL of the model server, e.g. "http://127.0.0.1:8765".
+            model_name (str): Name of the base model.
+            adapter_path (str, optional): Path to the adapter, as seen by the server. Defaults to None.
+            backend (str, optional): Backend the server loads the model with. Defaults to None.
+            timeout (float, optional): Seconds to wait for a response. Defaults to None (no limit).
+            **load_kwargs: Extra `ItriModel` arguments used when the server loads the model.
+        """
+        self.server_url = server_url.rstrip("/")
+        self.model_name = model_name
+        self.adapter_path = adapter_path
+        self.backend = backend
+        self.timeout = timeout
+        self.load_kwargs = load_kwargs
+        self.device = f"remote ({self.server_url})"
+        self.draft = None
+        self.prompt_prefix = None
+        self._adapter_disabled = False
+        self._info = None
+
+    def set_prompt_prefix(self, prefix: str):
+        """Send `prefix` with every request so the server reuses its cached KV states."""
+        self.prompt_prefix = prefix
+
+    def info(self):
+        """
+        Fetch the quantization and default decoding settings of the server's model, once per client.
+
+        Returns:
+            dict: "quantization", "generation_kwargs", "stop_at_qa_json", "constrain_qa_json"
+                and "qa_categories", as resolved by the server.
+        """
+        if self._info is None:
+            self._info = request_json(self.server_url + "/info", {**self._model_payload(), "disable_adapter": False},
+                                      timeout=self.timeout)
+        return self._info
+
+    # The server's defaults, so that e.g. the generation cache sees whether requests sample
+    @property
+    def quantization(self):
+        return self.info()["quantization"]
+
+    @property
+    def generation_kwargs(self):
+        return self.info()["generation_kwargs"]
+
+    @property
+    def stop_at_qa_json(self):
+        return self.info()["stop_at_qa_json"]
+
+    @property
+    def constrain_qa_json(self):
+        return self.info()["constrain_qa_json"]
+
+    @property
+    def qa_categories(self):
+        return self.info()["qa_categories"]
+
+    @contextmanager
+    def adapter_disabled(self):
+        """Run requests on the server's base model with the adapter switched off."""
+        self._adapter_disabled = True
+        try:
+            yield self
+        finally:
+            self._adapter_disabled = False
+
+    def generate(self, prompt: str, **generation_kwargs):
+        return self.generate_batch([prompt], batch_size=1, **generation_kwargs)[0]
+
+    def generate_batch(self, prompts: list, batch_size: int = 8, show_progress: bool = False, **generation_kwargs):
+        """Generate on the server; see `ItriModel.generate_batch`. `show_progress` is ignored."""
+        response = request_json(self.server_url + "/generate", {
+            **self._model_payload(),
+            # The prefix KV states belong to the adapter model
+            "prompt_prefix": None if self._adapter_disabled else self.prompt_prefix,
+            "prompts": list(prompts),
+            "batch_size": batch_size,
+            "generation_kwargs": generation_kwargs,
+        }, timeout=self.timeout)
+        return response["outputs"]
+
+    def generate_candidates(self, prompts: list, num_candidates: int, batch_size: int = 8,
+                            show_progress: bool = False, diverse: bool = False, **generation_kwargs):
+        """Generate several answers per prompt on the server; see `ItriModel.generate_candidates`."""
+        response = request_json(self.server_url + "/generate", {
+            **self._model_payload(),
+            "prompt_prefix": None if self._adapter_disabled else self.prompt_prefix,
+            "prompts": list(prompts),
+            "batch_size": batch_size,
+            "num_candidates": num_candidates,
+            "diverse": diverse,
+            "generation_kwargs": generation_kwargs,
+        }, timeout=self.timeout)
+        return response["outputs"]
+
+    def score_continuations(self, prompts: list, continuations: list, batch_size: int = 8, show_progress: bool = False):
+        """Score continuations on the server; see `ItriModel.score_continuations`. `show_progress` is ignored."""
+        response = request_json(self.server_url + "/score", {
+            **self._model_payload(),
+            "prompts": list(prompts),
+            "continuations": list(continuations),
+            "batch_size": batch_size,
+        }, timeout=self.timeout)
+        return response["scores"]
+
+    def _model_payload(self):
+        """Fields telling the server which resident model to use."""
+        return {
+            "model_name": self.model_name,
+            "adapter_path": self.adapter_path,
+            "backend": self.backend,
+            "load_kwargs": self.load_kwargs,
+            "disable_adapter": self._adapter_disabled,
+        }
+
+
+def request_json(url: str, payload: dict = None, timeout: float = None):
+    """
+    Send a JSON request (POST with a payload, GET without) and decode the JSON response.
+
+    Raises:
+        RuntimeError: If the server answers with an error status.
+    """
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"Model server error {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+
+
+def is_server_running(server_url: str, timeout: float = 1.0):
+    """Return True if a model server answers the health check at `server_url`."""
+    try:
+        return request_json(server_url.rstrip("/") + "/health", timeout=timeout).get("status") == "ok"
+    except (OSError, ValueError):
+        return False
+
+
+def connect_or_load(server_url: str, model_name: str, adapter_path: str = None, backend: str = None, **load_kwargs):
+    """
+    Use the warm model server when it is running, otherwise load the model in this process.
+
+    Args:
+        server_url (str): Base URL of the model server, or None to always load locally.
+        model_name (str): Name of the base model.
+        adapter_path (str, optional): Path to the adapter. Defaults to None.
+        backend (str, optional): Backend for the model. Defaults to None.
+        **load_kwargs: Extra `ItriModel` arguments.
+
+    Returns:
+        RemoteItriModel or ItriModel: A model exposing `generate`/`generate_batch`.
+    """
+    if server_url:
+        if is_server_running(server_url):
+            print(f"Using model server at {server_url}")
+            return RemoteItriModel(server_url, model_name, adapter_path, backend, **load_kwargs)
+        print(f"No model server running at {server_url}, loading the model in-process")
+    return registry.get_model(model_name, adapter_path, backend=backend, **load_kwargs)
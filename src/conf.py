@@ -1,5 +1,3 @@
-from peft import LoraConfig
-
 # Model config
 model_config = {
     "temperature": 0.2,
@@ -11,6 +9,96 @@ model_config = {
     "early_stopping": True,
 }
 
+# Inference backend for ItriModel: "cuda" (8-bit bitsandbytes), "cpu", or "onnx" (ONNX Runtime).
+# None selects "cuda" when a GPU is available and "cpu" otherwise.
+backend = None
+
+# CPU backend config
+cpu_backend_config = {
+    "dtype": "bfloat16",  # Weight dtype when quantize_dynamic is off: "bfloat16" or "float32"
+    "quantize_dynamic": True,  # PyTorch dynamic int8 quantization of the Linear layers (float32 only)
+    "attn_implementation": "sdpa",
+    # Preallocated KV cache, required for torch.compile to avoid recompiles; cached prompt prefixes
+    # and shared prefills are copied into it
+    "static_cache": True,
+    "compile": False,
+}
+
+# Assisted (speculative) decoding: the fine-tuned 1B drafts tokens that the 3B QA model verifies.
+# Set draft_model_name to e.g. "meta-llama/Llama-3.2-1B" to enable it.
+draft_model_name = None
+draft_adapter_path = None
+num_assistant_tokens = 5
+
+# Stop generating once the {"question", "answer"} JSON object is closed
+stop_at_qa_json = True
+
+# Grammar-constrained decoding of the QA JSON; qa_categories adds a "category" enum key
+constrain_qa_json = False
+qa_categories = None  # e.g. ("method", "knowledge", "discussion")
+
+# Labels for categorizing QA sets by scoring each one after the prompt (src/categorize.py);
+# calibration divides out the model's preference for labels on content-free inputs
+category_labels = ["method", "knowledge", "discussion"]
+calibrate_categories = True
+
+# Versioned hashed n-gram classifiers trained with train_classifier.py; generate_QA.py
+# falls back to LLM label scoring when the classifier's top probability is below the threshold
+category_classifier_path = "models/category_classifier/"
+category_confidence_threshold = 0.6
+
+# Local model server started with model_server.py; used by the entry scripts' --server option
+server_url = "http://127.0.0.1:8765"
+
+# Continuous-batching QA service started with qa_service.py
+service_config = {
+    "max_batch_tokens": 16384,  # Prompt plus new tokens all running sequences may reserve
+    "max_batch_size": 32,
+    "request_timeout": 120.0,  # Seconds before a request is cancelled
+}
+service_url = "http://127.0.0.1:8766"
+
+# Persistent cache of generated outputs (src/cache.py), evicted least recently used beyond the cap
+use_generation_cache = True
+cache_path = "data/cache/generations.sqlite"
+cache_max_entries = 100000
+
+# Seconds between rewrites of the Prometheus metrics file (--prometheus_path)
+prometheus_interval = 15.0
+
+# Number of prompts generated together by ItriModel.generate_batch, or "auto" to size batches in
+# tokens from the free memory with the planner in src/planner.py
+batch_size = 8
+
+# Memory planner for batch_size="auto" and finetune.py's training micro-batch
+planner_config = {
+    "memory_fraction": 0.6,  # Share of the memory free at startup that batches may use
+    "min_batch_tokens": 512,
+    "max_batch_tokens": 131072,
+    "default_batch_tokens": 8192,  # Used where free memory cannot be determined
+    "max_batch_size": 64,  # Rows per generation batch
+    "max_micro_batch": 16,
+}
+
+# QA pairs generated per abstract by generate_QA.py (--num_qa). The candidates share one prefill
+# and are sampled, or come from diverse beam search with --diverse_qa; questions whose word-level
+# similarity reaches qa_dedup_threshold are dropped as duplicates
+num_qa = 1
+diversity_penalty = 1.0
+qa_dedup_threshold = 0.8
+
+# Cascade in generate_QA.py (--cascade): the fine-tuned 1B generates first and only abstracts whose
+# QA sets all fail the validators in src/qa_validation.py are regenerated with the 3B model
+cascade_model_name = "meta-llama/Llama-3.2-1B"
+cascade_adapter_path = "models/experiment/meta-llama_Llama-3.2-1B_QA25"
+generic_question_patterns = [
+    r"\b(purpose|aim|objective|goal)s? of (this|the) (study|paper|article|research|work)\b",
+    r"\bwhat (is|was) (this|the) (study|paper|article|abstract) about\b",
+    r"\bwhat did (this|the) (study|paper|article|research|authors?) (find|show|investigate|conclude)\b",
+    r"\bwhat (are|were) the (main |key )?(findings|results|conclusions) of (this|the) (study|paper|article)\b",
+]
+min_answer_grounding = 0.5  # Fraction of the answer's content words that must occur in the abstract
+
 # Tokenizer config
 tokenizer_config = {
     "return_tensors": "pt",
@@ -19,13 +107,20 @@ tokenizer_config = {
     "max_length": 4096
 }
 # Default configuration for a Q&A task using LoRA
-lora_config = LoraConfig(
-    r=16,
-    target_modules=["q", "v"],
-    lora_alpha=32,
-    lora_dropout=0.1,
-    bias="lora_only"
-)
+lora_config_kwargs = {
+    "r": 16,
+    "target_modules": ["q", "v"],
+    "lora_alpha": 32,
+    "lora_dropout": 0.1,
+    "bias": "lora_only"
+}
+
+
+def get_lora_config():
+    """Build the default LoraConfig; peft is imported here so reading the config stays cheap."""
+    from peft import LoraConfig
+    return LoraConfig(**lora_config_kwargs)
+
 
 model_name = "meta-llama/Llama-3.2-1B"
 
@@ -37,6 +132,19 @@ results_path = "results/"
 # TODO: Adapter Path
 adapter_path = "models/experiment/meta-llama_Llama-3.2-3B_r16alpha32_Fixed_5epoch_QA25"
 
+# Merged adapter checkpoints written by export_model.py; ItriModel loads them instead of base + adapter,
+# except for models whose base weights are also needed (need_base, e.g. generate_QA.py's categorization)
+merged_model_path = "models/merged/"
+use_merged_checkpoints = True
+
+# ONNX Runtime backend (backend = "onnx"), loading exports written by `export_model.py --format onnx`
+onnx_model_path = "models/onnx/"
+onnx_backend_config = {
+    "quantized": False,  # Load model_quantized.onnx (exported with --quantize) instead of model.onnx
+    "provider": "CPUExecutionProvider",
+    "intra_op_num_threads": None,  # None lets ONNX Runtime use every core
+}
+
 # Directory stores all the templates
 template_path = "prompt/templates/"
 
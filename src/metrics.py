@@ -0,0 +1,191 @@
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Returned by `timer` while metrics are disabled, so instrumented code pays one attribute check
+_DISABLED = nullcontext()
+
+
+class Metrics:
+    """
+    Process-wide stage timers, counters and distributions for the generation pipeline.
+
+    Disabled by default; `timer` then returns a shared no-op context and the
+    recording methods return immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._periodic = None
+        self.reset()
+
+    def reset(self):
+        """Clear everything recorded so far."""
+        self.started = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.distributions = {}
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        return self
+
+    def timer(self, name: str):
+        """
+        Time a block as stage `name`.
+
+        Args:
+            name (str): Stage name, e.g. "model.prefill" or "pipeline.write".
+
+        Returns:
+            A context manager recording the block's wall time.
+        """
+        if not self.enabled:
+            return _DISABLED
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start)
+
+    def record_time(self, name: str, seconds: float):
+        """Add a measured duration to stage `name`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+
+    def add(self, name: str, value: int = 1):
+        """Increase counter `name`, e.g. "model.tokens_out"."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        """Record one value of distribution `name`, e.g. a batch size."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.distributions.setdefault(name, {"count": 0, "sum": 0, "min": value, "max": value})
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+
+    @staticmethod
+    def peak_rss_bytes():
+        """Peak resident set size of this process."""
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def summary(self):
+        """
+        Summarize the run so far.
+
+        Returns:
+            dict: Timers, counters and distributions, plus tokens/s for the prefill and
+                decode stages and the peak RSS.
+        """
+        with self._lock:
+            timers = {name: dict(stage) for name, stage in self.timers.items()}
+            counters = dict(self.counters)
+            distributions = {
+                name: {**stats, "mean": stats["sum"] / stats["count"]}
+                for name, stats in self.distributions.items()
+            }
+
+        throughput = {}
+        for stage, counter in (("model.prefill", "model.tokens_in"), ("model.decode", "model.tokens_out")):
+            seconds = timers.get(stage, {}).get("seconds")
+            if seconds and counter in counters:
+                throughput[f"{stage}.tokens_per_second"] = counters[counter] / seconds
+
+        return {
+            "pid": os.getpid(),
+            "wall_seconds": time.time() - self.started,
+            "peak_rss_bytes": self.peak_rss_bytes(),
+            "timers": timers,
+            "counters": counters,
+            "distributions": distributions,
+            "throughput": throughput,
+        }
+
+    def write_summary(self, path: str):
+        """Write `summary()` as JSON."""
+        _write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def prometheus_text(self):
+        """Render the current metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            "# TYPE itri_stage_seconds_total counter",
+            *(f'itri_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}'
+              for name, stage in summary["timers"].items()),
+            "# TYPE itri_stage_calls_total counter",
+            *(f'itri_stage_calls_total{{stage="{name}"}} {stage["calls"]}'
+              for name, stage in summary["timers"].items()),
+        ]
+        for name, value in summary["counters"].items():
+            metric = f"itri_{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, stats in summary["distributions"].items():
+            metric = f"itri_{_metric_name(name)}"
+            lines += [f"# TYPE {metric} summary", f"{metric}_count {stats['count']}", f"{metric}_sum {stats['sum']}"]
+        lines += ["# TYPE itri_peak_rss_bytes gauge", f"itri_peak_rss_bytes {summary['peak_rss_bytes']}"]
+        return "\n".join(lines) + "\n"
+
+    def start_prometheus(self, path: str, interval: float):
+        """Rewrite `path` with `prometheus_text()` every `interval` seconds, e.g. for a textfile collector."""
+        if self._periodic is not None:
+            return
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                _write_atomic(path, self.prometheus_text())
+
+        thread = threading.Thread(target=loop, name="metrics-prometheus", daemon=True)
+        thread.start()
+        self._periodic = (thread, stop, path)
+
+    def stop_prometheus(self):
+        """Stop the periodic output after writing it one last time."""
+        if self._periodic is None:
+            return
+        thread, stop, path = self._periodic
+        stop.set()
+        thread.join()
+        _write_atomic(path, self.prometheus_text())
+        self._periodic = None
+
+
+def _metric_name(name: str):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _write_atomic(path: str, text: str):
+    """Replace `path` in one step so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.partial"
+    with open(partial, "w") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+# Shared by ItriModel and the entry scripts; enabled by the scripts' --metrics_path
+metrics = Metrics()
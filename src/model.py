@@ -1,7 +1,22 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import (
+    AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, DynamicCache, LogitsProcessorList, StaticCache,
+    StoppingCriteriaList
+)
 from peft import PeftModel, PeftConfig
 import torch
 import os
+import hashlib
+import re
+import time
+from contextlib import contextmanager
+from tqdm import tqdm
+import src.conf as conf
+from src.streaming import GenerationStream, TimedTextStreamer
+from src.qa_decoding import QAJsonLogitsProcessor, QAJsonStoppingCriteria
+from src.sampling import RowSeededSampler, row_seed
+from src.checkpoints import ONNX_FILE, ONNX_QUANTIZED_FILE, find_merged_checkpoint, find_onnx_checkpoint
+from src.metrics import metrics
+from src.planner import AUTO, MemoryPlanner, is_out_of_memory, release_memory
 from abc import ABC, abstractmethod
 
 
@@ -30,40 +45,228 @@ class BaseLLMModel(ABC):
         """Generate text based on input."""
         pass
 
+    @abstractmethod
+    def generate_batch(self, prompts: list, batch_size: int = 8):
+        """Generate text for several inputs, returned in input order."""
+        pass
+
     @abstractmethod
     def save_model(self, base_save_path: str):
         """Save the model and tokenizer with versioning."""
         pass
 
 
+class _ForwardCounter:
+    """Forward hook that counts how many times a module is called."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, module, args, output):
+        self.count += 1
+
+
+class _FirstForwardTimer:
+    """Forward hook that records when the first forward pass (the prefill) finished."""
+
+    def __init__(self):
+        self.finished = None
+
+    def __call__(self, module, args, output):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+
 class ItriModel(BaseLLMModel):
-    def __init__(self, model_name: str, adapter_path: str = None):
+    BACKENDS = ("cuda", "cpu", "onnx")
+
+    def __init__(self, model_name: str, adapter_path: str = None, backend: str = None, training: bool = False,
+                 draft_model_name: str = None, draft_adapter_path: str = None, num_assistant_tokens: int = None,
+                 adapter_paths: list = None, need_base: bool = False):
         """
         Initialize the model, tokenizer, and optionally apply an adapter.
 
         Args:
             model_name (str): Name of the base model.
-            adapter_path (str, optional): Path to the adapter. Defaults to None.
-            device (str): Device to load the model on. Defaults to "cuda" if available.
+            adapter_path (str, optional): Path to the adapter. A merged checkpoint exported for it
+                with export_model.py is loaded instead when available. Defaults to None.
+            backend (str, optional): "cuda" (8-bit bitsandbytes), "cpu", or "onnx" (ONNX Runtime
+                on an export from `export_model.py --format onnx`). Defaults to `conf.backend`,
+                or "cuda" when available and "cpu" otherwise.
+            training (bool): Keep the model trainable with gradient checkpointing instead
+                of applying the inference profile. Defaults to False.
+            draft_model_name (str, optional): Smaller model with the same tokenizer that drafts
+                tokens for assisted (speculative) decoding. Defaults to None (disabled).
+            draft_adapter_path (str, optional): Adapter applied to the draft model. Defaults to None.
+            num_assistant_tokens (int, optional): Tokens the draft proposes per verification step.
+                Defaults to `conf.num_assistant_tokens`.
+            adapter_paths (list[str], optional): Further adapters loaded onto the same base weights
+                and selected with `set_adapter` or per prompt. Merged checkpoints are not used then.
+                Defaults to None.
+            need_base (bool): The base weights will also be used with the adapter disabled, so
+                the adapter is applied to the base model even when a merged checkpoint exists.
+                Defaults to False.
         """
         super().__init__(model_name)
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tokenizer = self.load_tokenizer(model_name)
-        self.model = self.load_model(model_name)
+        self.backend = self.resolve_backend(backend)
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend}, expected one of {self.BACKENDS}")
+        if training and self.backend == "onnx":
+            raise ValueError("ONNX Runtime models are inference-only; use the cpu or cuda backend for training")
+        adapter_paths = [path for path in adapter_paths or [] if path != adapter_path]
+        if adapter_paths and self.backend == "onnx":
+            raise ValueError("ONNX exports have one adapter merged in; use the cpu or cuda backend for several "
+                             "adapters")
+        if adapter_paths and not adapter_path:
+            adapter_path, adapter_paths = adapter_paths[0], adapter_paths[1:]
+        self.quantization = self.quantization_for(self.backend)
+        self.device = "cuda" if self.backend == "cuda" else "cpu"
+        self.training = training
+        self.adapter_path = adapter_path
+        self.max_input_length = 8192
+        self.generation_kwargs = {
+            "max_new_tokens": 200,  # Increased from 128 to allow for longer responses
+            "do_sample": True,  # Keep sampling for diversity
+            "num_beams": 5,  # Increased from 2 to explore a broader search space
+            "temperature": 0.7,  # Added to control randomness
+            "top_k": 50,  # Focus on the top 50 tokens
+            "top_p": 0.9,
+            "early_stopping": True,
+        }
+        # End each sequence as soon as its {"question", "answer"} object is closed
+        self.stop_at_qa_json = conf.stop_at_qa_json
+        # Constrain decoding to the QA JSON grammar, optionally with a category enum
+        self.constrain_qa_json = conf.constrain_qa_json
+        self.qa_categories = conf.qa_categories
+        # KV caches of static prompt prefixes, keyed by (model, adapter, prefix hash)
+        self.prompt_prefix = None
+        self._prefix_caches = {}
+        self._adapter_enabled = True
+        # Adapters loaded onto the base weights, mapped to their PEFT adapter names
+        self.adapters = {}
+        self._base_quantized = False
+        self._planner = None
 
-        if adapter_path:
+        # A checkpoint exported with the adapter merged in skips the LoRA matmuls at inference
+        self.merged_checkpoint = None
+        if self.backend == "onnx":
+            # ONNX exports always have the adapter merged in
+            self.merged_checkpoint = self.find_onnx_export(model_name, adapter_path)
+        elif adapter_path and conf.use_merged_checkpoints and not adapter_paths and not need_base:
+            self.merged_checkpoint = find_merged_checkpoint(model_name, adapter_path)
+        weights_path = self.merged_checkpoint or model_name
+        if self.merged_checkpoint:
+            print(f"Loading merged checkpoint from {self.merged_checkpoint}...")
+
+        self.tokenizer = self.load_tokenizer(weights_path)
+        self.model = self.load_model(weights_path)
+
+        if adapter_path and not self.merged_checkpoint:
             self.apply_adapter(adapter_path)
+        for path in adapter_paths:
+            self.load_adapter(path)
 
         self.apply_perf_optimizations()
 
+        self.draft = None
+        if draft_model_name:
+            self.load_draft_model(draft_model_name, draft_adapter_path, num_assistant_tokens)
+
+    @staticmethod
+    def resolve_backend(backend: str = None):
+        """Return the backend to use: the given one, `conf.backend`, or cuda/cpu by availability."""
+        return backend or conf.backend or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    @staticmethod
+    def quantization_for(backend: str):
+        """Describe how a backend stores the weights, e.g. for keying shared models."""
+        if backend == "cuda":
+            return "bnb-int8"
+        if backend == "onnx":
+            return "onnx-int8" if conf.onnx_backend_config["quantized"] else "onnx-float32"
+        cpu_config = conf.cpu_backend_config
+        return "dynamic-int8" if cpu_config["quantize_dynamic"] else cpu_config["dtype"]
+
+    @staticmethod
+    def find_onnx_export(model_name: str, adapter_path: str = None):
+        """
+        Locate the ONNX export for a model and adapter.
+
+        Args:
+            model_name (str): Name of the base model, or a directory holding a `model.onnx` export.
+            adapter_path (str, optional): Path to the adapter merged into the export. Defaults to None.
+
+        Returns:
+            str: The export directory.
+
+        Raises:
+            FileNotFoundError: If the model has not been exported.
+        """
+        if os.path.exists(os.path.join(model_name, ONNX_FILE)) and not adapter_path:
+            return model_name
+        export_dir = find_onnx_checkpoint(model_name, adapter_path)
+        if export_dir is None:
+            raise FileNotFoundError(
+                f"No ONNX export of {model_name} with adapter {adapter_path} in {conf.onnx_model_path}; "
+                f"create one with export_model.py --format onnx"
+            )
+        return export_dir
+
+    @property
+    def can_disable_adapter(self):
+        """Whether `adapter_disabled` can expose the base weights, i.e. the adapter is not merged."""
+        return isinstance(self.model, PeftModel) or not self.adapter_path
+
+    @contextmanager
+    def adapter_disabled(self):
+        """
+        Run the model with its adapter switched off, reusing the loaded base weights.
+
+        Raises:
+            RuntimeError: If the adapter has been merged into the weights.
+        """
+        if isinstance(self.model, PeftModel):
+            self._adapter_enabled = False
+            try:
+                with self.model.disable_adapter():
+                    yield self
+            finally:
+                self._adapter_enabled = True
+        elif self.adapter_path:
+            raise RuntimeError(f"The adapter of {self.model_name} is merged into the weights and cannot be disabled")
+        else:
+            yield self
+
     def load_tokenizer(self, model_name: str):
         """Load the tokenizer and add a padding token if needed."""
         tokenizer = AutoTokenizer.from_pretrained(model_name)
-        if tokenizer.pad_token is None:
+        if tokenizer.pad_token is None and self.backend == "onnx":
+            # The exported graph's vocabulary cannot grow; padded positions are masked out anyway
+            tokenizer.pad_token = tokenizer.eos_token
+        elif tokenizer.pad_token is None:
             tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+        # Decoder-only models continue from the last position, so pad on the left
+        tokenizer.padding_side = "left"
         return tokenizer
 
     def load_model(self, model_name: str):
+        """
+        Load the model with the loader for the selected backend.
+        """
+        if self.backend == "onnx":
+            return self._load_onnx_model(model_name)
+        if self.backend == "cpu":
+            model = self._load_cpu_model(model_name)
+        else:
+            model = self._load_cuda_model(model_name)
+
+        # Resize token embeddings if tokenizer is updated
+        if len(self.tokenizer) > model.config.vocab_size:
+            model.resize_token_embeddings(len(self.tokenizer))
+
+        return model
+
+    def _load_cuda_model(self, model_name: str):
         """
         Load the model with memory-efficient configurations using BitsAndBytesConfig.
         """
@@ -83,12 +286,55 @@ class ItriModel(BaseLLMModel):
             trust_remote_code=True  # Enable custom model implementations
         )
 
-        # Resize token embeddings if tokenizer is updated
-        if len(self.tokenizer) > model.config.vocab_size:
-            model.resize_token_embeddings(len(self.tokenizer))
+        return model
+
+    def _load_cpu_model(self, model_name: str):
+        """
+        Load full-precision weights for CPU inference without bitsandbytes.
+
+        Dynamic int8 quantization only supports float32 Linear layers, so the
+        configured dtype is ignored when `quantize_dynamic` is enabled.
+        """
+        cpu_config = conf.cpu_backend_config
+        dtype = torch.float32 if cpu_config["quantize_dynamic"] else getattr(torch, cpu_config["dtype"])
+
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=dtype,
+            attn_implementation=cpu_config["attn_implementation"],
+            low_cpu_mem_usage=True,
+            trust_remote_code=True
+        )
 
         return model
 
+    def _load_onnx_model(self, export_dir: str):
+        """
+        Load an ONNX export into an ONNX Runtime session that generates like a transformers model.
+
+        The graph takes and returns the KV cache, so each decode step only
+        runs the new token.
+        """
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForCausalLM
+
+        onnx_config = conf.onnx_backend_config
+        file_name = ONNX_QUANTIZED_FILE if onnx_config["quantized"] else ONNX_FILE
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            raise FileNotFoundError(f"{file_name} not found in {export_dir}; export with --quantize for int8")
+
+        session_options = onnxruntime.SessionOptions()
+        if onnx_config["intra_op_num_threads"]:
+            session_options.intra_op_num_threads = onnx_config["intra_op_num_threads"]
+        return ORTModelForCausalLM.from_pretrained(
+            export_dir,
+            file_name=file_name,
+            provider=onnx_config["provider"],
+            session_options=session_options,
+            use_cache=True,
+            use_io_binding=False
+        )
+
     def apply_adapter(self, adapter_path: str):
         """
         Apply an adapter to the loaded model.
@@ -98,47 +344,808 @@ class ItriModel(BaseLLMModel):
         """
         print(f"Loading adapter from {adapter_path}...")
         self.model = PeftModel.from_pretrained(self.model, adapter_path)
+        self.adapters[adapter_path] = "default"
+
+    @staticmethod
+    def adapter_name_for(adapter_path: str):
+        """PEFT adapter name for a path; module names may not contain dots."""
+        return re.sub(r"\W", "_", os.path.normpath(adapter_path))
+
+    def load_adapter(self, adapter_path: str):
+        """
+        Load another LoRA adapter onto the base weights without activating it.
+
+        Only the low-rank adapter matrices are read, so loading takes
+        milliseconds and adds a few MB per adapter.
+
+        Args:
+            adapter_path (str): Path to the adapter.
+
+        Returns:
+            str: The PEFT name of the adapter.
+
+        Raises:
+            RuntimeError: If the model has no unmerged adapter to add to, or its base layers
+                were dynamically quantized after loading.
+        """
+        if adapter_path in self.adapters:
+            return self.adapters[adapter_path]
+        if not isinstance(self.model, PeftModel):
+            raise RuntimeError(f"{self.model_name} has no unmerged adapter to add to; "
+                               f"load it with adapter_paths to switch between adapters")
+        if self._base_quantized:
+            raise RuntimeError("LoRA layers cannot be added to dynamically quantized weights; pass every adapter "
+                               "as adapter_paths when loading the model, or disable quantize_dynamic")
+
+        start = time.perf_counter()
+        name = self.adapter_name_for(adapter_path)
+        self.model.load_adapter(adapter_path, adapter_name=name)
+        self.adapters[adapter_path] = name
+        print(f"Loaded adapter {adapter_path} in {time.perf_counter() - start:.3f}s")
+        return name
+
+    def set_adapter(self, adapter_path: str):
+        """
+        Select the adapter used by later calls, loading it first if needed.
+
+        The registered prompt prefix is re-cached for the adapter the first
+        time it is selected, since its KV states depend on the adapter.
+
+        Args:
+            adapter_path (str): Path to the adapter.
+        """
+        if adapter_path == self.adapter_path:
+            return
+        name = self.load_adapter(adapter_path)
+        self.model.set_adapter(name)
+        self.adapter_path = adapter_path
+        if self.prompt_prefix:
+            self.set_prompt_prefix(self.prompt_prefix[0])
+
+    @contextmanager
+    def using_adapter(self, adapter_path: str):
+        """Select an adapter (None for the base weights) for the enclosed calls, then restore the previous one."""
+        if adapter_path is None:
+            with self.adapter_disabled():
+                yield self
+            return
+        previous = self.adapter_path
+        self.set_adapter(adapter_path)
+        try:
+            yield self
+        finally:
+            if previous:
+                self.set_adapter(previous)
+
+    def load_draft_model(self, draft_model_name: str, draft_adapter_path: str = None, num_assistant_tokens: int = None):
+        """
+        Load a draft model that proposes tokens for this model to verify.
+
+        The draft must share this model's tokenizer, e.g. the fine-tuned
+        Llama-3.2-1B drafting for Llama-3.2-3B.
+
+        Args:
+            draft_model_name (str): Name of the draft base model.
+            draft_adapter_path (str, optional): Adapter applied to the draft model. Defaults to None.
+            num_assistant_tokens (int, optional): Tokens proposed per verification step.
+                Defaults to `conf.num_assistant_tokens`.
+        """
+        print(f"Loading draft model {draft_model_name} for assisted decoding...")
+        self.draft = ItriModel(draft_model_name, draft_adapter_path, backend=self.backend)
+        if len(self.draft.tokenizer) != len(self.tokenizer):
+            raise ValueError(f"Draft model {draft_model_name} does not share the tokenizer of {self.model_name}")
+
+        # The assisted candidate generator reads its step size from the draft's generation config
+        generation_config = self._hf_model(self.draft.model).generation_config
+        generation_config.num_assistant_tokens = num_assistant_tokens or conf.num_assistant_tokens
+        self.reset_draft_stats()
+
+    def reset_draft_stats(self):
+        """Reset the counters behind `get_draft_stats`."""
+        self.draft_stats = {
+            "generations": 0,
+            "new_tokens": 0,
+            "target_forwards": 0,
+            "draft_forwards": 0,
+        }
+
+    def get_draft_stats(self):
+        """
+        Summarize assisted decoding since the last reset.
+
+        Every verification step of the target model accepts some draft tokens
+        and adds one token of its own, so accepted tokens are the new tokens
+        minus the target forward passes, and every draft forward pass proposes
+        one token.
+
+        Returns:
+            dict: Raw counters plus `acceptance_rate` and `tokens_per_target_forward`.
+        """
+        return self.summarize_draft_stats(self.draft_stats)
+
+    @staticmethod
+    def summarize_draft_stats(counters: dict):
+        """
+        Derive the acceptance figures of `get_draft_stats` from raw counters.
+
+        Args:
+            counters (dict): "generations", "new_tokens", "target_forwards" and "draft_forwards",
+                e.g. summed over the "model.draft_*" metrics of several workers.
+
+        Returns:
+            dict: The counters plus `accepted_tokens`, `acceptance_rate` and `tokens_per_target_forward`.
+        """
+        stats = dict(counters)
+        accepted = max(stats["new_tokens"] - stats["target_forwards"], 0)
+        stats["accepted_tokens"] = accepted
+        stats["acceptance_rate"] = accepted / stats["draft_forwards"] if stats["draft_forwards"] else 0.0
+        stats["tokens_per_target_forward"] = (
+            stats["new_tokens"] / stats["target_forwards"] if stats["target_forwards"] else 0.0
+        )
+        return stats
+
+    @staticmethod
+    def _hf_model(model):
+        """Return the underlying transformers model, unwrapping a PEFT adapter."""
+        return model.get_base_model() if isinstance(model, PeftModel) else model
 
     def apply_perf_optimizations(self):
-        """Enable performance optimizations to reduce memory usage."""
-        self.model.gradient_checkpointing_enable()  # Save memory during training/inference
+        """Apply the training profile, or the inference profile for the selected backend."""
+        if self.training:
+            self.model.gradient_checkpointing_enable()  # Save memory during training
+            return
+        if self.backend == "onnx":
+            # ONNX Runtime applies its own graph optimizations when the session is created
+            return
+
+        # Checkpointing only trades compute for activation memory in the backward pass
+        if getattr(self.model, "is_gradient_checkpointing", False):
+            self.model.gradient_checkpointing_disable()
+        self.model.eval()
+
+        if self.backend == "cpu":
+            self._apply_cpu_optimizations()
+
+    def _apply_cpu_optimizations(self):
+        """Quantize, switch to a static KV cache, and optionally compile for CPU inference."""
+        cpu_config = conf.cpu_backend_config
+
+        if cpu_config["quantize_dynamic"]:
+            layers = {torch.nn.Linear}
+            if isinstance(self.model, PeftModel):
+                # Quantize the base layers and leave the LoRA matrices in float, so the adapter can still be
+                # disabled (e.g. to categorize with the shared base weights) or switched
+                layers = {
+                    name for name, module in self.model.named_modules()
+                    if isinstance(module, torch.nn.Linear) and ".lora_" not in name
+                }
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, layers, dtype=torch.qint8)
+            self._base_quantized = True
 
-    def generate(self, prompt: str):
+        if cpu_config["static_cache"]:
+            self.generation_kwargs["cache_implementation"] = "static"
+
+        if cpu_config["compile"]:
+            self.model.forward = torch.compile(self.model.forward)
+
+    @property
+    def planner(self):
+        """The `MemoryPlanner` sizing `batch_size="auto"` batches, created on first use."""
+        if self._planner is None:
+            self._planner = MemoryPlanner.for_model(self)
+        return self._planner
+
+    def set_prompt_prefix(self, prefix: str):
+        """
+        Register the static text every prompt starts with and cache its KV states.
+
+        The prefix is prefilled once per (model, adapter, prefix hash); prompts
+        passed to `generate`/`generate_batch` that start with it reuse the
+        cached past_key_values and only prefill their own suffix.
+
+        Args:
+            prefix (str): The rendered template text before the first variable,
+                e.g. from `PromptManager.render_prefix`.
+        """
+        if self.backend == "onnx":
+            # ONNX Runtime sessions cannot resume from a cached prefix, so prompts are prefilled whole
+            return
+        prefix_hash = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        key = (self.model_name, self.adapter_path, prefix_hash)
+
+        if key not in self._prefix_caches:
+            prefix_ids = self.tokenizer(prefix, truncation=True, max_length=self.max_input_length)["input_ids"]
+            with torch.inference_mode():
+                past_key_values = self.model(
+                    torch.tensor([prefix_ids], device=self.device),
+                    past_key_values=DynamicCache(),
+                    use_cache=True
+                ).past_key_values
+            self._prefix_caches[key] = {"input_ids": prefix_ids, "past_key_values": past_key_values}
+
+        self.prompt_prefix = (prefix, key)
+
+    def generate(self, prompt: str, **generation_kwargs):
         """
         Generate an answer using the provided prompt.
 
         Args:
             prompt (str): The rendered prompt.
+            **generation_kwargs: Overrides for the default generation settings.
 
         Returns:
             str: The generated answer.
         """
-        inputs = self.tokenizer(
-            prompt,
-            return_tensors="pt",
-            padding=True,
+        return self.generate_batch([prompt], batch_size=1, **generation_kwargs)[0]
+
+    def generate_stream(self, prompt: str, do_sample: bool = False, **generation_kwargs):
+        """
+        Generate an answer and yield the decoded text as tokens are produced.
+
+        Streaming decodes one sequence, so it runs greedy search or sampling
+        rather than beam search.
+
+        Args:
+            prompt (str): The rendered prompt.
+            do_sample (bool): Sample instead of decoding greedily. Defaults to False.
+            **generation_kwargs: Overrides for the default generation settings.
+
+        Returns:
+            GenerationStream: Iterator over text increments; its `stats()` report
+                time to first token and inter-token latency once iteration ends.
+        """
+        overrides = {"num_beams": 1, "do_sample": do_sample, "early_stopping": False}
+        if not do_sample:
+            overrides.update(temperature=None, top_k=None, top_p=None)
+
+        (prefix_key, encoded), = self._encode_prompts([prompt]).items()
+        batch, kwargs = self._prepare_batch(list(encoded.values()), prefix_key, {**overrides, **generation_kwargs})
+        streamer = TimedTextStreamer(self.tokenizer)
+        kwargs["streamer"] = streamer
+
+        generate_fn = self._generate_assisted if self.draft is not None else self._run_generate
+        return GenerationStream(lambda: generate_fn(batch, kwargs), streamer)
+
+    def generate_batch(self, prompts: list, batch_size: int = 8, show_progress: bool = False,
+                       adapter_paths: list = None, **generation_kwargs):
+        """
+        Generate answers for several prompts in length-bucketed batches.
+
+        Prompts are sorted by token length and grouped into batches of
+        `batch_size`, so each batch is only left-padded to its own longest
+        prompt. Prompts starting with the registered prompt prefix reuse its
+        cached KV states and are batched separately from the others. Outputs
+        are returned in the original prompt order.
+
+        Args:
+            prompts (list[str]): The rendered prompts.
+            batch_size (int or str): Maximum number of prompts per forward pass, or "auto" to fill
+                each batch up to the memory planner's token budget. A batch that runs out of
+                memory is split in half and retried either way. Defaults to 8.
+            show_progress (bool): Display a progress bar over the batches. Defaults to False.
+            adapter_paths (list[str], optional): Adapter to generate each prompt with; prompts are
+                grouped by adapter and the current adapter is restored afterwards. Defaults to None
+                (the current adapter for every prompt).
+            **generation_kwargs: Overrides for the default generation settings, including
+                `stop_at_qa_json` to toggle stopping at the closed QA object,
+                `constrain_qa_json`/`qa_categories` for grammar-constrained decoding and
+                `seed` to make sampling reproducible; without beam search each prompt then
+                samples from its own stream, independent of the rest of the batch.
+
+        Returns:
+            list[str]: The generated answers, one per prompt.
+        """
+        candidates = self.generate_candidates(prompts, 1, batch_size, show_progress,
+                                              adapter_paths=adapter_paths, **generation_kwargs)
+        return [texts[0] for texts in candidates]
+
+    def generate_candidates(self, prompts: list, num_candidates: int, batch_size: int = 8,
+                            show_progress: bool = False, diverse: bool = False, adapter_paths: list = None,
+                            **generation_kwargs):
+        """
+        Generate several answers per prompt, prefilling each prompt only once.
+
+        Candidates are sampled with `num_return_sequences`, or with `diverse`
+        come from diverse beam search with one beam per group. Either way every
+        prompt is prefilled once and its KV states are copied to each
+        candidate, so the prompt cost is shared by all of them.
+
+        Args:
+            prompts (list[str]): The rendered prompts.
+            num_candidates (int): Answers to generate per prompt.
+            batch_size (int or str): Maximum number of prompts per forward pass, or "auto". Defaults to 8.
+            show_progress (bool): Display a progress bar over the batches. Defaults to False.
+            diverse (bool): Use diverse beam search instead of sampling. Defaults to False.
+            adapter_paths (list[str], optional): Adapter for each prompt, as for `generate_batch`.
+            **generation_kwargs: Overrides for the default generation settings, as for `generate_batch`.
+
+        Returns:
+            list[list[str]]: `num_candidates` answers per prompt, in prompt order.
+        """
+        if adapter_paths is not None:
+            if len(adapter_paths) != len(prompts):
+                raise ValueError(f"Got {len(adapter_paths)} adapter paths for {len(prompts)} prompts")
+            groups = {}
+            for index, adapter_path in enumerate(adapter_paths):
+                groups.setdefault(adapter_path, []).append(index)
+            # Start with the current adapter to save a switch
+            order = sorted(groups, key=lambda adapter_path: adapter_path != self.adapter_path)
+            outputs = [None] * len(prompts)
+            for adapter_path in order:
+                indices = groups[adapter_path]
+                with self.using_adapter(adapter_path):
+                    texts = self.generate_candidates(
+                        [prompts[index] for index in indices], num_candidates, batch_size, show_progress,
+                        diverse, **generation_kwargs
+                    )
+                for index, candidates in zip(indices, texts):
+                    outputs[index] = candidates
+            return outputs
+
+        if batch_size != AUTO and batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1 or '{AUTO}', got {batch_size}")
+        if num_candidates < 1:
+            raise ValueError(f"num_candidates must be at least 1, got {num_candidates}")
+        if num_candidates > 1 and self.draft is not None:
+            raise ValueError("Assisted decoding returns one sequence per prompt; unload the draft model first")
+        if self.draft is not None:
+            # Assisted decoding verifies one sequence at a time
+            batch_size = 1
+        if num_candidates > 1:
+            if diverse:
+                overrides = {"do_sample": False, "num_beams": num_candidates, "num_beam_groups": num_candidates,
+                             "diversity_penalty": conf.diversity_penalty,
+                             "temperature": None, "top_k": None, "top_p": None}
+            else:
+                overrides = {"do_sample": True, "num_beams": 1, "early_stopping": False}
+            generation_kwargs = {**overrides, **generation_kwargs, "num_return_sequences": num_candidates}
+
+        with metrics.timer("model.tokenize"):
+            groups = self._encode_prompts(list(prompts))
+        buckets = []
+        for prefix_key, encoded in groups.items():
+            order = sorted(encoded, key=lambda i: len(encoded[i]))
+            if batch_size == AUTO:
+                spans = self.planner.plan_rows([self._row_tokens(prefix_key, encoded[i], generation_kwargs)
+                                                for i in order])
+            else:
+                spans = [(start, start + batch_size) for start in range(0, len(order), batch_size)]
+            buckets.extend((prefix_key, [(i, encoded[i]) for i in order[start:end]]) for start, end in spans)
+
+        outputs = [None] * len(prompts)
+        for prefix_key, bucket in tqdm(buckets, desc="Generating", disable=not show_progress):
+            indices = [index for index, _ in bucket]
+            texts = self._generate_bucket(prefix_key, bucket, generation_kwargs, batch_size)
+            # `generate` returns the sequences of each prompt next to each other
+            per_prompt = len(texts) // len(indices)
+            for position, index in enumerate(indices):
+                outputs[index] = texts[position * per_prompt:(position + 1) * per_prompt]
+
+        return outputs
+
+    def _row_tokens(self, prefix_key, input_ids: list, generation_kwargs: dict):
+        """Tokens a prompt takes in a generation batch: prefix, prompt and new tokens, per beam or sequence."""
+        kwargs = {**self.generation_kwargs, **generation_kwargs}
+        num_beams = kwargs.get("num_beams") or 1
+        expansion = num_beams if num_beams > 1 else kwargs.get("num_return_sequences") or 1
+        prefix_length = len(self._prefix_caches[prefix_key]["input_ids"]) if prefix_key else 0
+        return (prefix_length + len(input_ids) + (kwargs.get("max_new_tokens") or 0)) * expansion
+
+    def _generate_bucket(self, prefix_key, bucket: list, generation_kwargs: dict, batch_size=None):
+        """
+        Generate one bucket, splitting it in half and retrying while it runs out of memory.
+
+        Args:
+            prefix_key (tuple): Key of the cached prefix the prompts start with, or None.
+            bucket (list[tuple[int, list[int]]]): (prompt index, token ids) pairs.
+            generation_kwargs (dict): Overrides for the default generation settings.
+            batch_size (int or str, optional): The caller's batch size; with "auto" the planner's
+                budget is halved too, so later buckets are planned smaller. Defaults to None.
+
+        Returns:
+            list[str]: The decoded outputs of the bucket, the sequences of each prompt together.
+        """
+        input_ids = [ids for _, ids in bucket]
+        try:
+            return self._generate_encoded(input_ids, prefix_key=prefix_key, **generation_kwargs)
+        except (RuntimeError, MemoryError) as error:
+            if len(bucket) == 1 or not is_out_of_memory(error):
+                raise
+        # Retry outside the except block so the failed batch's tensors can be freed
+        if batch_size == AUTO:
+            failed_tokens = len(bucket) * max(self._row_tokens(prefix_key, ids, generation_kwargs)
+                                              for ids in input_ids)
+            self.planner.backoff(failed_tokens)
+        else:
+            release_memory()
+            print(f"Out of memory with {len(bucket)} prompts per batch; retrying in halves")
+        metrics.add("model.oom_retries")
+        half = len(bucket) // 2
+        return (self._generate_bucket(prefix_key, bucket[:half], generation_kwargs, batch_size)
+                + self._generate_bucket(prefix_key, bucket[half:], generation_kwargs, batch_size))
+
+    def score_continuations(self, prompts: list, continuations: list, batch_size: int = 8, show_progress: bool = False):
+        """
+        Score how likely each continuation is after each prompt, without generating.
+
+        Every (prompt, continuation) pair becomes one row of a single forward
+        pass per batch, so multi-token continuations are scored exactly. Only
+        the logits over the continuation positions are computed.
+
+        Args:
+            prompts (list[str]): The rendered prompts.
+            continuations (list[str]): Candidate texts following each prompt, e.g. " method".
+            batch_size (int or str): Maximum number of prompts per forward pass, or "auto" to size
+                batches with the memory planner. Defaults to 8.
+            show_progress (bool): Display a progress bar over the batches. Defaults to False.
+
+        Returns:
+            list[list[float]]: Summed token log-probabilities, one list per prompt
+                in `continuations` order.
+        """
+        if batch_size != AUTO and batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1 or '{AUTO}', got {batch_size}")
+
+        continuation_ids = [
+            self.tokenizer(text, add_special_tokens=False)["input_ids"] for text in continuations
+        ]
+        max_continuation = max(len(ids) for ids in continuation_ids)
+        encoded = self.tokenizer(
+            list(prompts),
             truncation=True,
-            max_length=8192
+            max_length=max(self.max_input_length - max_continuation, 1)
+        )["input_ids"]
+
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        if batch_size == AUTO:
+            # Each prompt takes one row per continuation
+            spans = self.planner.plan_rows(
+                [(len(encoded[i]) + max_continuation) * len(continuation_ids) for i in order],
+                max_rows=max(1, self.planner.settings["max_batch_size"] // len(continuation_ids))
+            )
+        else:
+            spans = [(start, start + batch_size) for start in range(0, len(order), batch_size)]
+        batches = [order[start:end] for start, end in spans]
+
+        scores = [None] * len(encoded)
+        for indices in tqdm(batches, desc="Scoring", disable=not show_progress):
+            rows = [encoded[i] + ids for i in indices for ids in continuation_ids]
+            metrics.observe("model.score_batch_size", len(rows))
+            with metrics.timer("model.score"):
+                row_scores = self._score_rows(rows, [len(ids) for ids in continuation_ids] * len(indices))
+            for n, index in enumerate(indices):
+                scores[index] = row_scores[n * len(continuation_ids):(n + 1) * len(continuation_ids)]
+
+        return scores
+
+    def _score_rows(self, rows: list, continuation_lengths: list):
+        """
+        Sum the log-probabilities of the last tokens of each row in one forward pass.
+
+        Args:
+            rows (list[list[int]]): Prompt plus continuation token ids.
+            continuation_lengths (list[int]): Number of trailing continuation tokens in each row.
+
+        Returns:
+            list[float]: The summed log-probability of each row's continuation.
+        """
+        max_length = max(len(ids) for ids in rows)
+        pad_token_id = self.tokenizer.pad_token_id
+        input_ids = torch.tensor(
+            [[pad_token_id] * (max_length - len(ids)) + ids for ids in rows], device=self.device
         )
-        batch = {k: v.to(self.device) for k, v in inputs.items()}
+        attention_mask = torch.tensor(
+            [[0] * (max_length - len(ids)) + [1] * len(ids) for ids in rows], device=self.device
+        )
+        # A plain forward pass does not derive positions from the mask like generate does
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        # Rows are right-aligned, so every continuation is predicted by the last `kept` logits
+        kept = max(continuation_lengths) + 1
+        # The ONNX graph always returns the logits of every position
+        extra = {} if self.backend == "onnx" else {"num_logits_to_keep": kept}
+        with torch.inference_mode(), torch.amp.autocast(device_type=self.device, enabled=self.device == "cuda"):
+            logits = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                **extra
+            ).logits[:, -kept:]
+        log_probs = torch.log_softmax(logits.float(), dim=-1)
+
+        scores = []
+        for row, length in enumerate(continuation_lengths):
+            targets = input_ids[row, max_length - length:]
+            predicted = log_probs[row, kept - length - 1:kept - 1]
+            scores.append(predicted.gather(-1, targets.unsqueeze(-1)).sum().item())
+        return scores
 
-        with torch.amp.autocast(device_type="cuda" if self.device == "cuda" else "cpu", enabled=self.device == "cuda"):
-            output = self.model.generate(
+    def _encode_prompts(self, prompts: list):
+        """
+        Tokenize prompts, splitting off the registered prompt prefix where it applies.
+
+        Args:
+            prompts (list[str]): The rendered prompts.
+
+        Returns:
+            dict: Maps a prefix cache key (None for plain prompts) to
+                {prompt index: token ids following the prefix}.
+        """
+        # Cached prefix states were computed with the adapter, so they do not apply while it is off
+        prefix, prefix_key = self.prompt_prefix if self.prompt_prefix and self._adapter_enabled else (None, None)
+        prefixed = [
+            i for i, prompt in enumerate(prompts)
+            if prefix is not None and prompt.startswith(prefix) and len(prompt) > len(prefix)
+        ]
+        prefixed_set = set(prefixed)
+        plain = [i for i in range(len(prompts)) if i not in prefixed_set]
+
+        groups = {}
+        if plain:
+            encoded = self.tokenizer(
+                [prompts[i] for i in plain],
+                truncation=True,
+                max_length=self.max_input_length
+            )["input_ids"]
+            groups[None] = dict(zip(plain, encoded))
+        if prefixed:
+            prefix_length = len(self._prefix_caches[prefix_key]["input_ids"])
+            encoded = self.tokenizer(
+                [prompts[i][len(prefix):] for i in prefixed],
+                add_special_tokens=False,
+                truncation=True,
+                max_length=max(self.max_input_length - prefix_length, 1)
+            )["input_ids"]
+            groups[prefix_key] = dict(zip(prefixed, encoded))
+
+        return groups
+
+    def _expand_prefix_cache(self, prefix_key, num_rows: int):
+        """Copy a cached prefix KV state once per generated row so generation can extend it."""
+        past_key_values = self._prefix_caches[prefix_key]["past_key_values"]
+        return DynamicCache.from_legacy_cache(tuple(
+            (key.repeat_interleave(num_rows, dim=0), value.repeat_interleave(num_rows, dim=0))
+            for key, value in past_key_values.to_legacy_cache()
+        ))
+
+    def _generate_encoded(self, input_ids: list, prefix_key=None, **generation_kwargs):
+        """
+        Run generation on one batch of already tokenized prompts.
+
+        Padding goes between the cached prefix (if any) and each prompt's own
+        tokens, so the prefix KV states line up for every row and plain
+        prompts are simply left-padded.
+
+        Args:
+            input_ids (list[list[int]]): Token ids for each prompt in the batch, after the prefix.
+            prefix_key (tuple, optional): Key of the cached prefix the prompts start with.
+            **generation_kwargs: Overrides for the default generation settings.
+
+        Returns:
+            list[str]: The decoded generated text for the batch, prompts excluded.
+        """
+        batch, kwargs = self._prepare_batch(input_ids, prefix_key, generation_kwargs)
+        metrics.observe("model.batch_size", len(input_ids))
+        metrics.add("model.tokens_in", sum(len(ids) for ids in input_ids))
+
+        if self.draft is not None:
+            output = self._generate_assisted(batch, kwargs)
+        else:
+            output = self._run_generate(batch, kwargs)
+
+        # Every row shares the padded prompt length, so the new tokens start at the same column
+        with metrics.timer("model.detokenize"):
+            decoded_output = self.tokenizer.batch_decode(output[:, batch["input_ids"].shape[1]:], skip_special_tokens=True)
+
+        return [text.strip() for text in decoded_output]
+
+    def _prepare_batch(self, input_ids: list, prefix_key, generation_kwargs: dict):
+        """
+        Pad a batch of tokenized prompts and resolve the generation settings for it.
+
+        Args:
+            input_ids (list[list[int]]): Token ids for each prompt in the batch, after the prefix.
+            prefix_key (tuple): Key of the cached prefix the prompts start with, or None.
+            generation_kwargs (dict): Overrides for the default generation settings.
+
+        Returns:
+            tuple[dict, dict]: The padded tensors and the keyword arguments for `generate`.
+        """
+        prefix_ids = self._prefix_caches[prefix_key]["input_ids"] if prefix_key else []
+        max_length = max(len(ids) for ids in input_ids)
+        pad_token_id = self.tokenizer.pad_token_id
+        batch = {
+            "input_ids": torch.tensor(
+                [prefix_ids + [pad_token_id] * (max_length - len(ids)) + ids for ids in input_ids],
+                device=self.device
+            ),
+            "attention_mask": torch.tensor(
+                [[1] * len(prefix_ids) + [0] * (max_length - len(ids)) + [1] * len(ids) for ids in input_ids],
+                device=self.device
+            ),
+        }
+        kwargs = {**self.generation_kwargs, **generation_kwargs}
+        seed = kwargs.pop("seed", None)
+        qa_categories = kwargs.pop("qa_categories", self.qa_categories)
+        if kwargs.pop("constrain_qa_json", self.constrain_qa_json):
+            kwargs["logits_processor"] = LogitsProcessorList([QAJsonLogitsProcessor(
+                self.tokenizer,
+                batch["input_ids"].shape[1],
+                categories=qa_categories,
+                max_new_tokens=kwargs.get("max_new_tokens")
+            )])
+        if kwargs.pop("stop_at_qa_json", self.stop_at_qa_json):
+            kwargs["stopping_criteria"] = StoppingCriteriaList(
+                [QAJsonStoppingCriteria(self.tokenizer, batch["input_ids"].shape[1])]
+            )
+        if self.draft is not None:
+            # Assisted generation only supports greedy search and sampling
+            kwargs.update(assistant_model=self.draft.model, num_beams=1)
+        # Beam search and multiple return sequences expand every row before the first step
+        num_beams = kwargs.get("num_beams") or 1
+        expansion = num_beams if num_beams > 1 else kwargs.get("num_return_sequences") or 1
+        if seed is not None and kwargs.get("do_sample") and num_beams == 1 and self.draft is None:
+            # Each row samples from its own stream, so a prompt's output does not depend on its batch mates
+            sampler = RowSeededSampler(
+                [row_seed(seed, prefix_ids + ids, index) for ids in input_ids for index in range(expansion)],
+                batch["input_ids"].shape[1],
+                **{name: kwargs.get(name) for name in ("temperature", "top_k", "top_p")}
+            )
+            kwargs.update(temperature=None, top_k=None, top_p=None)
+            kwargs["logits_processor"] = LogitsProcessorList([*kwargs.get("logits_processor", []), sampler])
+        elif seed is not None:
+            # Beam sampling draws across a prompt's beams and assisted decoding runs one prompt per
+            # batch, so these reseed per batch and only repeat for the same batches
+            torch.manual_seed(seed)
+        share_prefill = expansion > 1 and self.draft is None and self.backend != "onnx"
+        if prefix_key or share_prefill:
+            if prefix_key:
+                past_key_values = self._expand_prefix_cache(
+                    prefix_key, len(input_ids) * (1 if share_prefill else expansion)
+                )
+            else:
+                past_key_values = DynamicCache()
+            if share_prefill:
+                past_key_values = self._prefill_shared(batch, past_key_values, expansion)
+            # `generate` only preallocates a static cache itself when no cache is passed in
+            if kwargs.pop("cache_implementation", None) == "static" and self.draft is None:
+                past_key_values = self._to_static_cache(
+                    past_key_values, len(input_ids) * expansion,
+                    batch["input_ids"].shape[1] + (kwargs.get("max_new_tokens") or 0)
+                )
+            kwargs["past_key_values"] = past_key_values
+
+        return batch, kwargs
+
+    def _prefill_shared(self, batch: dict, past_key_values, expansion: int):
+        """
+        Prefill each prompt once and copy its KV states to all of its beams or returned sequences.
+
+        `generate` would otherwise repeat every prompt `expansion` times and
+        prefill each copy. All but the last prompt token are run here, so
+        `generate` starts from the cache with a single-token step.
+
+        Args:
+            batch (dict): Padded `input_ids` and `attention_mask`, cached prefix included.
+            past_key_values (DynamicCache): KV states of the cached prefix, one row per prompt, or empty.
+            expansion (int): Rows `generate` will create per prompt.
+
+        Returns:
+            DynamicCache: KV states for all but the last prompt token, `expansion` rows per prompt.
+        """
+        cached = past_key_values.get_seq_length()
+        if batch["input_ids"].shape[1] - cached > 1:
+            attention_mask = batch["attention_mask"][:, :-1]
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+            with metrics.timer("model.prefill"), torch.inference_mode(), \
+                    torch.amp.autocast(device_type=self.device, enabled=self.device == "cuda"):
+                past_key_values = self.model(
+                    input_ids=batch["input_ids"][:, cached:-1],
+                    attention_mask=attention_mask,
+                    position_ids=position_ids[:, cached:],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    num_logits_to_keep=1
+                ).past_key_values
+        past_key_values.batch_repeat_interleave(expansion)
+        return past_key_values
+
+    def _to_static_cache(self, past_key_values, num_rows: int, max_cache_len: int):
+        """
+        Copy the KV states of a cached prefix or shared prefill into a preallocated static cache.
+
+        Args:
+            past_key_values (DynamicCache): The filled (or empty) cache, `num_rows` rows.
+            num_rows (int): Rows `generate` runs, beams and returned sequences included.
+            max_cache_len (int): Positions to allocate: the padded prompt plus the new tokens.
+
+        Returns:
+            StaticCache: A cache holding the same states that `generate` extends in place.
+        """
+        static_cache = StaticCache(
+            self._hf_model(self.model).config,
+            batch_size=num_rows,
+            max_cache_len=max_cache_len,
+            device=self.device,
+            dtype=self._hf_model(self.model).dtype
+        )
+        for layer, (key, value) in enumerate(zip(past_key_values.key_cache, past_key_values.value_cache)):
+            static_cache.key_cache[layer][:, :, :key.shape[2]].copy_(key)
+            static_cache.value_cache[layer][:, :, :value.shape[2]].copy_(value)
+        return static_cache
+
+    def _run_generate(self, batch: dict, kwargs: dict):
+        """Call the underlying `generate` on a padded batch without tracking gradients."""
+        if not metrics.enabled:
+            return self._call_generate(batch, kwargs)
+        module = self._hf_model(self.model)
+        if isinstance(module, torch.nn.Module):
+            # The first forward pass prefills the prompts; every later one decodes
+            prefill_timer = _FirstForwardTimer()
+            handle = module.register_forward_hook(prefill_timer)
+            start = time.perf_counter()
+            try:
+                output = self._call_generate(batch, kwargs)
+            finally:
+                handle.remove()
+            end = time.perf_counter()
+
+            prefill_end = prefill_timer.finished or end
+            metrics.record_time("model.prefill", prefill_end - start)
+            metrics.record_time("model.decode", end - prefill_end)
+        else:
+            # ONNX Runtime runs outside torch, so there is no hook to split prefill from decode
+            with metrics.timer("model.generate"):
+                output = self._call_generate(batch, kwargs)
+
+        new_tokens = output[:, batch["input_ids"].shape[1]:]
+        metrics.add("model.tokens_out", int((new_tokens != self.tokenizer.pad_token_id).sum()))
+        return output
+
+    def _call_generate(self, batch: dict, kwargs: dict):
+        with torch.inference_mode(), torch.amp.autocast(device_type=self.device, enabled=self.device == "cuda"):
+            return self.model.generate(
                 batch["input_ids"],
                 attention_mask=batch["attention_mask"],
-                max_new_tokens=200,  # Increased from 128 to allow for longer responses
-                do_sample=True,  # Keep sampling for diversity
-                num_beams=5,  # Increased from 2 to explore a broader search space
-                temperature=0.7,  # Added to control randomness
-                top_k=50,  # Focus on the top 50 tokens
-                top_p=0.9,
-                early_stopping=True,
-                pad_token_id=self.tokenizer.pad_token_id
+                pad_token_id=self.tokenizer.pad_token_id,
+                **kwargs
             )
 
-        decoded_output = self.tokenizer.decode(output[0], skip_special_tokens=True)
+    def _generate_assisted(self, batch: dict, kwargs: dict):
+        """
+        Generate with the draft model proposing tokens and this model verifying them.
+
+        Args:
+            batch (dict): Padded `input_ids` and `attention_mask` for a single prompt.
+            kwargs (dict): Generation settings for the target model, including `assistant_model`.
+
+        Returns:
+            torch.Tensor: The generated token ids, prompt included.
+        """
+        target_counter, draft_counter = _ForwardCounter(), _ForwardCounter()
+        handles = [
+            self._hf_model(self.model).register_forward_hook(target_counter),
+            self._hf_model(self.draft.model).register_forward_hook(draft_counter),
+        ]
+
+        try:
+            output = self._run_generate(batch, kwargs)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        counts = {
+            "generations": 1,
+            "new_tokens": output.shape[1] - batch["input_ids"].shape[1],
+            "target_forwards": target_counter.count,
+            "draft_forwards": draft_counter.count,
+        }
+        for name, count in counts.items():
+            self.draft_stats[name] += count
+            # Workers report these through their metrics summaries
+            metrics.add(f"model.draft_{name}", count)
 
-        return decoded_output.strip()
+        return output
 
     def save_model(self, base_save_path: str):
         """Save the model and tokenizer with versioning."""
@@ -0,0 +1,176 @@
+import multiprocessing as mp
+import multiprocessing.connection
+import os
+
+from tqdm import tqdm
+
+
+def threads_per_worker(num_workers: int):
+    """Split the CPU cores evenly between worker processes, at least one thread each."""
+    return max(1, (os.cpu_count() or 1) // num_workers)
+
+
+def _worker_main(worker_id, init_fn, init_args, shard_fn, num_threads, tasks, results):
+    """
+    Worker process loop: set the thread count, build its state once, then process shards until told to stop.
+
+    Shards are (shard_id, items) tuples; None stops the worker. Results are sent on the
+    worker's own pipe, so a worker that dies cannot leave a lock shared with the others held.
+    """
+    # Split the cores before any model is built so intra-op pools do not oversubscribe
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    import torch
+    torch.set_num_threads(num_threads)
+
+    state = init_fn(*init_args) if init_fn is not None else None
+    results.send(("ready", worker_id, None, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        shard_id, items = task
+        results.send(("done", worker_id, shard_id, shard_fn(state, items)))
+
+
+def run_sharded(items: list, shard_fn, num_workers: int, init_fn=None, init_args: tuple = (),
+                shard_size: int = None, max_retries: int = 2, show_progress: bool = True, on_results=None):
+    """
+    Process items in worker processes, each holding its own state (e.g. a loaded model).
+
+    Items are split into contiguous shards handed out one at a time, so
+    faster workers take more shards. When a worker dies, the shard it held
+    is reassigned to a freshly started worker. Results are merged back in
+    input order.
+
+    Args:
+        items (list): Picklable inputs.
+        shard_fn (callable): `shard_fn(state, shard_items)` returning one result per item.
+            Must be a module-level function so spawned workers can import it.
+        num_workers (int): Number of worker processes.
+        init_fn (callable, optional): `init_fn(*init_args)` building the per-worker state once.
+        init_args (tuple): Arguments for `init_fn`.
+        shard_size (int, optional): Items per shard. Defaults to splitting the items
+            into four shards per worker.
+        max_retries (int): Times a shard may be reassigned after its worker died. Defaults to 2.
+        show_progress (bool): Display a progress bar over the items. Defaults to True.
+        on_results (callable, optional): Called with each shard's results, in input order,
+            as soon as every earlier shard is done, e.g. to write them out incrementally.
+
+    Returns:
+        list: The results of `shard_fn` for all items, in input order.
+
+    Raises:
+        RuntimeError: If a shard keeps crashing its worker.
+    """
+    if num_workers < 1:
+        raise ValueError(f"num_workers must be at least 1, got {num_workers}")
+    if not items:
+        return []
+
+    shard_size = shard_size or max(1, -(-len(items) // (num_workers * 4)))
+    shards = {
+        shard_id: items[start:start + shard_size]
+        for shard_id, start in enumerate(range(0, len(items), shard_size))
+    }
+    num_workers = min(num_workers, len(shards))
+    num_threads = threads_per_worker(num_workers)
+
+    # Spawned workers do not inherit CUDA or thread-pool state from this process
+    context = mp.get_context("spawn")
+    workers = {}
+    ready = set()
+    assigned = {}
+    attempts = {shard_id: 0 for shard_id in shards}
+    pending = list(shards)
+    outputs = {}
+    next_worker_id = 0
+    next_to_emit = 0
+
+    def start_worker():
+        nonlocal next_worker_id
+        worker_id = next_worker_id
+        next_worker_id += 1
+        tasks = context.Queue()
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_worker_main,
+            args=(worker_id, init_fn, init_args, shard_fn, num_threads, tasks, writer),
+            daemon=True
+        )
+        process.start()
+        # Only the worker holds the write end now, so the pipe reports EOF when it exits
+        writer.close()
+        workers[worker_id] = (process, tasks, reader)
+        assigned[worker_id] = None
+
+    def assign(worker_id):
+        if pending:
+            shard_id = pending.pop(0)
+            assigned[worker_id] = shard_id
+            workers[worker_id][1].put((shard_id, shards[shard_id]))
+        else:
+            assigned[worker_id] = None
+            workers[worker_id][1].put(None)
+
+    print(f"Processing {len(items)} items in {len(shards)} shards with {num_workers} workers "
+          f"({num_threads} threads each)")
+    for _ in range(num_workers):
+        start_worker()
+
+    progress = tqdm(total=len(items), disable=not show_progress)
+    try:
+        while len(outputs) < len(shards):
+            readers = {reader: worker_id for worker_id, (_, _, reader) in workers.items()}
+            for reader in mp.connection.wait(list(readers), timeout=1.0):
+                try:
+                    kind, worker_id, shard_id, shard_results = reader.recv()
+                except EOFError:
+                    # The worker exited; wait for its exit code so it is handled below
+                    workers[readers[reader]][0].join(timeout=5)
+                    continue
+
+                if kind == "ready":
+                    ready.add(worker_id)
+                    assign(worker_id)
+                elif kind == "done":
+                    if shard_id not in outputs:
+                        outputs[shard_id] = shard_results
+                        progress.update(len(shards[shard_id]))
+                    while on_results is not None and next_to_emit in outputs:
+                        on_results(outputs[next_to_emit])
+                        next_to_emit += 1
+                    assign(worker_id)
+
+            # Reassign the shard of any worker that died, and replace the worker if work remains
+            for worker_id, (process, _, reader) in list(workers.items()):
+                if process.is_alive():
+                    continue
+                if process.exitcode != 0 and worker_id not in ready:
+                    # Building the state failed, which a fresh worker would repeat
+                    raise RuntimeError(f"Worker {worker_id} exited with code {process.exitcode} during initialization")
+                shard_id = assigned.pop(worker_id)
+                del workers[worker_id]
+                reader.close()
+                if process.exitcode == 0:
+                    # Told to stop once no shards were left
+                    continue
+                if shard_id is not None and shard_id not in outputs:
+                    attempts[shard_id] += 1
+                    if attempts[shard_id] > max_retries:
+                        raise RuntimeError(f"Shard {shard_id} crashed its worker {attempts[shard_id]} times")
+                    print(f"Worker {worker_id} exited with code {process.exitcode}, reassigning shard {shard_id}")
+                    pending.insert(0, shard_id)
+                if pending:
+                    start_worker()
+    finally:
+        progress.close()
+        for process, tasks, _ in workers.values():
+            if process.is_alive():
+                tasks.put(None)
+        for process, _, reader in workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            reader.close()
+
+    return [result for shard_id in sorted(outputs) for result in outputs[shard_id]]
@@ -0,0 +1,267 @@
+import gc
+import os
+import sys
+
+import src.conf as conf
+
+AUTO = "auto"
+
+# Bytes per value of the dtypes models compute in
+DTYPE_BYTES = {"float32": 4, "float16": 2, "bfloat16": 2}
+
+
+def parse_batch_size(value):
+    """argparse type for `--batch_size`: a positive integer or "auto" for the memory planner."""
+    if value == AUTO:
+        return AUTO
+    batch_size = int(value)
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1 or '{AUTO}', got {value}")
+    return batch_size
+
+
+def is_out_of_memory(error: BaseException):
+    """Whether an exception means an allocation failed, on the GPU or in host memory."""
+    if isinstance(error, MemoryError):
+        return True
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(error, getattr(torch.cuda, "OutOfMemoryError", ())):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+
+def release_memory():
+    """Return freed tensors to the allocator (and CUDA's cache to the driver) after an OOM."""
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _read_int(path: str):
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def available_memory_bytes(device: str = "cpu"):
+    """
+    Memory a new allocation can still use on a device.
+
+    On CPU this is the kernel's MemAvailable, capped by the cgroup (container)
+    limit when one is set.
+
+    Args:
+        device (str): "cpu" or "cuda". Defaults to "cpu".
+
+    Returns:
+        int or None: Free bytes, or None where they cannot be determined.
+    """
+    if device == "cuda":
+        import torch
+        free, _ = torch.cuda.mem_get_info()
+        return free
+
+    available = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    if available is None and hasattr(os, "sysconf"):
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError):
+            pass
+
+    limit = _read_int("/sys/fs/cgroup/memory.max") or _read_int("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    usage = _read_int("/sys/fs/cgroup/memory.current") or _read_int("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    # cgroup v1 reports an effectively unlimited limit as a huge number
+    if limit and usage is not None and limit < 1 << 60:
+        available = min(available, limit - usage) if available is not None else limit - usage
+    return available
+
+
+def module_bytes(model):
+    """Bytes held by a torch module's parameters and buffers."""
+    return sum(tensor.numel() * tensor.element_size() for tensor in list(model.parameters()) + list(model.buffers()))
+
+
+class MemoryPlanner:
+    """
+    Sizes generation batches and training micro-batches from free memory and the model's shape.
+
+    The cost of a token is its KV cache entry plus the transient prefill
+    activations; a generation batch may use `memory_fraction` of the memory
+    free when the planner is created, minus the per-row logits. When a batch
+    still runs out of memory, `backoff` halves the token budget for the rest
+    of the run.
+    """
+
+    def __init__(self, model_config, device: str = "cpu", dtype_bytes: int = 4, kv_dtype_bytes: int = None,
+                 available_bytes: int = None):
+        """
+        Args:
+            model_config: The transformers config of the model (hidden size, layers, heads, vocabulary).
+            device (str): "cpu" or "cuda". Defaults to "cpu".
+            dtype_bytes (int): Bytes per activation value. Defaults to 4 (float32).
+            kv_dtype_bytes (int, optional): Bytes per cached key/value. Defaults to `dtype_bytes`.
+            available_bytes (int, optional): Free memory to plan for. Defaults to `available_memory_bytes(device)`.
+        """
+        self.config = model_config
+        self.device = device
+        self.dtype_bytes = dtype_bytes
+        self.kv_dtype_bytes = kv_dtype_bytes or dtype_bytes
+        self.available_bytes = available_bytes if available_bytes is not None else available_memory_bytes(device)
+        self.settings = conf.planner_config
+        self._max_batch_tokens = None
+
+    @classmethod
+    def for_model(cls, model):
+        """
+        Build a planner for a loaded `ItriModel`.
+
+        Args:
+            model (ItriModel): The model whose batches are planned.
+
+        Returns:
+            MemoryPlanner: The planner, using the model's compute dtype.
+        """
+        if model.backend == "cuda":
+            dtype_bytes = 2
+        elif model.backend == "cpu" and not conf.cpu_backend_config["quantize_dynamic"]:
+            dtype_bytes = DTYPE_BYTES[conf.cpu_backend_config["dtype"]]
+        else:
+            # Dynamically quantized layers and ONNX Runtime compute in float32
+            dtype_bytes = 4
+        return cls(model._hf_model(model.model).config, model.device, dtype_bytes)
+
+    @property
+    def head_dim(self):
+        config = self.config
+        return getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+
+    def kv_bytes_per_token(self):
+        """Bytes of KV cache one token takes across all layers."""
+        config = self.config
+        kv_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+        return 2 * config.num_hidden_layers * kv_heads * self.head_dim * self.kv_dtype_bytes
+
+    def activation_bytes_per_token(self):
+        """Bytes of the largest transient activations of one token in a forward pass (residual, attention, MLP)."""
+        config = self.config
+        intermediate = getattr(config, "intermediate_size", None) or 4 * config.hidden_size
+        return (4 * config.hidden_size + 3 * intermediate) * self.dtype_bytes
+
+    def row_bytes(self):
+        """Bytes of the logits and processed scores of one sequence at one step."""
+        return 2 * self.config.vocab_size * 4
+
+    @property
+    def max_batch_tokens(self):
+        """
+        Largest number of tokens (prompt plus new tokens, over all rows) a generation batch may hold.
+
+        Computed once from the free memory and logged; falls back to
+        `conf.planner_config["default_batch_tokens"]` where free memory is unknown.
+        """
+        if self._max_batch_tokens is None:
+            settings = self.settings
+            if self.available_bytes is None:
+                tokens = settings["default_batch_tokens"]
+                reason = "free memory unknown"
+            else:
+                usable = self.available_bytes * settings["memory_fraction"]
+                usable -= settings["max_batch_size"] * self.row_bytes()
+                tokens = int(usable // (self.kv_bytes_per_token() + self.activation_bytes_per_token()))
+                reason = f"{self.available_bytes / 2**30:.1f} GiB free on {self.device}"
+            self._max_batch_tokens = max(settings["min_batch_tokens"], min(tokens, settings["max_batch_tokens"]))
+            print(f"Memory planner: up to {self._max_batch_tokens} tokens per generation batch ({reason})")
+        return self._max_batch_tokens
+
+    def plan_rows(self, row_tokens: list, max_rows: int = None):
+        """
+        Split rows sorted by length into batches that stay within `max_batch_tokens` once padded.
+
+        Args:
+            row_tokens (list[int]): Tokens each row will hold, ascending.
+            max_rows (int, optional): Cap on rows per batch. Defaults to `conf.planner_config["max_batch_size"]`.
+
+        Returns:
+            list[tuple[int, int]]: (start, end) offsets of each batch.
+        """
+        max_rows = max_rows or self.settings["max_batch_size"]
+        batches = []
+        start = 0
+        for end, tokens in enumerate(row_tokens):
+            # Rows are padded to the longest, which is the one being added
+            rows = end - start + 1
+            if end > start and (rows > max_rows or rows * tokens > self.max_batch_tokens):
+                batches.append((start, end))
+                start = end
+        if row_tokens:
+            batches.append((start, len(row_tokens)))
+        return batches
+
+    def backoff(self, failed_tokens: int):
+        """
+        Halve the token budget after a batch of `failed_tokens` tokens ran out of memory.
+
+        Args:
+            failed_tokens (int): Padded tokens of the batch that failed.
+        """
+        release_memory()
+        budget = min(self.max_batch_tokens, failed_tokens) // 2
+        self._max_batch_tokens = max(self.settings["min_batch_tokens"], budget)
+        print(f"Out of memory with {failed_tokens} tokens; retrying with at most {self._max_batch_tokens} per batch")
+
+    def training_batch(self, model, seq_length: int, effective_batch_size: int):
+        """
+        Pick the training micro-batch and gradient accumulation for an effective batch size.
+
+        Memory per sample follows the usual transformer estimate of about
+        `34 * hidden + 5 * heads * seq_length` half-precision activation bytes
+        per token and layer, plus the logits and their gradients. Weights,
+        gradients and Adam states are subtracted first when the model is not
+        on the training device yet.
+
+        Args:
+            model: The (PEFT) model to train.
+            seq_length (int): Padded tokens per sample.
+            effective_batch_size (int): Samples per optimizer step to keep.
+
+        Returns:
+            tuple[int, int]: (per-device micro-batch, gradient accumulation steps); their product
+                is at least `effective_batch_size`.
+        """
+        config, settings = self.config, self.settings
+        scale = self.dtype_bytes / 2
+        per_sample = seq_length * config.num_hidden_layers * (
+            34 * config.hidden_size + 5 * config.num_attention_heads * seq_length
+        ) * scale + 3 * seq_length * config.vocab_size * 4
+
+        if self.available_bytes is None:
+            micro_batch = 1
+        else:
+            usable = self.available_bytes * settings["memory_fraction"]
+            on_device = next(model.parameters()).device.type == self.device
+            if not on_device:
+                usable -= module_bytes(model)
+            trainable = sum(parameter.numel() for parameter in model.parameters() if parameter.requires_grad)
+            # Gradient plus two Adam moments in float32
+            usable -= trainable * 4 * 3
+            micro_batch = max(1, int(usable // per_sample))
+
+        micro_batch = min(micro_batch, settings["max_micro_batch"], effective_batch_size)
+        # A power of two divides the usual effective batch sizes evenly
+        micro_batch = 1 << (micro_batch.bit_length() - 1)
+        accumulation = -(-effective_batch_size // micro_batch)
+        print(f"Memory planner: training micro-batch {micro_batch} x {accumulation} accumulation steps "
+              f"({per_sample / 2**20:.0f} MiB activations per sample of {seq_length} tokens)")
+        return micro_batch, accumulation
@@ -0,0 +1,245 @@
+import torch
+from transformers import StoppingCriteria
+
+from src.qa_json import QAGrammar, extract_qa
+
+
+class QAJsonStoppingCriteria(StoppingCriteria):
+    """
+    Stops each sequence once it has emitted a complete {"question": ..., "answer": ...} object.
+
+    Only the tokens added since the previous call are decoded on most steps
+    (assisted decoding can accept several per step); the generated slice is
+    parsed only when one of them contains a closing brace.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int):
+        """
+        Args:
+            tokenizer: The tokenizer used for generation.
+            prompt_length (int): Number of (padded) prompt tokens preceding the generated ones.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.checked_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        is_done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        if input_ids.shape[1] <= self.prompt_length:
+            return is_done
+
+        # Beam search reorders rows, but the new columns always belong to the current rows
+        start = min(self.checked_length, input_ids.shape[1] - 1)
+        self.checked_length = input_ids.shape[1]
+        new_texts = self.tokenizer.batch_decode(input_ids[:, start:])
+        for row, new_text in enumerate(new_texts):
+            if "}" not in new_text:
+                continue
+            generated = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            is_done[row] = extract_qa(generated) is not None
+
+        return is_done
+
+
+class _VocabIndex:
+    """Decoded text of every token, grouped for fast grammar checks. Built once per tokenizer."""
+
+    _instances = {}
+
+    def __init__(self, tokenizer):
+        special_ids = set(tokenizer.all_special_ids)
+        self.size = len(tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.texts = [
+            "" if token_id in special_ids else tokenizer.decode([token_id])
+            for token_id in range(self.size)
+        ]
+
+        # Tokens that can never end a string or the object; allowed anywhere inside a string
+        string_safe = [False] * self.size
+        # Tokens whose effect inside a string depends on the grammar state
+        self.string_risky = []
+        self.by_first_char = {}
+        for token_id, text in enumerate(self.texts):
+            if not text:
+                continue
+            self.by_first_char.setdefault(text[0], []).append(token_id)
+            if '"' in text or "\\" in text or any(ord(char) < 0x20 for char in text):
+                self.string_risky.append(token_id)
+            else:
+                string_safe[token_id] = True
+        self.string_safe = torch.tensor(string_safe, dtype=torch.bool)
+
+        # Masks per (grammar categories, state signature, forced to close)
+        self.masks = {}
+
+    @classmethod
+    def get(cls, tokenizer):
+        key = (tokenizer.name_or_path, len(tokenizer))
+        if key not in cls._instances:
+            cls._instances[key] = cls(tokenizer)
+        return cls._instances[key]
+
+
+class _RowProgress:
+    """The generated token ids a row's grammar state covers, and the state after each of them."""
+
+    __slots__ = ("ids", "history")
+
+    def __init__(self, ids: list, history: list):
+        self.ids = ids
+        # (grammar state, decode window start, decoded end) after 0, 1, ... len(ids) tokens
+        self.history = history
+
+    def copy(self):
+        return _RowProgress(list(self.ids), list(self.history))
+
+    def truncate(self, length: int):
+        del self.ids[length:]
+        del self.history[length + 1:]
+
+
+class QAJsonLogitsProcessor:
+    """
+    Masks every token that would take the output outside the QA JSON grammar.
+
+    Follows the transformers LogitsProcessor protocol. Each row keeps its
+    grammar state, which is advanced over the tokens added since the previous
+    step only, decoding a window of a few tokens so characters split across
+    tokens come out whole. When beam search reorders rows, a row takes over
+    the state of the row whose tokens it continues; when assisted decoding
+    rejects draft tokens, a row rolls back to the state before them.
+    Allowed-token masks depend only on the grammar state signature, so each
+    one is computed once per tokenizer and reused across steps, rows and
+    calls. When the remaining token budget only just covers the characters
+    needed to close the object, strings are forced to end so the output
+    still parses.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, categories: tuple = None, max_new_tokens: int = None):
+        """
+        Args:
+            tokenizer: The tokenizer used for generation.
+            prompt_length (int): Number of (padded) prompt tokens preceding the generated ones.
+            categories (tuple[str], optional): Allowed values of a "category" key. Defaults to None.
+            max_new_tokens (int, optional): Generation budget used to force closing. Defaults to None.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.grammar = QAGrammar(categories)
+        self.vocab = _VocabIndex.get(tokenizer)
+        self._device_masks = {}
+        # Generated ids of the previous call and the progress of each of its rows
+        self._ids = None
+        self._rows = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids[:, self.prompt_length:]
+        generated_length = generated.shape[1]
+        rows = self._sync(generated)
+
+        allowed = torch.zeros(scores.shape, dtype=torch.bool, device=scores.device)
+        for row, progress in enumerate(rows):
+            self._advance(progress, generated[row, len(progress.ids):].tolist())
+            state = progress.history[-1][0]
+            forced = (
+                self.max_new_tokens is not None
+                and state is not None
+                and self.grammar.segment_kind(state) == QAGrammar.STRING
+                and self.max_new_tokens - generated_length <= self.grammar.min_chars_to_complete(state)
+            )
+            mask = self._mask(state, forced, scores.device)
+            width = min(mask.shape[0], scores.shape[1])
+            allowed[row, :width] = mask[:width]
+
+        self._ids, self._rows = generated.clone(), rows
+        return scores.masked_fill(~allowed, float("-inf"))
+
+    def _sync(self, generated: torch.LongTensor):
+        """Match each row to the progress of the previous row whose tokens it continues."""
+        if self._ids is None:
+            return [self._new_progress() for _ in range(generated.shape[0])]
+
+        common = min(generated.shape[1], self._ids.shape[1])
+        current, previous = generated[:, :common], self._ids[:, :common]
+        rows, taken = [], set()
+        for row in range(generated.shape[0]):
+            if row < len(previous) and torch.equal(current[row], previous[row]):
+                parent, length = row, common
+            else:
+                # Beam search reorders rows, so look for the row this one now continues
+                matches = (previous == current[row]).all(-1).nonzero()
+                if len(matches):
+                    parent, length = matches[0].item(), common
+                elif row < len(previous):
+                    # The row's own tokens changed (rejected draft tokens), so roll back to the first change
+                    parent, length = row, (current[row] != previous[row]).nonzero()[0].item()
+                else:
+                    rows.append(self._new_progress())
+                    continue
+            # Several rows can continue the same parent
+            progress = self._rows[parent].copy() if parent in taken else self._rows[parent]
+            taken.add(parent)
+            progress.truncate(length)
+            rows.append(progress)
+        return rows
+
+    def _new_progress(self):
+        return _RowProgress([], [(self.grammar.initial_state, 0, 0)])
+
+    def _advance(self, progress: _RowProgress, new_ids: list):
+        """Advance a row's grammar state over its new tokens."""
+        for token_id in new_ids:
+            progress.ids.append(token_id)
+            state, start, end = progress.history[-1]
+            if state is not None:
+                decoded = self.tokenizer.decode(progress.ids[start:end], skip_special_tokens=True)
+                text = self.tokenizer.decode(progress.ids[start:], skip_special_tokens=True)
+                # Wait for the rest of a character whose bytes are split across tokens
+                if len(text) > len(decoded) and not text.endswith("\ufffd"):
+                    state = self.grammar.advance(state, text[len(decoded):])
+                    start, end = end, len(progress.ids)
+            progress.history.append((state, start, end))
+
+    def _mask(self, state, forced: bool, device):
+        """Allowed tokens for a grammar state, cached by signature."""
+        if state is None or self.grammar.is_complete(state):
+            key = ("eos",)
+        else:
+            key = (self.grammar.categories, self.grammar.signature(state), forced)
+
+        if (key, device) not in self._device_masks:
+            if key not in self.vocab.masks:
+                self.vocab.masks[key] = self._build_mask(state, forced)
+            self._device_masks[(key, device)] = self.vocab.masks[key].to(device)
+        return self._device_masks[(key, device)]
+
+    def _build_mask(self, state, forced: bool):
+        vocab = self.vocab
+        mask = torch.zeros(vocab.size, dtype=torch.bool)
+        if state is None or self.grammar.is_complete(state):
+            # Finished (or, defensively, derailed) rows may only end
+            mask[vocab.eos_token_id] = True
+            return mask
+
+        segment, _, escaped = state
+        in_string = self.grammar.segment_kind(state) == QAGrammar.STRING
+        if in_string and not escaped:
+            candidates = vocab.string_risky
+            if not forced:
+                mask |= vocab.string_safe
+        else:
+            next_chars = set(QAGrammar.ESCAPES) if in_string else self.grammar.next_chars(state)
+            candidates = [token_id for char in next_chars for token_id in vocab.by_first_char.get(char, [])]
+
+        for token_id in candidates:
+            next_state = self.grammar.advance(state, vocab.texts[token_id])
+            # When forced, only tokens that close the current string are allowed
+            if next_state is not None and (not forced or next_state[0] > segment):
+                mask[token_id] = True
+
+        if forced and not mask.any():
+            # Nothing closes the current segment in one token, so keep extending it
+            return self._build_mask(state, False)
+        return mask
@@ -0,0 +1,236 @@
+import json
+import re
+from difflib import SequenceMatcher
+
+
+QA_KEYS = ("question", "answer")
+
+
+def find_json_objects(text: str):
+    """
+    Yield the balanced top-level `{...}` spans in a piece of generated text.
+
+    Braces inside JSON strings are ignored, so a closing brace in an answer
+    does not end the object early.
+
+    Parameters:
+    - text (str): Text that may contain JSON objects among other output.
+
+    Yields:
+    - tuple[int, int]: Start and end offsets of each balanced object.
+    """
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield start, index + 1
+
+
+def extract_qa(text: str):
+    """
+    Parse the first JSON object with string "question" and "answer" values.
+
+    Parameters:
+    - text (str): Generated text, e.g. the tokens produced after the prompt.
+
+    Returns:
+    - dict or None: The parsed object, or None if the text holds no valid QA object.
+    """
+    for start, end in find_json_objects(text):
+        try:
+            candidate = json.loads(text[start:end])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(candidate, dict) and all(isinstance(candidate.get(key), str) for key in QA_KEYS):
+            return candidate
+    return None
+
+
+def question_words(qa_set: dict):
+    """
+    Lowercase the words of a QA set's question, ignoring punctuation and spacing.
+
+    Parameters:
+    - qa_set (dict): A parsed QA object.
+
+    Returns:
+    - list[str]: The question's words.
+    """
+    return re.findall(r"\w+", qa_set["question"].lower())
+
+
+def dedup_qa_sets(qa_sets: list, threshold: float = 0.8):
+    """
+    Drop QA sets whose question is nearly identical to an earlier one.
+
+    Questions are compared word by word with `difflib.SequenceMatcher`, so
+    rewordings that only change punctuation, case or a word or two count as
+    duplicates.
+
+    Parameters:
+    - qa_sets (list[dict or None]): Parsed QA objects; None entries are skipped.
+    - threshold (float): Similarity ratio from which two questions are duplicates.
+
+    Returns:
+    - list[int]: Indices of the QA sets to keep, in their original order.
+    """
+    kept, kept_words = [], []
+    for index, qa_set in enumerate(qa_sets):
+        if qa_set is None:
+            continue
+        words = question_words(qa_set)
+        if any(SequenceMatcher(None, words, other, autojunk=False).ratio() >= threshold for other in kept_words):
+            continue
+        kept.append(index)
+        kept_words.append(words)
+    return kept
+
+
+class QAGrammar:
+    """
+    Character-level grammar for `{"question": "...", "answer": "..."}` with an optional category enum.
+
+    The layout is fixed (no optional whitespace) and both strings must be
+    non-empty, so any text the grammar accepts parses with `extract_qa`.
+    States are hashable tuples `(segment, position, escaped)`: `position` is
+    the offset into a literal, the text typed so far for the enum, and the
+    number of characters for a string.
+    """
+
+    LITERAL, STRING, ENUM = "literal", "string", "enum"
+    ESCAPES = '"\\/bfnrt'
+
+    def __init__(self, categories: tuple = None):
+        """
+        Parameters:
+        - categories (tuple[str], optional): Allowed values of a trailing "category" key.
+          Defaults to None (no category key).
+        """
+        self.categories = tuple(categories) if categories else None
+        self.segments = [
+            (self.LITERAL, '{"question": "'),
+            (self.STRING, None),
+            (self.LITERAL, '", "answer": "'),
+            (self.STRING, None),
+        ]
+        if self.categories:
+            self.segments += [(self.LITERAL, '", "category": "'), (self.ENUM, self.categories)]
+        self.segments.append((self.LITERAL, '"}'))
+        self.initial_state = (0, 0, False)
+
+    def is_complete(self, state) -> bool:
+        return state is not None and state[0] == len(self.segments)
+
+    def segment_kind(self, state):
+        return None if self.is_complete(state) else self.segments[state[0]][0]
+
+    def advance(self, state, text: str):
+        """
+        Consume `text` from `state`.
+
+        Returns:
+        - tuple or None: The new state, or None if the text leaves the grammar.
+        """
+        for char in text:
+            if state is None or self.is_complete(state):
+                return None
+            state = self._step(state, char)
+        return state
+
+    def _step(self, state, char: str):
+        segment, position, escaped = state
+        kind, value = self.segments[segment]
+
+        if kind == self.LITERAL:
+            if char != value[position]:
+                return None
+            position += 1
+            return self._enter(segment + 1) if position == len(value) else (segment, position, False)
+
+        if kind == self.STRING:
+            if escaped:
+                return (segment, position + 1, False) if char in self.ESCAPES else None
+            if char == "\\":
+                return (segment, position, True)
+            if char == '"':
+                # The closing quote is the first character of the following literal
+                return (segment + 1, 1, False) if position > 0 else None
+            return (segment, position + 1, False) if ord(char) >= 0x20 else None
+
+        # Enum: `position` holds the option text typed so far
+        if char == '"' and position in value:
+            return (segment + 1, 1, False)
+        typed = position + char
+        return (segment, typed, False) if any(option.startswith(typed) for option in value) else None
+
+    def _enter(self, segment: int):
+        """State at the start of a segment."""
+        is_enum = segment < len(self.segments) and self.segments[segment][0] == self.ENUM
+        return (segment, "" if is_enum else 0, False)
+
+    def signature(self, state):
+        """
+        Collapse states that allow exactly the same continuations.
+
+        Inside a string only emptiness and the escape flag matter, which keeps
+        the number of distinct signatures small enough to cache token masks.
+        """
+        segment, position, escaped = state
+        if self.segment_kind(state) == self.STRING:
+            return segment, min(position, 1), escaped
+        return state
+
+    def next_chars(self, state):
+        """Characters that may start the continuation from a literal or enum state."""
+        segment, position, _ = state
+        kind, value = self.segments[segment]
+        if kind == self.LITERAL:
+            return {value[position]}
+        chars = {option[len(position)] for option in value if option.startswith(position) and len(option) > len(position)}
+        if position in value:
+            chars.add('"')
+        return chars
+
+    def min_chars_to_complete(self, state) -> int:
+        """Fewest characters that can still complete the object from `state`."""
+        if self.is_complete(state):
+            return 0
+        segment, position, escaped = state
+        kind, value = self.segments[segment]
+
+        if kind == self.LITERAL:
+            remaining = len(value) - position
+        elif kind == self.STRING:
+            # Finish an escape, make the string non-empty, then close it
+            remaining = int(escaped) + (1 if position == 0 else 0) + 1
+            remaining -= 1  # The closing quote is counted by the next literal
+        else:
+            remaining = min(len(option) - len(position) for option in value if option.startswith(position)) + 1
+            remaining -= 1
+
+        for kind, value in self.segments[segment + 1:]:
+            if kind == self.LITERAL:
+                remaining += len(value)
+            elif kind == self.STRING:
+                remaining += 1
+            else:
+                remaining += min(len(option) for option in value)
+        return remaining
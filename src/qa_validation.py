@@ -0,0 +1,71 @@
+import re
+
+import src.conf as conf
+
+# Short function words that say nothing about whether an answer comes from the abstract
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how in into is it its
+may might more most no not of on or our over such than that the their them then there these they
+this those through to was we were what when where which while who why will with would
+""".split())
+
+
+def content_words(text: str):
+    """
+    Lowercase the words of a text that carry meaning, dropping stopwords and numbers.
+
+    Parameters:
+    - text (str): Any text, e.g. a generated answer.
+
+    Returns:
+    - list[str]: The remaining words, in order.
+    """
+    return [word for word in re.findall(r"[a-z][a-z0-9-]*", text.lower()) if word not in STOPWORDS]
+
+
+def answer_grounding(answer: str, abstract: str):
+    """
+    Fraction of the answer's content words that occur in the abstract.
+
+    Words are matched as substrings of the lowercased abstract, so
+    "measure" is found in "measured".
+
+    Parameters:
+    - answer (str): The generated answer.
+    - abstract (str): The abstract the QA set was generated from.
+
+    Returns:
+    - float: Between 0 and 1; 1.0 for an answer without content words.
+    """
+    words = content_words(answer)
+    if not words:
+        return 1.0
+    abstract = abstract.lower()
+    return sum(word in abstract for word in words) / len(words)
+
+
+def qa_rejection(qa_set: dict, abstract: str, patterns=None, min_grounding: float = None):
+    """
+    Run the cheap validators on a QA set and return the first one it fails.
+
+    Parameters:
+    - qa_set (dict or None): The parsed QA object, or None when the output held no valid JSON.
+    - abstract (str): The abstract the QA set was generated from.
+    - patterns (list, optional): Regexes of generic questions. Defaults to `conf.generic_question_patterns`.
+    - min_grounding (float, optional): Minimum `answer_grounding`. Defaults to `conf.min_answer_grounding`.
+
+    Returns:
+    - str or None: "invalid_json", "empty", "generic_question" or "ungrounded_answer", or None if it passes.
+    """
+    if qa_set is None:
+        return "invalid_json"
+    question, answer = qa_set["question"].strip(), qa_set["answer"].strip()
+    if not question or not answer:
+        return "empty"
+    patterns = conf.generic_question_patterns if patterns is None else patterns
+    if any(re.search(pattern, question, re.IGNORECASE) for pattern in patterns):
+        return "generic_question"
+    min_grounding = conf.min_answer_grounding if min_grounding is None else min_grounding
+    if abstract and answer_grounding(answer, abstract) < min_grounding:
+        return "ungrounded_answer"
+    return None
@@ -0,0 +1,78 @@
+# Loaded models shared by every entry point in the process, keyed by (model name, quantization, adapter)
+_models = {}
+
+
+def model_key(model_name: str, adapter_path: str = None, backend: str = None):
+    """
+    Build the registry key of a model.
+
+    Args:
+        model_name (str): Name of the base model.
+        adapter_path (str, optional): Path to the adapter. Defaults to None.
+        backend (str, optional): Backend passed to `ItriModel`. Defaults to the resolved default backend.
+
+    Returns:
+        tuple: (model name, quantization, adapter path).
+    """
+    from src.model import ItriModel
+
+    return model_name, ItriModel.quantization_for(ItriModel.resolve_backend(backend)), adapter_path
+
+
+def get_model(model_name: str, adapter_path: str = None, backend: str = None, **kwargs):
+    """
+    Return the loaded model for (model name, quantization, adapter), loading it on first use.
+
+    Args:
+        model_name (str): Name of the base model.
+        adapter_path (str, optional): Path to the adapter. Defaults to None.
+        backend (str, optional): Backend passed to `ItriModel`. Defaults to None.
+        **kwargs: Extra `ItriModel` arguments, only used when the model is loaded.
+
+    Returns:
+        ItriModel: The shared model instance.
+    """
+    key = model_key(model_name, adapter_path, backend)
+    if key not in _models:
+        # Imported here so that merely importing the registry does not load torch
+        from src.model import ItriModel
+
+        _models[key] = ItriModel(model_name, adapter_path, backend=backend, **kwargs)
+    return _models[key]
+
+
+def get_base_model(model_name: str, backend: str = None):
+    """
+    Return a model whose base weights can be used without any adapter.
+
+    A loaded adapter-free model is preferred, then any loaded model of the same
+    base and quantization whose (unmerged) adapter can be disabled. Only if
+    neither exists is a new base model loaded. Use the result inside
+    `with model.adapter_disabled():`.
+
+    Args:
+        model_name (str): Name of the base model.
+        backend (str, optional): Backend passed to `ItriModel`. Defaults to None.
+
+    Returns:
+        ItriModel: The shared model instance.
+    """
+    name, quantization, _ = key = model_key(model_name, None, backend)
+    if key in _models:
+        return _models[key]
+
+    for (other_name, other_quantization, _), model in _models.items():
+        if other_name == name and other_quantization == quantization and model.can_disable_adapter:
+            return model
+
+    return get_model(model_name, backend=backend)
+
+
+def loaded_models():
+    """Return the registry keys of all loaded models."""
+    return list(_models)
+
+
+def clear():
+    """Drop every model from the registry so it can be garbage collected."""
+    _models.clear()
@@ -0,0 +1,72 @@
+import hashlib
+
+import torch
+from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+
+
+def row_seed(seed: int, token_ids: list, index: int = 0):
+    """
+    Derive the random stream of one generated sequence.
+
+    Args:
+        seed (int): The run's seed.
+        token_ids (list[int]): The prompt's token ids, without padding.
+        index (int): Which of the prompt's returned sequences the row is. Defaults to 0.
+
+    Returns:
+        int: A non-negative 63-bit seed.
+    """
+    digest = hashlib.sha256(f"{seed}:{index}:{','.join(map(str, token_ids))}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") >> 1
+
+
+class RowSeededSampler:
+    """
+    Samples each row's next token from a random stream of its own.
+
+    Follows the transformers LogitsProcessor protocol. `generate` draws the
+    tokens of all rows from the global generator, so under a fixed seed a
+    prompt's output would depend on its batch mates and row position. Here
+    a row's draw at each step is seeded by its row seed and the number of
+    tokens it has generated, so seeded output depends only on the prompt
+    and the settings. Temperature, top-k and top-p are applied here, and
+    the returned scores allow only the drawn token. It must therefore be
+    the last processor, and `generate` must run without its own warpers.
+    """
+
+    def __init__(self, seeds: list, prompt_length: int, temperature: float = None, top_k: int = None,
+                 top_p: float = None):
+        """
+        Args:
+            seeds (list[int]): Seed of each row, from `row_seed`.
+            prompt_length (int): Number of (padded) prompt tokens preceding the generated ones.
+            temperature (float, optional): Sampling temperature. Defaults to None (1.0).
+            top_k (int, optional): Sample only among the top-k tokens. Defaults to None (all).
+            top_p (float, optional): Nucleus sampling mass. Defaults to None (1.0).
+        """
+        self.seeds = seeds
+        self.prompt_length = prompt_length
+        warpers = []
+        if temperature is not None and temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if top_k:
+            warpers.append(TopKLogitsWarper(top_k))
+        if top_p is not None and top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p))
+        self.warpers = LogitsProcessorList(warpers)
+        self._generator = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        probs = torch.softmax(self.warpers(input_ids, scores).float(), dim=-1)
+        if self._generator is None or self._generator.device != probs.device:
+            self._generator = torch.Generator(device=probs.device)
+
+        step = input_ids.shape[1] - self.prompt_length
+        tokens = []
+        for row, seed in enumerate(self.seeds):
+            # Seeding by step rather than drawing on keeps every draw independent of the other rows
+            self._generator.manual_seed(row_seed(seed, [step]))
+            tokens.append(torch.multinomial(probs[row], 1, generator=self._generator))
+
+        drawn = torch.full_like(scores, float("-inf"))
+        return drawn.scatter_(1, torch.stack(tokens), 0.0)
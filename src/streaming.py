@@ -0,0 +1,76 @@
+import time
+from threading import Thread
+from transformers import TextIteratorStreamer
+
+
+class TimedTextStreamer(TextIteratorStreamer):
+    """A TextIteratorStreamer that skips the prompt and records when each new token arrives."""
+
+    def __init__(self, tokenizer, timeout: float = None):
+        super().__init__(tokenizer, skip_prompt=True, timeout=timeout, skip_special_tokens=True)
+        self.token_times = []
+
+    def put(self, value):
+        """Record the arrival time of generated tokens before queueing their text."""
+        if not (self.skip_prompt and self.next_tokens_are_prompt):
+            # Assisted decoding can emit several accepted tokens in one step
+            self.token_times.extend([time.perf_counter()] * value.numel())
+        super().put(value)
+
+
+class GenerationStream:
+    """Iterates over the text increments of a generation running in a background thread."""
+
+    def __init__(self, generate_fn, streamer: TimedTextStreamer):
+        """
+        Start `generate_fn` in a background thread.
+
+        Args:
+            generate_fn (callable): Runs the generation, writing tokens to `streamer`.
+            streamer (TimedTextStreamer): The streamer passed to the generation.
+        """
+        self.streamer = streamer
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self._error = None
+        self._thread = Thread(target=self._run, args=(generate_fn,), daemon=True)
+        self._thread.start()
+
+    def _run(self, generate_fn):
+        try:
+            generate_fn()
+        except Exception as e:
+            self._error = e
+            # Unblock the consumer, which re-raises the error
+            self.streamer.end()
+
+    def __iter__(self):
+        for text in self.streamer:
+            if text:
+                yield text
+        self._thread.join()
+        self.end_time = time.perf_counter()
+        if self._error is not None:
+            raise self._error
+
+    def stats(self) -> dict:
+        """
+        Latency statistics for the tokens received so far.
+
+        Returns:
+            dict: Token count, time to first token, mean/max inter-token latency,
+                total time and decode throughput, all times in seconds.
+        """
+        token_times = self.streamer.token_times
+        gaps = [later - earlier for earlier, later in zip(token_times, token_times[1:])]
+        end_time = self.end_time or time.perf_counter()
+        decode_time = token_times[-1] - token_times[0] if len(token_times) > 1 else 0.0
+
+        return {
+            "tokens": len(token_times),
+            "time_to_first_token": token_times[0] - self.start_time if token_times else None,
+            "mean_inter_token_latency": sum(gaps) / len(gaps) if gaps else None,
+            "max_inter_token_latency": max(gaps) if gaps else None,
+            "total_time": end_time - self.start_time,
+            "tokens_per_second": (len(token_times) - 1) / decode_time if decode_time else None,
+        }
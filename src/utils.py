@@ -1,6 +1,5 @@
 import os
 import json
-import pandas as pd
 
 
 def read_csv_file(file_path, num_rows=5):
@@ -14,6 +13,8 @@ def read_csv_file(file_path, num_rows=5):
     Returns:
     - pd.DataFrame: DataFrame containing the first `num_rows` rows of the CSV.
     """
+    import pandas as pd
+
     try:
         df = pd.read_csv(file_path, nrows=num_rows)
     except FileNotFoundError:
@@ -0,0 +1,88 @@
+"""
+Shared fixtures: a tiny randomly initialized Llama built locally, so the model tests run offline.
+
+The benchmarks build the same model with `build_tiny_model`.
+"""
+import random
+
+import pytest
+
+from prompt.prompt_manager import PromptManager
+
+WORDS = (
+    "telomerase activity cells patients expression cancer treatment cadmium exposure study results "
+    "protein gene levels associated increased reduced significantly analysis samples clinical "
+    "mice tumor growth pathway response risk population cohort method measured compared"
+).split()
+
+
+def synthetic_abstract(num_words: int, rng: random.Random):
+    """A deterministic abstract-like text of `num_words` words."""
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < num_words:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def build_tiny_model(path: str, hidden_size: int = 64, num_layers: int = 2, vocab_size: int = 1000, seed: int = 0):
+    """
+    Save a randomly initialized Llama and a locally trained tokenizer to `path`.
+
+    Args:
+        path (str): Output directory, loadable as an `ItriModel` model name.
+        hidden_size (int): Model width. Defaults to 64.
+        num_layers (int): Decoder layers. Defaults to 2.
+        vocab_size (int): BPE vocabulary size. Defaults to 1000.
+        seed (int): Seed for the weights and the training text. Defaults to 0.
+
+    Returns:
+        str: `path`.
+    """
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    # Train on the real template so prompts tokenize to realistic lengths
+    rng = random.Random(seed)
+    template = PromptManager().render_prompt("llama3.2.j2", {"abstract": ""})
+    texts = [template] + [synthetic_abstract(200, rng) for _ in range(50)]
+    texts += ['{"question": "What was measured?", "answer": "Telomerase activity."}'] * 20
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(texts, trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<unk>", "<s>", "</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A", special_tokens=[("<s>", tokenizer.token_to_id("<s>"))]
+    )
+    hf_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+    hf_tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(hf_tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        bos_token_id=hf_tokenizer.bos_token_id,
+        eos_token_id=hf_tokenizer.eos_token_id,
+    )
+    LlamaForCausalLM(config).save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """Directory of the tiny Llama and its tokenizer, built once per test session."""
+    pytest.importorskip("torch")
+    return build_tiny_model(str(tmp_path_factory.mktemp("tiny_llama")))
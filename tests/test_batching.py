@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import src.conf as conf
+from src.batching import ContinuousBatcher
+from src.model import ItriModel
+
+# (prompt, max_new_tokens, step before which it is submitted)
+REQUESTS = [
+    ("Cadmium exposure and telomere length in adults", 12, 0),
+    ("A short one", 5, 0),
+    ("Telomerase activity in cancer cells was measured in a large cohort of patients", 9, 2),
+    ("Short", 14, 3),
+    ("Blood lead levels", 3, 3),
+    ("Oxidative stress markers were higher in exposed workers than in controls", 7, 8),
+]
+GREEDY = {"do_sample": False, "num_beams": 1, "early_stopping": False, "stop_at_qa_json": False,
+          "constrain_qa_json": False, "temperature": None, "top_k": None, "top_p": None}
+
+
+@pytest.fixture(scope="module")
+def model(tiny_model_dir):
+    cpu_config = dict(conf.cpu_backend_config)
+    conf.cpu_backend_config.update(quantize_dynamic=False, dtype="float32", static_cache=False, compile=False)
+    try:
+        yield ItriModel(tiny_model_dir, backend="cpu")
+    finally:
+        conf.cpu_backend_config.update(cpu_config)
+
+
+def run_step(batcher):
+    """One iteration of the batcher's decoding loop, run on this thread."""
+    batcher._drop_cancelled()
+    batcher._admit()
+    if batcher._running:
+        batcher._step()
+
+
+def test_staggered_requests_match_generate_batch(model):
+    expected = [
+        model.generate_batch([prompt], batch_size=1, max_new_tokens=max_new_tokens, **GREEDY)[0]
+        for prompt, max_new_tokens, _ in REQUESTS
+    ]
+
+    batcher = ContinuousBatcher(model, max_batch_tokens=10000, max_batch_size=8, stop_at_qa_json=False)
+    futures = [None] * len(REQUESTS)
+    step = 0
+    while step < 100 and not all(future is not None and future.done() for future in futures):
+        # New requests join a batch whose rows are at different lengths, and finished rows leave mid-decode
+        for index, (prompt, max_new_tokens, submit_step) in enumerate(REQUESTS):
+            if submit_step == step:
+                futures[index] = batcher.submit(prompt, max_new_tokens=max_new_tokens)
+        run_step(batcher)
+        step += 1
+
+    assert [future.result()["text"] for future in futures] == expected
+    assert batcher.stats()["running"] == 0 and batcher.stats()["completed"] == len(REQUESTS)
+
+
+def test_cancelled_request_leaves_the_others_intact(model):
+    prompts = [prompt for prompt, _, _ in REQUESTS[:3]]
+    expected = model.generate_batch(prompts, batch_size=1, max_new_tokens=10, **GREEDY)
+
+    batcher = ContinuousBatcher(model, max_batch_tokens=10000, max_batch_size=8, stop_at_qa_json=False)
+    futures = [batcher.submit(prompt, max_new_tokens=10) for prompt in prompts]
+    cancelled = batcher.submit("A request that is cancelled while it decodes", max_new_tokens=10)
+    for _ in range(3):
+        run_step(batcher)
+    cancelled.cancel()
+    while not all(future.done() for future in futures):
+        run_step(batcher)
+
+    assert [future.result()["text"] for future in futures] == expected
+    assert batcher.stats()["cancelled"] == 1
+
+
+def test_background_thread_serves_concurrent_requests(model):
+    prompts = [prompt for prompt, _, _ in REQUESTS]
+    expected = model.generate_batch(prompts, batch_size=1, max_new_tokens=6, **GREEDY)
+
+    batcher = ContinuousBatcher(model, max_batch_tokens=10000, max_batch_size=3, stop_at_qa_json=False).start()
+    try:
+        futures = [batcher.submit(prompt, max_new_tokens=6) for prompt in prompts]
+        assert [future.result(timeout=60)["text"] for future in futures] == expected
+    finally:
+        batcher.stop()
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("optimum.onnxruntime")
+
+import src.conf as conf
+from src.checkpoints import export_onnx
+from src.model import ItriModel
+
+PROMPTS = [
+    "Cadmium exposure and telomere length",
+    "A short one",
+    "Telomerase activity in cancer cells was measured in a large cohort",
+]
+GREEDY = {"do_sample": False, "num_beams": 1, "max_new_tokens": 16, "stop_at_qa_json": False,
+          "constrain_qa_json": False}
+
+
+@pytest.fixture(scope="module")
+def models(tiny_model_dir, tmp_path_factory):
+    export_dir = export_onnx(tiny_model_dir, root=str(tmp_path_factory.mktemp("onnx")), quantize=True)
+
+    cpu_config = dict(conf.cpu_backend_config)
+    onnx_config = dict(conf.onnx_backend_config)
+    conf.cpu_backend_config.update(quantize_dynamic=False, dtype="float32", static_cache=False, compile=False)
+    conf.onnx_backend_config["quantized"] = False
+    try:
+        yield ItriModel(tiny_model_dir, backend="cpu"), ItriModel(export_dir, backend="onnx"), export_dir
+    finally:
+        conf.cpu_backend_config.update(cpu_config)
+        conf.onnx_backend_config.update(onnx_config)
+
+
+def test_greedy_outputs_match_pytorch(models):
+    torch_model, onnx_model, _ = models
+    assert onnx_model.generate_batch(PROMPTS, batch_size=3, **GREEDY) == \
+        torch_model.generate_batch(PROMPTS, batch_size=3, **GREEDY)
+
+
+def test_beam_search_outputs_match_pytorch(models):
+    torch_model, onnx_model, _ = models
+    settings = {**GREEDY, "num_beams": 3}
+    assert onnx_model.generate_batch(PROMPTS, batch_size=2, **settings) == \
+        torch_model.generate_batch(PROMPTS, batch_size=2, **settings)
+
+
+def test_continuation_scores_match_pytorch(models):
+    torch_model, onnx_model, _ = models
+    continuations = [" method", " knowledge", " discussion"]
+    expected = torch_model.score_continuations(PROMPTS, continuations)
+    actual = onnx_model.score_continuations(PROMPTS, continuations)
+    # The PyTorch model gains a [PAD] row in its vocabulary, which shifts log-softmax slightly
+    for expected_row, actual_row in zip(expected, actual):
+        assert actual_row == pytest.approx(expected_row, abs=1e-2)
+
+
+def test_quantized_export_generates(models):
+    _, _, export_dir = models
+    conf.onnx_backend_config["quantized"] = True
+    try:
+        model = ItriModel(export_dir, backend="onnx")
+    finally:
+        conf.onnx_backend_config["quantized"] = False
+    assert model.quantization == "onnx-int8"
+    assert len(model.generate_batch(PROMPTS, batch_size=3, **GREEDY)) == len(PROMPTS)
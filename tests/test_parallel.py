@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+
+from src.parallel import run_sharded
+
+CRASH_ITEM = 13
+
+
+def init_state(marker_path):
+    return marker_path
+
+
+def square_or_crash(marker_path, items):
+    """Square the items; the first worker to reach CRASH_ITEM dies halfway through its shard."""
+    results = []
+    for item in items:
+        if item == CRASH_ITEM and not os.path.exists(marker_path):
+            open(marker_path, "w").close()
+            os._exit(3)
+        results.append(item * item)
+    return results
+
+
+def test_crashed_shard_is_reassigned_and_results_stay_in_order(tmp_path):
+    items = list(range(40))
+    emitted = []
+    results = run_sharded(items, square_or_crash, 2, init_fn=init_state, init_args=(str(tmp_path / "crashed"),),
+                          shard_size=5, show_progress=False, on_results=emitted.append)
+
+    assert (tmp_path / "crashed").exists()
+    assert results == [item * item for item in items]
+    # Every shard reaches on_results exactly once, in input order
+    assert [result for shard in emitted for result in shard] == results
+    assert [len(shard) for shard in emitted] == [5] * 8
+
+
+def always_crash(state, items):
+    if CRASH_ITEM in items:
+        os._exit(3)
+    return items
+
+
+def test_shard_that_keeps_crashing_raises():
+    with pytest.raises(RuntimeError, match="crashed its worker"):
+        run_sharded(list(range(20)), always_crash, 1, shard_size=5, max_retries=1, show_progress=False)
@@ -0,0 +1,148 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from src.qa_decoding import QAJsonLogitsProcessor, QAJsonStoppingCriteria
+from src.qa_json import QAGrammar, extract_qa
+
+
+class CharTokenizer:
+    """One token per character of a fixed alphabet, plus an end-of-sequence token."""
+
+    def __init__(self, alphabet):
+        self.vocab = ["</s>"] + list(alphabet)
+        self.ids = {text: token_id for token_id, text in enumerate(self.vocab)}
+        self.eos_token_id = 0
+        self.all_special_ids = [0]
+        self.name_or_path = f"char-tokenizer-{len(self.vocab)}"
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def encode(self, text):
+        return [self.ids[char] for char in text]
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return "".join(self.vocab[token_id] for token_id in token_ids
+                       if not (skip_special_tokens and token_id in self.all_special_ids))
+
+    def batch_decode(self, rows, skip_special_tokens=False):
+        return [self.decode(row.tolist(), skip_special_tokens) for row in rows]
+
+
+QA_TEXT = '{"question": "Why?", "answer": "A {b}."}'
+TOKENIZER = CharTokenizer(sorted(set(QA_TEXT + "xyz\\\n")))
+PROMPT = "xy"
+
+
+def ids(text):
+    return torch.tensor([TOKENIZER.encode(text)])
+
+
+def test_stops_after_closing_brace():
+    criteria = QAJsonStoppingCriteria(TOKENIZER, len(PROMPT))
+    text = PROMPT + QA_TEXT
+    # The brace inside the answer does not close the object
+    for end in range(len(PROMPT) + 1, len(text)):
+        assert not criteria(ids(text[:end]), None).item()
+    assert criteria(ids(text), None).item()
+
+
+def test_stops_when_several_tokens_are_accepted_at_once():
+    # Assisted decoding can accept the closing brace and further draft tokens in one step
+    criteria = QAJsonStoppingCriteria(TOKENIZER, len(PROMPT))
+    assert not criteria(ids(PROMPT + QA_TEXT[:10]), None).item()
+    assert criteria(ids(PROMPT + QA_TEXT + "xyz"), None).item()
+
+
+def run_processor(processor, ranking, steps):
+    """Decode greedily under the processor, preferring tokens in `ranking` order; returns the new text."""
+    input_ids = ids(PROMPT)
+    scores = torch.zeros(1, len(TOKENIZER))
+    for rank, text in enumerate(ranking):
+        scores[0, TOKENIZER.ids[text]] = len(ranking) - rank
+    for _ in range(steps):
+        next_id = processor(input_ids, scores.clone()).argmax(-1, keepdim=True)
+        input_ids = torch.cat([input_ids, next_id], dim=1)
+        if next_id.item() == TOKENIZER.eos_token_id:
+            break
+    return TOKENIZER.decode(input_ids[0, len(PROMPT):].tolist(), skip_special_tokens=True)
+
+
+def test_grammar_accepts_escapes_and_braces_in_strings():
+    grammar = QAGrammar()
+    text = r'{"question": "What is \"{x}\"?", "answer": "a\\b} {"}'
+    state = grammar.advance(grammar.initial_state, text)
+    assert grammar.is_complete(state)
+    assert extract_qa(text) == {"question": 'What is "{x}"?', "answer": "a\\b} {"}
+
+
+def test_grammar_rejects_raw_control_characters_and_bad_escapes():
+    grammar = QAGrammar()
+    assert grammar.advance(grammar.initial_state, '{"question": "a\nb') is None
+    assert grammar.advance(grammar.initial_state, '{"question": "a\\x') is None
+    assert grammar.advance(grammar.initial_state, '{"question": "a\\n') is not None
+    # Both strings must be non-empty
+    assert grammar.advance(grammar.initial_state, '{"question": ""') is None
+
+
+def test_masks_follow_the_grammar_state():
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT))
+    allowed = processor(ids(PROMPT + '{"question": "a'), torch.zeros(1, len(TOKENIZER))) > float("-inf")
+    assert allowed[0, TOKENIZER.ids["x"]] and allowed[0, TOKENIZER.ids["{"]] and allowed[0, TOKENIZER.ids['"']]
+    assert not allowed[0, TOKENIZER.ids["\n"]] and not allowed[0, TOKENIZER.eos_token_id]
+
+    escaped = processor(ids(PROMPT + '{"question": "a\\'), torch.zeros(1, len(TOKENIZER))) > float("-inf")
+    assert {TOKENIZER.vocab[i] for i in escaped[0].nonzero().flatten().tolist()} <= set(QAGrammar.ESCAPES)
+
+
+def test_masks_are_cached_per_state_signature():
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT))
+    scores = torch.zeros(1, len(TOKENIZER))
+    processor(ids(PROMPT + '{"question": "ab'), scores)
+    cached = dict(processor.vocab.masks)
+    # A longer string in the same segment has the same signature and reuses the mask
+    processor(ids(PROMPT + '{"question": "ababab'), scores)
+    assert processor.vocab.masks.keys() == cached.keys()
+    assert all(processor.vocab.masks[key] is mask for key, mask in cached.items())
+
+
+def test_only_eos_is_allowed_after_the_closing_brace():
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT))
+    allowed = processor(ids(PROMPT + QA_TEXT), torch.zeros(1, len(TOKENIZER))) > float("-inf")
+    assert allowed[0].nonzero().flatten().tolist() == [TOKENIZER.eos_token_id]
+
+
+def test_forced_completion_closes_the_object_within_the_budget():
+    minimal = len('{"question": "x", "answer": "x"}')
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT), max_new_tokens=minimal + 6)
+    # The preferred token never closes a string, so only forcing can finish the object
+    text = run_processor(processor, ["x", '"'], minimal + 6)
+    assert extract_qa(text) is not None
+    assert len(text) <= minimal + 6
+
+
+def test_unconstrained_budget_keeps_extending_strings():
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT))
+    text = run_processor(processor, ["x", '"'], 40)
+    assert text.startswith('{"question": "xxx') and extract_qa(text) is None
+
+
+def grammar_states(processor):
+    return [progress.history[-1][0] for progress in processor._rows]
+
+
+def test_row_states_follow_reordered_and_rolled_back_rows():
+    processor = QAJsonLogitsProcessor(TOKENIZER, len(PROMPT))
+    grammar = processor.grammar
+    texts = ['{"question": "ab', '{"question": "a\\']
+    scores = torch.zeros(2, len(TOKENIZER))
+    processor(torch.cat([ids(PROMPT + text) for text in texts]), scores)
+
+    # Beam search swaps the rows and both continue the escaped one
+    processor(torch.cat([ids(PROMPT + texts[1] + '"'), ids(PROMPT + texts[1] + "n")]), scores)
+    assert grammar_states(processor) == [grammar.advance(grammar.initial_state, texts[1] + end) for end in '"n']
+
+    # Rejected draft tokens are replaced by a different one
+    processor(ids(PROMPT + '{"question": "x'), scores[:1])
+    assert grammar_states(processor) == [grammar.advance(grammar.initial_state, '{"question": "x')]
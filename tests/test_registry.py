@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("peft")
+
+import src.conf as conf
+from src import registry
+from src.model import ItriModel
+
+PROMPTS = ["Cadmium exposure and telomere length", "A short one"]
+GREEDY = {"do_sample": False, "num_beams": 1, "max_new_tokens": 8, "stop_at_qa_json": False,
+          "constrain_qa_json": False, "temperature": None, "top_k": None, "top_p": None}
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tiny_model_dir, tmp_path_factory):
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+
+    adapter_dir = str(tmp_path_factory.mktemp("adapter"))
+    # Random B matrices, so the adapter changes the outputs
+    lora_config = LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    get_peft_model(AutoModelForCausalLM.from_pretrained(tiny_model_dir), lora_config).save_pretrained(adapter_dir)
+
+    cpu_config = dict(conf.cpu_backend_config)
+    conf.cpu_backend_config.update(quantize_dynamic=True, static_cache=False, compile=False)
+    registry.clear()
+    try:
+        yield tiny_model_dir, adapter_dir
+    finally:
+        registry.clear()
+        conf.cpu_backend_config.update(cpu_config)
+
+
+def test_base_model_reuses_the_quantized_adapter_model(tiny_model):
+    model_dir, adapter_dir = tiny_model
+    model_qa = registry.get_model(model_dir, adapter_dir, backend="cpu")
+    assert model_qa.can_disable_adapter
+    assert registry.get_base_model(model_dir, backend="cpu") is model_qa
+    assert len(registry.loaded_models()) == 1
+
+    with model_qa.adapter_disabled():
+        disabled = model_qa.generate_batch(PROMPTS, batch_size=2, **GREEDY)
+    base = ItriModel(model_dir, backend="cpu")
+    assert disabled == base.generate_batch(PROMPTS, batch_size=2, **GREEDY)
+    assert model_qa.generate_batch(PROMPTS, batch_size=2, **GREEDY) != disabled
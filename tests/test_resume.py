@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+pytest.importorskip("jsonlines")
+
+from generate_QA import completed_dois, write_results
+
+
+def records(doi, num_qa):
+    return [{"doi": doi, "QA": {"question": f"Q{index}?", "answer": "A."}, "qa_index": index}
+            for index in range(num_qa)]
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_partial_last_line_is_removed(tmp_path):
+    output_path = tmp_path / "output.jsonl"
+    with open(output_path, "wb") as f:
+        write_results(f, records("10.1/a", 2) + records("10.1/b", 2))
+        f.write(b'{"doi": "10.1/c", "QA": {"quest')
+
+    assert completed_dois(str(output_path)) == {"10.1/a", "10.1/b"}
+    assert read_lines(output_path) == records("10.1/a", 2) + records("10.1/b", 2)
+    # Nothing left to remove the second time
+    assert completed_dois(str(output_path)) == {"10.1/a", "10.1/b"}
+
+
+def test_all_records_of_a_chunk_are_written_at_once(tmp_path):
+    class RecordingFile:
+        def __init__(self):
+            self.writes = []
+
+        def write(self, data):
+            self.writes.append(data)
+
+        def flush(self):
+            pass
+
+    output_file = RecordingFile()
+    write_results(output_file, records("10.1/a", 3) + records("10.1/b", 3))
+    # A crash cannot fall between the Q&A sets of one abstract
+    assert len(output_file.writes) == 1
+    assert output_file.writes[0].count(b"\n") == 6
+
+
+def test_resume_appends_after_the_complete_records(tmp_path):
+    output_path = tmp_path / "output.jsonl"
+    with open(output_path, "wb") as f:
+        write_results(f, records("10.1/a", 3))
+        # Crash while writing the next chunk
+        f.write(json.dumps(records("10.1/b", 3)[0]).encode("utf-8")[:20])
+
+    done = completed_dois(str(output_path))
+    remaining = [doi for doi in ("10.1/a", "10.1/b") if doi not in done]
+    assert remaining == ["10.1/b"]
+    with open(output_path, "ab") as f:
+        write_results(f, records("10.1/b", 3))
+
+    assert read_lines(output_path) == records("10.1/a", 3) + records("10.1/b", 3)
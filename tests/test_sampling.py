@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import src.conf as conf
+from src.cache import GenerationCache
+from src.model import ItriModel
+
+PROMPT = "Cadmium exposure and telomere length in adults"
+SAMPLED = {"seed": 7, "do_sample": True, "num_beams": 1, "early_stopping": False, "max_new_tokens": 12,
+           "stop_at_qa_json": False}
+
+
+@pytest.fixture(scope="module")
+def model(tiny_model_dir):
+    cpu_config = dict(conf.cpu_backend_config)
+    conf.cpu_backend_config.update(quantize_dynamic=False, dtype="float32", static_cache=False, compile=False)
+    try:
+        yield ItriModel(tiny_model_dir, backend="cpu")
+    finally:
+        conf.cpu_backend_config.update(cpu_config)
+
+
+def test_seeded_sample_does_not_depend_on_the_batch(model):
+    alone = model.generate_batch([PROMPT], **SAMPLED)[0]
+    # A prompt of the same length, so the only difference is the row position and batch mate
+    same_length = model.tokenizer.decode(model.tokenizer(PROMPT)["input_ids"][1:][::-1])
+    assert len(model.tokenizer(same_length)["input_ids"]) == len(model.tokenizer(PROMPT)["input_ids"])
+
+    assert model.generate_batch([same_length, PROMPT], **SAMPLED)[1] == alone
+    assert model.generate_batch(["A longer prompt about blood lead levels in children", PROMPT], **SAMPLED)[1] == alone
+    assert model.generate_batch([PROMPT], **{**SAMPLED, "seed": 8})[0] != alone
+
+
+def test_seeded_candidates_are_distinct_and_independent_of_the_batch(model):
+    candidates = model.generate_candidates([PROMPT], 3, **SAMPLED)[0]
+    assert len(set(candidates)) == 3
+    assert model.generate_candidates(["Blood lead levels", PROMPT], 3, **SAMPLED)[1] == candidates
+
+
+def test_cache_skips_sampling_that_depends_on_the_batch(model, tmp_path):
+    cache = GenerationCache(path=str(tmp_path / "cache.sqlite"))
+    assert cache.settings_for(model, {"seed": 7, "num_beams": 1}) is not None
+    # The default settings sample with beam search
+    assert cache.settings_for(model, {"seed": 7}) is None
+    assert cache.settings_for(model, {"num_beams": 1}) is None
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+pytest.importorskip("jsonlines")
+
+from generate_QA import read_worker_summaries, run_stats_from_summaries, worker_summary_files
+
+
+def write_summary(path, counters, timers):
+    with open(path, "w") as f:
+        json.dump({"counters": counters, "timers": {name: {"seconds": seconds} for name, seconds in timers.items()}}, f)
+
+
+def test_run_stats_add_up_this_runs_worker_summaries(tmp_path):
+    root = str(tmp_path / "run.json")
+    write_summary(tmp_path / "run.worker1.json", {"pipeline.cascade_small_abstracts": 50}, {})
+    before = worker_summary_files(root)
+
+    write_summary(tmp_path / "run.worker2.json", {
+        "pipeline.cascade_small_abstracts": 4, "pipeline.cascade_large_abstracts": 1,
+        "pipeline.cascade_rejected_ungrounded_answer": 2, "model.draft_new_tokens": 30,
+    }, {"pipeline.generate_small": 2.0, "pipeline.generate_large": 1.5})
+    write_summary(tmp_path / "run.worker3.json", {
+        "pipeline.cascade_small_abstracts": 3, "pipeline.cascade_rejected_ungrounded_answer": 1,
+        "pipeline.cascade_rejected_too_short": 1, "model.draft_new_tokens": 12,
+    }, {"pipeline.generate_small": 1.0})
+
+    # The first file belongs to an earlier run
+    cascade_stats, draft_counters = run_stats_from_summaries(read_worker_summaries(root, before))
+    assert cascade_stats["tiers"] == {"small": {"abstracts": 7, "seconds": 3.0},
+                                      "large": {"abstracts": 1, "seconds": 1.5}}
+    assert cascade_stats["rejections"] == {"ungrounded_answer": 3, "too_short": 1}
+    assert draft_counters == {"generations": 0, "new_tokens": 42, "target_forwards": 0, "draft_forwards": 0}
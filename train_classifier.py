@@ -0,0 +1,27 @@
+import argparse
+import src.conf as conf
+from src.category_classifier import CategoryClassifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the QA category classifier used by generate_QA.py")
+    parser.add_argument("--data_paths", type=str, nargs="+",
+                        default=["utils/submit_QA_sample/qa_database_updated.jsonl"],
+                        help="JSONL files of labelled QA pairs from the submission tool")
+    parser.add_argument("--output_dir", type=str, default=conf.category_classifier_path,
+                        help="Directory for versioned classifiers")
+    parser.add_argument("--n_features", type=int, default=2 ** 18, help="Size of the hashed n-gram feature space")
+    args = parser.parse_args()
+
+    classifier = CategoryClassifier.train(args.data_paths, n_features=args.n_features)
+    metadata = classifier.metadata
+    accuracy = f"{metadata['cv_accuracy']:.1%}" if metadata["cv_accuracy"] is not None else "n/a"
+    print(f"Trained on {metadata['num_examples']} QA pairs {metadata['label_counts']}, "
+          f"cross-validated accuracy {accuracy}")
+
+    save_dir = classifier.save(args.output_dir)
+    print(f"Saved category classifier to {save_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import os
 import yaml
-from pymongo import MongoClient
 
 def save_to_mongodb(df, db_name, collection_name, cluster_uri=None):
     """
@@ -12,6 +11,9 @@ def save_to_mongodb(df, db_name, collection_name, cluster_uri=None):
         collection_name (str): Name of the MongoDB collection.
         cluster_uri (str, optional): MongoDB connection URI for a cluster. Defaults to localhost.
     """
+    # MongoDB is only needed for this output, not for writing YAML
+    from pymongo import MongoClient
+
     if cluster_uri is None:
         cluster_uri = "mongodb://localhost:27017/"
 
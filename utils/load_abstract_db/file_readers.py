@@ -1,6 +1,4 @@
 import os
-from pybtex.database import parse_string
-import pandas as pd
 import json
 import yaml
 
@@ -15,6 +13,10 @@ def read_bib_file(bib_file):
     Returns:
         pd.DataFrame: DataFrame containing BibTeX entries.
     """
+    # BibTeX parsing and DataFrames are only needed here, not for reading YAML
+    from pybtex.database import parse_string
+    import pandas as pd
+
     if not os.path.exists(bib_file):
         raise FileNotFoundError(f"The file {bib_file} does not exist.")
 